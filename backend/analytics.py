@@ -0,0 +1,188 @@
+"""
+Circulation analytics: daily rollups of checkouts and returns, and the
+vectorized aggregation that answers ad-hoc date ranges from them
+Rollup rows are computed here from raw loans; server.py stores them, keeps
+them current with a background job and reads them back for /api/analytics
+
+    circulation_daily       day, grade, genre -> checkouts, returns, loan_seconds
+    book_circulation_daily  day, book_id -> checkouts
+    book_circulation_monthly  month, book_id -> checkouts (from the daily rows)
+
+Checkouts count on the day of checkout_date and returns on the day of
+return_date (UTC). Grade and genre are taken when the day is rolled up.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+UNKNOWN = "unknown"
+SECONDS_PER_DAY = 86400
+
+LOAN_COLUMNS = ["book_id", "member_id", "checkout_date", "return_date"]
+CIRCULATION_COLUMNS = ["day", "grade", "genre", "checkouts", "returns", "loan_seconds"]
+BOOK_COLUMNS = ["day", "book_id", "genre", "checkouts"]
+
+INTERVALS = {"day": "D", "week": "W-SUN", "month": "M"}
+GROUPS = ("grade", "genre")
+
+
+def day_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, moment.day)
+
+
+def month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+
+def next_month(moment: datetime) -> datetime:
+    return datetime(moment.year + moment.month // 12, moment.month % 12 + 1, 1)
+
+
+def split_months(start: datetime, end: datetime) -> Tuple[Optional[tuple], List[tuple]]:
+    """
+    Split [start, end) into the whole months it covers and the leftover days
+    on either side, so long ranges read one row per book and month
+    """
+    first = start if start == month_start(start) else next_month(start)
+    last = month_start(end)
+    if first >= last:
+        return None, [(start, end)]
+    days = [(low, high) for low, high in ((start, first), (last, end)) if low < high]
+    return (first, last), days
+
+
+def frame(rows: List[dict], columns: List[str]) -> pd.DataFrame:
+    # Explicit columns so that an empty range still aggregates to empty results
+    result = pd.DataFrame.from_records(rows, columns=columns)
+    for column in ("day", "checkout_date", "return_date"):
+        if column in result:
+            result[column] = pd.to_datetime(result[column])
+    return result
+
+
+def records(table: pd.DataFrame) -> List[dict]:
+    """Rows as plain Python values that BSON can encode"""
+    columns = {}
+    for name in table.columns:
+        if pd.api.types.is_datetime64_any_dtype(table[name]):
+            columns[name] = [value.to_pydatetime() for value in table[name]]
+        else:
+            columns[name] = table[name].tolist()
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+def daily_rollups(
+    loans: List[dict], grades: Dict[str, str], genres: Dict[str, str], since: Optional[datetime]
+) -> Tuple[List[dict], List[dict]]:
+    """Circulation and per-book rows for every day from since on"""
+    loans = frame(loans, LOAN_COLUMNS)
+    loans["grade"] = loans["member_id"].map(grades).fillna(UNKNOWN)
+    loans["genre"] = loans["book_id"].map(genres).fillna(UNKNOWN)
+    if since is not None:
+        checkouts = loans[loans["checkout_date"] >= since]
+        # NaT compares False, so open loans drop out here
+        returns = loans[loans["return_date"] >= since]
+    else:
+        checkouts = loans
+        returns = loans[loans["return_date"].notna()]
+
+    checkout_day = checkouts["checkout_date"].dt.floor("D").rename("day")
+    checkout_counts = checkouts.groupby([checkout_day, "grade", "genre"]).size().rename("checkouts")
+    returned = pd.DataFrame({
+        "day": returns["return_date"].dt.floor("D"),
+        "grade": returns["grade"],
+        "genre": returns["genre"],
+        "loan_seconds": (returns["return_date"] - returns["checkout_date"]).dt.total_seconds(),
+    })
+    return_totals = returned.groupby(["day", "grade", "genre"])["loan_seconds"].agg(["size", "sum"])
+    return_totals.columns = ["returns", "loan_seconds"]
+
+    circulation = pd.concat([checkout_counts, return_totals], axis=1).fillna(0).reset_index()
+    circulation = circulation.astype({"checkouts": np.int64, "returns": np.int64, "loan_seconds": np.float64})
+    circulation.insert(
+        0, "_id",
+        circulation["day"].dt.strftime("%Y-%m-%d") + "|" + circulation["grade"] + "|" + circulation["genre"]
+    )
+
+    books = checkouts.groupby([checkout_day, "book_id", "genre"]).size().rename("checkouts").reset_index()
+    books.insert(0, "_id", books["day"].dt.strftime("%Y-%m-%d") + "|" + books["book_id"])
+    return records(circulation[["_id"] + CIRCULATION_COLUMNS]), records(books[["_id"] + BOOK_COLUMNS])
+
+
+def monthly_book_rollups(rows: List[dict]) -> List[dict]:
+    """Fold per-book daily rows into per-book monthly rows"""
+    books = frame(rows, BOOK_COLUMNS)
+    month = books["day"].dt.to_period("M").dt.start_time.rename("month")
+    monthly = books.groupby([month, "book_id", "genre"])["checkouts"].sum().reset_index()
+    monthly.insert(0, "_id", monthly["month"].dt.strftime("%Y-%m") + "|" + monthly["book_id"])
+    return records(monthly)
+
+
+def average_days(loan_seconds: np.ndarray, returns: np.ndarray) -> List[Optional[float]]:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        days = np.round(loan_seconds / returns / SECONDS_PER_DAY, 2)
+    return [None if np.isnan(value) else float(value) for value in days]
+
+
+def top_books(rows: List[dict], limit: int) -> List[Tuple[str, int]]:
+    """(book_id, checkouts) for the most borrowed books, ties by book id"""
+    books = frame(rows, ["book_id", "checkouts"])
+    totals = books.groupby("book_id")["checkouts"].sum().reset_index()
+    totals = totals.sort_values(["checkouts", "book_id"], ascending=[False, True], kind="stable").head(limit)
+    return list(zip(totals["book_id"].tolist(), totals["checkouts"].tolist()))
+
+
+def summarize(totals: pd.DataFrame) -> List[dict]:
+    return [
+        {"checkouts": checkouts, "returns": returns, "average_loan_days": average}
+        for checkouts, returns, average in zip(
+            totals["checkouts"].astype(np.int64).tolist(),
+            totals["returns"].astype(np.int64).tolist(),
+            average_days(totals["loan_seconds"].to_numpy(np.float64), totals["returns"].to_numpy(np.float64)),
+        )
+    ]
+
+
+def borrowing_by(rows: List[dict], group: str) -> List[dict]:
+    """Totals per grade or genre, most checkouts first"""
+    circulation = frame(rows, CIRCULATION_COLUMNS)
+    totals = circulation.groupby(group)[["checkouts", "returns", "loan_seconds"]].sum()
+    totals = totals.sort_values("checkouts", ascending=False, kind="stable")
+    return [{group: key, **summary} for key, summary in zip(totals.index.tolist(), summarize(totals))]
+
+
+def trends(rows: List[dict], start: datetime, end: datetime, interval: str) -> List[dict]:
+    """Totals per day, week (from Monday) or month over [start, end), including empty periods"""
+    freq = INTERVALS[interval]
+    circulation = frame(rows, CIRCULATION_COLUMNS)
+    periods = circulation["day"].dt.to_period(freq)
+    totals = circulation.groupby(periods)[["checkouts", "returns", "loan_seconds"]].sum()
+    index = pd.period_range(start, end - timedelta(days=1), freq=freq)
+    totals = totals.reindex(index, fill_value=0)
+    return [
+        {"period_start": period.start_time.date().isoformat(), **summary}
+        for period, summary in zip(index, summarize(totals))
+    ]
+
+
+def loan_duration(rows: List[dict]) -> dict:
+    """Average loan length of the returns in range, overall and per grade and genre"""
+    circulation = frame(rows, CIRCULATION_COLUMNS)
+    returns = int(circulation["returns"].sum())
+    overall = average_days(np.array([circulation["loan_seconds"].sum()], dtype=np.float64), np.array([returns]))[0]
+    result = {"returns": returns, "average_loan_days": overall}
+    for group in GROUPS:
+        totals = circulation.groupby(group)[["returns", "loan_seconds"]].sum()
+        totals = totals[totals["returns"] > 0].sort_values("returns", ascending=False, kind="stable")
+        result[f"by_{group}"] = [
+            {group: key, "returns": count, "average_loan_days": average}
+            for key, count, average in zip(
+                totals.index.tolist(),
+                totals["returns"].astype(np.int64).tolist(),
+                average_days(totals["loan_seconds"].to_numpy(np.float64), totals["returns"].to_numpy(np.float64)),
+            )
+        ]
+    return result
@@ -0,0 +1,100 @@
+"""
+Bounded in-process LRU cache with a time-to-live, used as a read-through
+cache for hot book and member documents
+Entries are invalidated explicitly by the write routes in this worker; the
+TTL bounds how long a write made by another worker can go unnoticed.
+Readers that know the current version of the underlying data (such as the
+conditional GET routes) pass it in, and entries loaded at any other version
+count as stale
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+class LRUCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Hashable, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, version: Optional[Hashable] = None) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, entry_version, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+            elif version is not None and entry_version != version:
+                del self._entries[key]
+                self.stale += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def get_many(
+        self, keys: Iterable[Hashable], version: Optional[Hashable] = None
+    ) -> Tuple[Dict[Hashable, Any], List[Hashable]]:
+        """Split keys into cached values and keys that still need loading"""
+        found, missing = {}, []
+        for key in keys:
+            value = self.get(key, version)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        return found, missing
+
+    def set(self, key: Hashable, value: Any, version: Optional[Hashable] = None):
+        if self.maxsize <= 0 or value is None:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, version, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_load(
+        self, key: Hashable, loader: Callable[[], Awaitable[Optional[Any]]], version: Optional[Hashable] = None
+    ) -> Optional[Any]:
+        """Cached value, or the loader's; the version must be read before loading"""
+        value = self.get(key, version)
+        if value is None:
+            value = await loader()
+            self.set(key, value, version)
+        return value
+
+    def invalidate(self, *keys: Hashable):
+        for key in keys:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "stale": self.stale,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,131 @@
+"""
+Streaming catalogue import shared by POST /api/import/books and the
+import_books.py CLI
+Rows are validated against BookCreate and upserted by ISBN in fixed-size
+chunks, so memory stays bounded however large the file is
+"""
+
+import csv
+import json
+import uuid
+from datetime import datetime
+from itertools import islice
+from typing import IO, Iterator, List, Optional, Type
+
+from pydantic import BaseModel, ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+DEFAULT_CHUNK_SIZE = 1000
+
+# Only the first rejections are reported back; the count covers all of them
+MAX_REPORTED_REJECTIONS = 1000
+
+FORMATS = ("csv", "ndjson")
+
+
+class RejectedRow(BaseModel):
+    row: int
+    error: str
+
+
+class ImportReport(BaseModel):
+    processed: int = 0
+    inserted: int = 0
+    updated: int = 0
+    rejected: int = 0
+    rejected_rows: List[RejectedRow] = []
+
+    def reject(self, row: int, error: str):
+        self.rejected += 1
+        if len(self.rejected_rows) < MAX_REPORTED_REJECTIONS:
+            self.rejected_rows.append(RejectedRow(row=row, error=error))
+
+
+def detect_format(filename: str) -> Optional[str]:
+    name = filename.lower()
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    return None
+
+
+def iter_rows(stream: IO[str], file_format: str) -> Iterator[tuple]:
+    """Yield (row number, parsed row or error message) without reading ahead"""
+    if file_format == "csv":
+        for row_number, row in enumerate(csv.DictReader(stream), start=1):
+            yield row_number, {key: value for key, value in row.items() if key is not None}
+    elif file_format == "ndjson":
+        for row_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield row_number, f"Invalid JSON: {e}"
+                continue
+            yield row_number, row if isinstance(row, dict) else "Expected a JSON object"
+    else:
+        raise ValueError(f"Unsupported format: {file_format}")
+
+
+def book_upsert(book) -> UpdateOne:
+    # Descriptive fields follow the file; identity and copy counts are only
+    # set when the ISBN is new, so re-imports never disturb circulation
+    fields = book.dict()
+    total_copies = fields.pop("total_copies")
+    now = datetime.utcnow()
+    return UpdateOne(
+        {"isbn": book.isbn},
+        {
+            "$set": {**fields, "updated_at": now},
+            "$setOnInsert": {
+                "id": str(uuid.uuid4()),
+                "total_copies": total_copies,
+                "available_copies": total_copies,
+                "created_at": now,
+            },
+        },
+        upsert=True,
+    )
+
+
+async def import_books(db, rows: Iterator[tuple], book_model: Type[BaseModel],
+                       chunk_size: int = DEFAULT_CHUNK_SIZE) -> ImportReport:
+    """Validate rows against book_model (BookCreate) and upsert them chunk by chunk"""
+    report = ImportReport()
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return report
+        report.processed += len(chunk)
+
+        operations, row_numbers = [], []
+        for row_number, row in chunk:
+            if isinstance(row, str):
+                report.reject(row_number, row)
+                continue
+            try:
+                book = book_model(**row)
+            except ValidationError as e:
+                report.reject(row_number, "; ".join(
+                    f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()
+                ))
+                continue
+            operations.append(book_upsert(book))
+            row_numbers.append(row_number)
+
+        if not operations:
+            continue
+        try:
+            result = await db.books.bulk_write(operations, ordered=False)
+            report.inserted += result.upserted_count
+            report.updated += result.matched_count
+        except BulkWriteError as e:
+            # Typically the same ISBN twice in one chunk racing to upsert
+            details = e.details
+            report.inserted += details.get("nUpserted", 0)
+            report.updated += details.get("nMatched", 0)
+            for error in details["writeErrors"]:
+                report.reject(row_numbers[error["index"]], error.get("errmsg", "Write failed"))
@@ -0,0 +1,73 @@
+"""
+In-process fan-out of change events to Server-Sent Events clients
+A single upstream feed per worker (a MongoDB change stream, or the write
+routes themselves when change streams are unavailable) publishes each event
+once; it is encoded once and queued to every connected subscriber
+"""
+
+import asyncio
+from typing import AsyncIterator, Callable, Optional, Set
+
+# Sent in place of the events a subscriber fell too far behind to receive
+RESYNC_EVENT = b"event: resync\ndata: {}\n\n"
+
+
+class Subscriber:
+    def __init__(self, queue_size: int):
+        self.queue: "asyncio.Queue[bytes]" = asyncio.Queue(maxsize=queue_size)
+        self.lagged = False
+
+
+class EventHub:
+    def __init__(self, queue_size: int, encode: Callable[[object], bytes]):
+        self.queue_size = queue_size
+        self.encode = encode
+        self.subscribers: Set[Subscriber] = set()
+        # True while a change stream watcher feeds the hub; the write routes
+        # then leave publishing to it so that events are not sent twice
+        self.upstream_active = False
+        self.published = 0
+        self.dropped_subscribers = 0
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    def wants_local_events(self) -> bool:
+        return bool(self.subscribers) and not self.upstream_active
+
+    def publish(self, event_type: str, data: object):
+        if not self.subscribers:
+            return
+        frame = b"event: " + event_type.encode() + b"\ndata: " + self.encode(data) + b"\n\n"
+        self.published += 1
+        for subscriber in list(self.subscribers):
+            if subscriber.lagged:
+                continue
+            try:
+                subscriber.queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # A slow client must not hold events in memory for everyone;
+                # it gets a resync event and reconnects
+                subscriber.lagged = True
+                self.dropped_subscribers += 1
+
+    async def stream(self, keepalive_seconds: float,
+                     is_disconnected: Optional[Callable] = None) -> AsyncIterator[bytes]:
+        """SSE frames for one client until it disconnects or falls behind"""
+        subscriber = Subscriber(self.queue_size)
+        self.subscribers.add(subscriber)
+        try:
+            yield f"retry: {int(keepalive_seconds * 1000)}\n\n".encode()
+            while True:
+                if subscriber.lagged:
+                    yield RESYNC_EVENT
+                    return
+                try:
+                    frame = await asyncio.wait_for(subscriber.queue.get(), keepalive_seconds)
+                except asyncio.TimeoutError:
+                    if is_disconnected is not None and await is_disconnected():
+                        return
+                    frame = b": keepalive\n\n"
+                yield frame
+        finally:
+            self.subscribers.discard(subscriber)
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic library for scale testing
+
+    python generate_dataset.py --books 100000 --members 20000 --transactions 1000000
+    python generate_dataset.py --members 500 --pictures 0.5 --drop
+
+Titles, authors and genres follow skewed (Zipf-like) distributions, popular
+books and keen readers account for most loans, and the loan history has
+realistic returned and overdue ratios. Copy counts stay consistent with the
+open loans. Documents are inserted with insert_many in batches while the next
+batch is generated.
+
+The same generator is usable as a module:
+
+    from generate_dataset import generate_library
+    await generate_library(db, books=10000, members=2000, transactions=50000)
+"""
+
+import asyncio
+import base64
+import io
+import random
+import time
+import uuid
+from bisect import bisect
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import Iterator, List, Optional
+
+import typer
+from PIL import Image
+
+import server
+
+DEFAULT_BATCH_SIZE = 5000
+# Batches being inserted while the next one is generated
+MAX_INFLIGHT_BATCHES = 4
+LOAN_DAYS = 14
+HISTORY_DAYS = 365
+
+GENRES = {
+    "Fiction": 24, "Mystery": 11, "Fantasy": 10, "Science Fiction": 9, "Romance": 7,
+    "Biography": 6, "History": 6, "Science": 6, "Mathematics": 4, "Poetry": 3,
+    "Graphic Novel": 5, "Reference": 2, "Self-Help": 3, "Drama": 3,
+}
+TITLE_WORDS = (
+    "the of and a in to night house girl boy secret last lost world life time day war "
+    "love dark light stars river city garden shadow king queen dream song storm fire "
+    "water island road winter summer heart story letters empire silent wild golden "
+    "hidden forgotten broken little great new old journey return beyond between under "
+    "kingdom ocean mountain forest bridge tower echo memory promise truth lies ghost "
+    "machine code numbers atoms cells history science guide introduction principles"
+).split()
+FIRST_NAMES = (
+    "Olivia Liam Emma Noah Ava Elijah Sophia James Isabella Lucas Mia Mateo Amelia Ethan "
+    "Harper Aiden Evelyn Leo Abigail Kai Priya Arjun Mei Hiro Fatima Omar Zara Kwame "
+    "Amara Diego Lucia Sven Ingrid Yusuf Aisha Chen Wei Sofia Ivan Nadia Tariq Leila"
+).split()
+LAST_NAMES = (
+    "Smith Johnson Williams Brown Jones Garcia Miller Davis Rodriguez Martinez Hernandez "
+    "Lopez Wilson Anderson Thomas Taylor Moore Jackson Martin Lee Perez Thompson White "
+    "Harris Clark Lewis Robinson Walker Young Allen King Wright Scott Nguyen Patel Kim "
+    "Singh Chen Wang Okafor Mensah Novak Kowalski Silva Rossi Muller Dubois Tanaka Sato"
+).split()
+GRADES = ["9th Grade", "10th Grade", "11th Grade", "12th Grade"]
+
+
+@dataclass
+class DatasetReport:
+    books: int = 0
+    members: int = 0
+    pictures: int = 0
+    transactions: int = 0
+    active_loans: int = 0
+    overdue_loans: int = 0
+    seconds: float = 0.0
+
+
+def zipf_cum_weights(count: int, exponent: float = 1.0) -> List[float]:
+    return list(accumulate(1 / (rank + 1) ** exponent for rank in range(count)))
+
+
+def make_id(rng: random.Random) -> str:
+    # Seeded, so the same arguments always produce the same dataset
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def make_books(rng: random.Random, count: int, now: datetime) -> List[dict]:
+    word_weights = zipf_cum_weights(len(TITLE_WORDS), 0.8)
+    authors = [f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}" for _ in range(max(1, count // 8))]
+    author_weights = zipf_cum_weights(len(authors), 0.7)
+    genres, genre_weights = list(GENRES), list(accumulate(GENRES.values()))
+    books = []
+    for i in range(count):
+        title = " ".join(rng.choices(TITLE_WORDS, cum_weights=word_weights, k=rng.randint(1, 5))).title()
+        copies = min(1 + int(rng.expovariate(0.6)), 30)
+        created_at = now - timedelta(days=rng.uniform(0, 3 * HISTORY_DAYS))
+        books.append({
+            "id": make_id(rng),
+            "title": title,
+            "author": rng.choices(authors, cum_weights=author_weights)[0],
+            "isbn": f"978-{i // 1000000 % 10}-{i // 1000 % 1000:03d}-{i % 1000:03d}{rng.randint(0, 99):02d}-{i % 10}",
+            "genre": rng.choices(genres, cum_weights=genre_weights)[0],
+            "total_copies": copies,
+            "available_copies": copies,
+            "description": "",
+            "created_at": created_at,
+        })
+    return books
+
+
+def make_picture(rng: random.Random) -> str:
+    image = Image.new("RGB", (256, 256), tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=80)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def iter_members(rng: random.Random, ids: List[str], now: datetime) -> Iterator[dict]:
+    for i, member_id in enumerate(ids):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        created_at = now - timedelta(days=rng.uniform(0, 2 * HISTORY_DAYS))
+        yield {
+            "id": member_id,
+            "name": f"{first} {last}",
+            "student_id": f"STU{i:07d}",
+            "grade": rng.choice(GRADES),
+            "picture_etag": None,
+            "email": f"{first}.{last}{i}@school.edu".lower(),
+            "phone": "",
+            "created_at": created_at,
+        }
+
+
+def iter_transactions(rng: random.Random, count: int, books: List[dict], member_ids: List[str], now: datetime,
+                      returned_ratio: float, overdue_ratio: float, report: DatasetReport) -> Iterator[dict]:
+    """Loans over the past year; open loans only take copies that are actually free"""
+    book_weights = zipf_cum_weights(len(books), 0.9)
+    member_weights = zipf_cum_weights(len(member_ids), 0.5)
+    active_pairs = set()
+    for _ in range(count):
+        book_index = bisect(book_weights, rng.random() * book_weights[-1])
+        member_index = bisect(member_weights, rng.random() * member_weights[-1])
+        book = books[book_index]
+
+        active = rng.random() >= returned_ratio
+        if active and (book["available_copies"] == 0 or (book_index, member_index) in active_pairs):
+            active = False
+        if active:
+            overdue = rng.random() < overdue_ratio
+            # Open loans started within the last loan period unless overdue
+            if overdue:
+                checkout_date = now - timedelta(days=rng.uniform(LOAN_DAYS + 1, LOAN_DAYS + 60))
+            else:
+                checkout_date = now - timedelta(days=rng.uniform(0, LOAN_DAYS - 0.01))
+            return_date = None
+            status = "overdue" if overdue else "borrowed"
+            book["available_copies"] -= 1
+            active_pairs.add((book_index, member_index))
+            report.active_loans += 1
+            report.overdue_loans += overdue
+        else:
+            checkout_date = now - timedelta(days=rng.uniform(LOAN_DAYS, HISTORY_DAYS))
+            # Most come back on time, some a little late
+            return_date = checkout_date + timedelta(days=min(rng.expovariate(1 / 9), LOAN_DAYS * 3))
+            status = "returned"
+
+        loan = {
+            "id": make_id(rng),
+            "book_id": book["id"],
+            "member_id": member_ids[member_index],
+            "checkout_date": checkout_date,
+            "due_date": checkout_date + timedelta(days=LOAN_DAYS),
+            "return_date": return_date,
+            "status": status,
+            "created_at": checkout_date,
+        }
+        if status != "returned":
+            loan["active"] = True
+        yield loan
+
+
+def batches(items: Iterator[dict], size: int) -> Iterator[List[dict]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def insert_batches(collection, items: Iterator[dict], batch_size: int) -> int:
+    """insert_many in batches, generating the next batch while earlier ones are written
+
+    updated_at is the time of insertion, not the backdated created_at, so a
+    running server picks the documents up in its search refresh and /api/sync
+    """
+    inflight = set()
+    inserted = 0
+    for batch in batches(items, batch_size):
+        stamped = datetime.utcnow()
+        for item in batch:
+            item["updated_at"] = stamped
+        if len(inflight) >= MAX_INFLIGHT_BATCHES:
+            done, inflight = await asyncio.wait(inflight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        inflight.add(asyncio.ensure_future(collection.insert_many(batch, ordered=False)))
+        inserted += len(batch)
+        # Let the writes start before generating more
+        await asyncio.sleep(0)
+    if inflight:
+        await asyncio.gather(*inflight)
+    return inserted
+
+
+async def generate_library(db, books: int = 10000, members: int = 2000, transactions: int = 50000,
+                           pictures: float = 0.0, returned_ratio: float = 0.85, overdue_ratio: float = 0.2,
+                           batch_size: int = DEFAULT_BATCH_SIZE, seed: Optional[int] = 42,
+                           store_picture=None) -> DatasetReport:
+    """Insert a synthetic library into db
+
+    pictures is the fraction of members that get a profile picture; it needs
+    store_picture(member_id, picture_base64) -> member fields, normally
+    server.store_member_picture. Book documents are kept in memory while the
+    loans are generated, then inserted with their final available_copies.
+    """
+    if pictures and store_picture is None:
+        raise ValueError("store_picture is required when generating pictures")
+
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    report = DatasetReport()
+
+    book_docs = make_books(rng, books, now)
+    member_ids = [make_id(rng) for _ in range(members)]
+
+    report.members = await insert_batches(db.members, iter_members(rng, member_ids, now), batch_size)
+    if transactions and book_docs and member_ids:
+        report.transactions = await insert_batches(
+            db.transactions,
+            iter_transactions(rng, transactions, book_docs, member_ids, now, returned_ratio, overdue_ratio, report),
+            batch_size
+        )
+    report.books = await insert_batches(db.books, iter(book_docs), batch_size)
+
+    if pictures:
+        semaphore = asyncio.Semaphore(16)
+        palette = [make_picture(rng) for _ in range(32)]
+
+        async def add_picture(member_id: str):
+            async with semaphore:
+                fields = await store_picture(member_id, rng.choice(palette))
+                await db.members.update_one({"id": member_id}, {"$set": {**fields, "updated_at": datetime.utcnow()}})
+
+        chosen = [member_id for member_id in member_ids if rng.random() < pictures]
+        await asyncio.gather(*[add_picture(member_id) for member_id in chosen])
+        report.pictures = len(chosen)
+
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+async def run(args: dict, drop: bool):
+    if drop:
+        for collection_name in ["books", "members", "transactions", "stats", "tombstones", "holds",
+                                "circulation_daily", "book_circulation_daily", "book_circulation_monthly",
+                                "member_pictures.files", "member_pictures.chunks"]:
+            await server.db[collection_name].drop()
+    await server.ensure_indexes()
+    report = await generate_library(server.db, store_picture=server.store_member_picture, **args)
+    # Bring the derived state up to date right away
+    await server.reconcile_stats(log_drift=False)
+    # Generated loans are backdated, behind any rollup watermark
+    await server.rollup_circulation(rebuild=True)
+    await server.touch_collections(*server.VERSIONED_COLLECTIONS)
+    return report
+
+
+def main(
+    books: int = typer.Option(10000, min=0, help="Number of books"),
+    members: int = typer.Option(2000, min=0, help="Number of members"),
+    transactions: int = typer.Option(50000, min=0, help="Number of loans, open and returned"),
+    pictures: float = typer.Option(0.0, min=0.0, max=1.0, help="Fraction of members with a profile picture"),
+    returned_ratio: float = typer.Option(0.85, min=0.0, max=1.0, help="Share of loans already returned"),
+    overdue_ratio: float = typer.Option(0.2, min=0.0, max=1.0, help="Share of open loans that are overdue"),
+    batch_size: int = typer.Option(DEFAULT_BATCH_SIZE, min=1, help="Documents per insert_many"),
+    seed: int = typer.Option(42, help="Random seed"),
+    drop: bool = typer.Option(False, help="Drop the library collections first"),
+):
+    args = {
+        "books": books, "members": members, "transactions": transactions, "pictures": pictures,
+        "returned_ratio": returned_ratio, "overdue_ratio": overdue_ratio, "batch_size": batch_size, "seed": seed,
+    }
+    report = asyncio.run(run(args, drop))
+    typer.echo(
+        f"Inserted {report.books} books, {report.members} members ({report.pictures} with pictures) and "
+        f"{report.transactions} transactions ({report.active_loans} open, {report.overdue_loans} overdue) "
+        f"in {report.seconds:.1f} s"
+    )
+    server.db.close()
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,35 @@
+"""
+Multi-process serving: gunicorn manages uvicorn workers, one event loop and
+one MongoDB connection pool per worker
+
+    cd backend && gunicorn server:app
+
+Settings come from the environment (or backend/.env). Each worker opens up
+to MONGO_MAX_POOL_SIZE connections, so the database sees WEB_CONCURRENCY
+times that many at most. Caches, search indexes, SSE subscribers and metrics
+are per worker as well.
+"""
+
+import multiprocessing
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).parent / '.env')
+
+# Unset or empty settings fall back to their defaults
+bind = os.environ.get('BIND') or '0.0.0.0:8001'
+workers = int(os.environ.get('WEB_CONCURRENCY') or 0) or multiprocessing.cpu_count()
+worker_class = 'uvicorn.workers.UvicornWorker'
+# The app is imported in each worker after the fork; the Motor client and its
+# background threads must not be shared across processes
+preload_app = False
+timeout = int(os.environ.get('WORKER_TIMEOUT_SECONDS') or 60)
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT_SECONDS') or 30)
+keepalive = int(os.environ.get('KEEPALIVE_SECONDS') or 5)
+# Recycle workers now and then to bound memory growth; the jitter keeps them
+# from restarting all at once
+max_requests = int(os.environ.get('WORKER_MAX_REQUESTS') or 0)
+max_requests_jitter = max_requests // 10
+accesslog = os.environ.get('ACCESS_LOG') or None
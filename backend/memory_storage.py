@@ -0,0 +1,1243 @@
+"""
+In-memory storage backend: the subset of the MongoDB collection API that the
+app uses, for tests and benchmarks that run without a database server
+Documents live in dicts keyed by insertion sequence. Every declared index is
+kept as a sorted list of encoded keys, which serves equality and $in lookups,
+range scans and sorts alike; unique and partial indexes are enforced on write.
+All operations run synchronously on the event loop, so each one is atomic.
+"""
+
+import re
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta, timezone
+from itertools import islice, product
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import bson
+from bson import ObjectId
+from gridfs.errors import NoFile
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure, WriteError
+from pymongo.operations import DeleteMany, DeleteOne, IndexModel, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+MISSING = object()
+
+# Sort order of BSON types, per the MongoDB comparison order
+NULL, NUMBER, STRING, OBJECT, ARRAY, BINARY, OBJECT_ID, BOOLEAN, DATE, REGEX = 1, 2, 3, 4, 5, 6, 7, 8, 9, 11
+# Encoded keys sort below and above every real value
+LOWEST = (0,)
+HIGHEST = (100,)
+
+TTL_MONITOR_SECONDS = 60
+MAX_KEY_PREFIXES = 1000
+
+
+def bracket(value) -> int:
+    if value is None or value is MISSING:
+        return NULL
+    if isinstance(value, bool):
+        return BOOLEAN
+    if isinstance(value, (int, float)):
+        return NUMBER
+    if isinstance(value, str):
+        return STRING
+    if isinstance(value, datetime):
+        return DATE
+    if isinstance(value, dict):
+        return OBJECT
+    if isinstance(value, list):
+        return ARRAY
+    if isinstance(value, ObjectId):
+        return OBJECT_ID
+    if isinstance(value, bytes):
+        return BINARY
+    if isinstance(value, re.Pattern):
+        return REGEX
+    raise TypeError(f"Cannot store value of type {type(value).__name__}")
+
+
+def encode(value) -> tuple:
+    """A totally ordered key for one value: its type bracket first, then the value"""
+    kind = bracket(value)
+    if kind == NULL:
+        return (NULL,)
+    if kind in (OBJECT, ARRAY, REGEX):
+        return (kind, repr(value))
+    if kind == OBJECT_ID:
+        return (kind, value.binary)
+    return (kind, value)
+
+
+def to_bson(value):
+    """Copy a value in the way a BSON round trip would change it"""
+    if isinstance(value, dict):
+        return {str(key): to_bson(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_bson(item) for item in value]
+    if isinstance(value, datetime):
+        # BSON dates are naive UTC with millisecond precision
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    if isinstance(value, bytearray):
+        return bytes(value)
+    return value
+
+
+def copy_value(value):
+    if isinstance(value, dict):
+        return {key: copy_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_value(item) for item in value]
+    return value
+
+
+def get_path(doc, path: str):
+    if "." not in path:
+        return doc.get(path, MISSING) if isinstance(doc, dict) else MISSING
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part, MISSING)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return MISSING
+        if value is MISSING:
+            return MISSING
+    return value
+
+
+def set_path(doc: dict, path: str, value):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+        if not isinstance(doc, dict):
+            raise WriteError(f"Cannot create field '{last}' in element {{{part}: {doc!r}}}", 28)
+    doc[last] = value
+
+
+def unset_path(doc: dict, path: str):
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(last, None)
+
+
+# Query matching
+
+def candidates(value) -> list:
+    # An array field matches a condition if the array itself or any element does
+    return [value, *value] if isinstance(value, list) else [value]
+
+
+def equals(value, target) -> bool:
+    if target is None:
+        return value is None or value is MISSING
+    return value is not MISSING and bracket(value) == bracket(target) and value == target
+
+
+def compare(value, operator: str, target) -> bool:
+    if value is MISSING or bracket(value) != bracket(target):
+        # Comparisons only match values of the same type, except null with null
+        return bracket(target) == NULL and value in (None, MISSING) and operator in ("$gte", "$lte")
+    if operator == "$gt":
+        return encode(value) > encode(target)
+    if operator == "$gte":
+        return encode(value) >= encode(target)
+    if operator == "$lt":
+        return encode(value) < encode(target)
+    return encode(value) <= encode(target)
+
+
+def regex_flags(options: str) -> int:
+    flags = 0
+    for option in options:
+        flags |= {"i": re.IGNORECASE, "m": re.MULTILINE, "s": re.DOTALL, "x": re.VERBOSE}.get(option, 0)
+    return flags
+
+
+def regex_matches(value, pattern: re.Pattern) -> bool:
+    return isinstance(value, str) and pattern.search(value) is not None
+
+
+def is_operator_document(condition) -> bool:
+    return isinstance(condition, dict) and bool(condition) and all(key.startswith("$") for key in condition)
+
+
+def is_scalar(value) -> bool:
+    return value is not None and not isinstance(value, (dict, list, re.Pattern))
+
+
+def compile_condition(condition) -> Callable[[Any], bool]:
+    """A test of one field value against a literal or an operator document"""
+    if is_operator_document(condition):
+        tests = [
+            compile_operator(operator, operand, condition)
+            for operator, operand in condition.items()
+            if operator != "$options"
+        ]
+        return tests[0] if len(tests) == 1 else (lambda value: all(test(value) for test in tests))
+    if isinstance(condition, re.Pattern):
+        return lambda value: any(regex_matches(item, condition) for item in candidates(value))
+    if is_scalar(condition):
+        target = encode(condition)
+        # Encoded keys compare type brackets too, so 1 never equals True
+        return lambda value: (
+            any(item is not MISSING and encode(item) == target for item in value)
+            if isinstance(value, list) else value is not MISSING and encode(value) == target
+        )
+    return lambda value: any(equals(item, condition) for item in candidates(value))
+
+
+def compile_operator(operator: str, operand, condition: dict) -> Callable[[Any], bool]:
+    if operator == "$eq":
+        return compile_condition({"$in": [operand]}) if is_scalar(operand) else (
+            lambda value: any(equals(item, operand) for item in candidates(value))
+        )
+    if operator == "$ne":
+        test = compile_operator("$eq", operand, condition)
+        return lambda value: not test(value)
+    if operator in ("$gt", "$gte", "$lt", "$lte"):
+        return lambda value: any(compare(item, operator, operand) for item in candidates(value))
+    if operator == "$in":
+        if all(is_scalar(target) for target in operand):
+            targets = {encode(target) for target in operand}
+            return lambda value: any(
+                item is not MISSING and encode(item) in targets for item in candidates(value)
+            )
+        tests = [compile_condition(target) for target in operand]
+        return lambda value: any(test(value) for test in tests)
+    if operator == "$nin":
+        test = compile_operator("$in", operand, condition)
+        return lambda value: not test(value)
+    if operator == "$exists":
+        return lambda value: (value is not MISSING) == bool(operand)
+    if operator == "$regex":
+        pattern = operand if isinstance(operand, re.Pattern) else re.compile(operand, regex_flags(
+            condition.get("$options", "")
+        ))
+        return lambda value: any(regex_matches(item, pattern) for item in candidates(value))
+    if operator == "$not":
+        test = compile_condition(operand)
+        return lambda value: not test(value)
+    if operator == "$size":
+        return lambda value: isinstance(value, list) and len(value) == operand
+    if operator == "$all":
+        tests = [compile_condition(target) for target in operand]
+        return lambda value: all(test(value) for test in tests)
+    if operator == "$elemMatch":
+        test = compile_query(operand) if not is_operator_document(operand) else compile_condition(operand)
+        return lambda value: isinstance(value, list) and any(test(item) for item in value)
+    raise OperationFailure(f"unknown operator: {operator}", 2)
+
+
+def compile_query(query: Optional[dict]) -> Callable[[dict], bool]:
+    """A test of whole documents against a query, built once per query"""
+    if not query:
+        return lambda doc: True
+    tests = []
+    for key, condition in query.items():
+        if key in ("$and", "$or", "$nor"):
+            parts = [compile_query(part) for part in condition]
+            if key == "$and":
+                tests.append(lambda doc, parts=parts: all(part(doc) for part in parts))
+            elif key == "$or":
+                tests.append(lambda doc, parts=parts: any(part(doc) for part in parts))
+            else:
+                tests.append(lambda doc, parts=parts: not any(part(doc) for part in parts))
+        elif key == "$expr":
+            tests.append(lambda doc, expression=condition: truthy(evaluate(expression, doc)))
+        elif key.startswith("$"):
+            raise OperationFailure(f"unknown top level operator: {key}", 2)
+        else:
+            test = compile_condition(condition)
+            if "." in key:
+                tests.append(lambda doc, key=key, test=test: test(get_path(doc, key)))
+            else:
+                tests.append(lambda doc, key=key, test=test: test(doc.get(key, MISSING)))
+    return tests[0] if len(tests) == 1 else (lambda doc: all(test(doc) for test in tests))
+
+
+def matches(doc: dict, query: Optional[dict]) -> bool:
+    return compile_query(query)(doc)
+
+
+# Query planning: which index entries can possibly match
+
+def field_points(query: dict, field: str) -> Optional[List[tuple]]:
+    """Encoded values the field must equal, when the query pins it to a few"""
+    points = None
+    for key, condition in query.items():
+        found = None
+        if key == "$and":
+            for part in condition:
+                part_points = field_points(part, field)
+                if part_points is not None:
+                    found = part_points if found is None else [p for p in found if p in part_points]
+        elif key == field:
+            if isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition):
+                if "$eq" in condition:
+                    found = [encode(condition["$eq"])]
+                elif "$in" in condition and not any(
+                    isinstance(target, (list, dict, re.Pattern)) or target is None for target in condition["$in"]
+                ):
+                    found = sorted({encode(target) for target in condition["$in"]})
+            elif not isinstance(condition, (list, dict, re.Pattern)) and condition is not None:
+                found = [encode(condition)]
+        if found is not None:
+            points = found if points is None else [p for p in points if p in found]
+    return points
+
+
+def field_range(query: dict, field: str) -> Tuple[tuple, tuple]:
+    """Inclusive encoded bounds that every matching value of the field lies within"""
+    low, high = LOWEST, HIGHEST
+    for key, condition in query.items():
+        if key == "$and":
+            for part in condition:
+                part_low, part_high = field_range(part, field)
+                low, high = max(low, part_low), min(high, part_high)
+        elif key == "$or":
+            ranges = [field_range(part, field) for part in condition]
+            low = max(low, min(part_low for part_low, _ in ranges))
+            high = min(high, max(part_high for _, part_high in ranges))
+        elif key == field:
+            if isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition):
+                for operator, operand in condition.items():
+                    if operand is None or isinstance(operand, (list, dict)):
+                        continue
+                    kind = bracket(operand)
+                    if operator in ("$gt", "$gte", "$eq"):
+                        low = max(low, encode(operand))
+                        high = min(high, (kind + 0.5,))
+                    if operator in ("$lt", "$lte", "$eq"):
+                        high = min(high, encode(operand) + HIGHEST)
+                        low = max(low, (kind,))
+            elif not isinstance(condition, (list, dict, re.Pattern)) and condition is not None:
+                low, high = max(low, encode(condition)), min(high, encode(condition) + HIGHEST)
+    return low, high
+
+
+class Index:
+    def __init__(self, name: str, keys: List[Tuple[str, Any]], unique: bool = False,
+                 partial: Optional[dict] = None, expire_after: Optional[float] = None, **options):
+        self.name = name
+        self.keys = keys
+        self.fields = [field for field, _ in keys]
+        self.unique = unique
+        self.partial = partial
+        self.partial_test = compile_query(partial) if partial is not None else None
+        self.expire_after = expire_after
+        self.options = options
+        # Sorted (key, seq) pairs, ascending in every field whatever the
+        # declared direction; descending sorts scan them backwards
+        self.entries: List[tuple] = []
+        # Array values would need one entry per element; such an index only
+        # enforces uniqueness and is not used to find documents
+        self.multikey = False
+
+    def info(self) -> dict:
+        info = {"v": 2, "key": list(self.keys)}
+        if self.unique:
+            info["unique"] = True
+        if self.partial is not None:
+            info["partialFilterExpression"] = self.partial
+        if self.expire_after is not None:
+            info["expireAfterSeconds"] = self.expire_after
+        info.update(self.options)
+        return info
+
+    def key(self, doc: dict) -> Optional[tuple]:
+        if self.partial_test is not None and not self.partial_test(doc):
+            return None
+        return tuple(encode(None if (value := get_path(doc, field)) is MISSING else value) for field in self.fields)
+
+    def add(self, key: Optional[tuple], seq: int):
+        if key is not None:
+            insort(self.entries, (key, seq))
+            self.multikey = self.multikey or any(part[0] == ARRAY for part in key)
+
+    def remove(self, key: Optional[tuple], seq: int):
+        if key is not None:
+            position = bisect_left(self.entries, (key, seq))
+            if position < len(self.entries) and self.entries[position] == (key, seq):
+                del self.entries[position]
+
+    def holder(self, key: tuple) -> Optional[int]:
+        """The document holding a unique key, if any"""
+        position = bisect_left(self.entries, (key,))
+        if position < len(self.entries) and self.entries[position][0] == key:
+            return self.entries[position][1]
+        return None
+
+    def scan(self, prefix: tuple, low: tuple = LOWEST, high: tuple = HIGHEST, reverse: bool = False) -> Iterator[int]:
+        """Sequence numbers of the entries starting with prefix whose next key part lies in [low, high]"""
+        start = bisect_left(self.entries, (prefix + (low,),) if low != LOWEST else (prefix,))
+        end = bisect_left(self.entries, (prefix + (high, HIGHEST),) if high != HIGHEST else (prefix + (HIGHEST,),))
+        if reverse:
+            return (self.entries[position][1] for position in range(end - 1, start - 1, -1))
+        return (self.entries[position][1] for position in range(start, end))
+
+
+class Plan:
+    def __init__(self, seqs: Iterable[int], ordered: bool, estimate: float):
+        self.seqs = seqs
+        # True when seqs already come in the requested sort order
+        self.ordered = ordered
+        self.estimate = estimate
+
+
+def sort_key(doc: dict, sort: List[Tuple[str, int]]) -> tuple:
+    key = []
+    for field, direction in sort:
+        value = get_path(doc, field)
+        encoded = encode(None if value is MISSING else value)
+        key.append(encoded if direction > 0 else Reversed(encoded))
+    return tuple(key)
+
+
+class Reversed:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def normalize_sort(key_or_list, direction=None) -> List[Tuple[str, int]]:
+    if key_or_list is None:
+        return []
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [(field, order) for field, order in key_or_list]
+
+
+def project(doc: dict, projection) -> dict:
+    if not projection:
+        return copy_value(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    include_id = projection.get("_id", 1)
+    fields = {field: flag for field, flag in projection.items() if field != "_id"}
+    if fields and all(fields.values()):
+        result = {}
+        if include_id and "_id" in doc:
+            result["_id"] = doc["_id"]
+        for field in fields:
+            if "." not in field:
+                if field in doc:
+                    value = doc[field]
+                    result[field] = copy_value(value) if isinstance(value, (dict, list)) else value
+            elif (value := get_path(doc, field)) is not MISSING:
+                set_path(result, field, copy_value(value))
+        return result
+    if any(fields.values()):
+        raise OperationFailure("Cannot do exclusion on field in inclusion projection", 31254)
+    result = copy_value(doc)
+    for field in fields:
+        unset_path(result, field)
+    if not include_id:
+        result.pop("_id", None)
+    return result
+
+
+# Updates
+
+def apply_update(doc: dict, update: dict, inserting: bool = False) -> dict:
+    doc = copy_value(doc)
+    for operator, fields in update.items():
+        if operator == "$setOnInsert" and not inserting:
+            continue
+        for path, operand in fields.items():
+            if path == "_id" and operator != "$setOnInsert" and not (inserting and operator == "$set"):
+                if get_path(doc, "_id") != operand:
+                    raise WriteError("Performing an update on the path '_id' would modify the immutable field '_id'", 66)
+            current = get_path(doc, path)
+            if operator in ("$set", "$setOnInsert"):
+                set_path(doc, path, to_bson(operand))
+            elif operator == "$unset":
+                unset_path(doc, path)
+            elif operator == "$inc":
+                if current is MISSING:
+                    current = 0
+                if bracket(current) != NUMBER or bracket(operand) != NUMBER:
+                    raise WriteError(f"Cannot apply $inc to a value of non-numeric type at '{path}'", 14)
+                set_path(doc, path, current + operand)
+            elif operator in ("$max", "$min"):
+                operand = to_bson(operand)
+                if current is MISSING or (
+                    encode(operand) > encode(current) if operator == "$max" else encode(operand) < encode(current)
+                ):
+                    set_path(doc, path, operand)
+            elif operator in ("$push", "$addToSet"):
+                values = operand["$each"] if isinstance(operand, dict) and "$each" in operand else [operand]
+                items = [] if current is MISSING else current
+                if not isinstance(items, list):
+                    raise WriteError(f"The field '{path}' must be an array", 2)
+                items = list(items)
+                for value in map(to_bson, values):
+                    if operator == "$push" or value not in items:
+                        items.append(value)
+                set_path(doc, path, items)
+            elif operator == "$pull":
+                if isinstance(current, list):
+                    test = compile_condition(operand)
+                    set_path(doc, path, [item for item in current if not test(item)])
+            else:
+                raise WriteError(f"Unknown modifier: {operator}", 9)
+    return doc
+
+
+def upsert_seed(query: dict) -> dict:
+    """The equality fields of a query, which an upserted document starts out with"""
+    doc = {}
+    for key, condition in query.items():
+        if key == "$and":
+            for part in condition:
+                doc.update(upsert_seed(part))
+        elif not key.startswith("$"):
+            if isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition):
+                if "$eq" in condition:
+                    set_path(doc, key, to_bson(condition["$eq"]))
+            elif not isinstance(condition, re.Pattern):
+                set_path(doc, key, to_bson(condition))
+    return doc
+
+
+def check_update(update: dict):
+    if not update or not all(key.startswith("$") for key in update):
+        raise ValueError("update only works with $ operators")
+
+
+# Aggregation
+
+def evaluate(expression, doc: dict):
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = get_path(doc, expression[1:])
+        return None if value is MISSING else value
+    if isinstance(expression, dict):
+        if len(expression) == 1:
+            operator, operand = next(iter(expression.items()))
+            if operator.startswith("$"):
+                return evaluate_operator(operator, operand, doc)
+        return {key: evaluate(value, doc) for key, value in expression.items()}
+    if isinstance(expression, list):
+        return [evaluate(item, doc) for item in expression]
+    return expression
+
+
+def truthy(value) -> bool:
+    # Aggregation truthiness: null, false and zero are false, anything else true
+    return value is not None and value is not False and value != 0
+
+
+def evaluate_operator(operator: str, operand, doc: dict):
+    if operator == "$literal":
+        return operand
+    args = [evaluate(item, doc) for item in operand] if isinstance(operand, list) else [evaluate(operand, doc)]
+    if operator in ("$add", "$subtract", "$multiply", "$divide"):
+        if any(arg is None for arg in args):
+            return None
+        result = args[0]
+        for arg in args[1:]:
+            # Date arithmetic is in milliseconds, as in MongoDB
+            if isinstance(result, datetime) and bracket(arg) == NUMBER:
+                arg = timedelta(milliseconds=arg)
+            if operator == "$add":
+                result = result + arg
+            elif operator == "$subtract":
+                result = result - arg
+                if isinstance(result, timedelta):
+                    result = int(result.total_seconds() * 1000)
+            elif operator == "$multiply":
+                result = result * arg
+            else:
+                result = result / arg
+        return result
+    if operator in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte"):
+        left, right = encode(args[0]), encode(args[1])
+        return {
+            "$eq": left == right, "$ne": left != right, "$gt": left > right,
+            "$gte": left >= right, "$lt": left < right, "$lte": left <= right,
+        }[operator]
+    if operator == "$cond":
+        if isinstance(operand, dict):
+            operand = [operand["if"], operand["then"], operand["else"]]
+        return evaluate(operand[1], doc) if evaluate(operand[0], doc) else evaluate(operand[2], doc)
+    if operator == "$ifNull":
+        return next((arg for arg in args if arg is not None), None)
+    if operator in ("$and", "$or"):
+        return all(args) if operator == "$and" else any(args)
+    if operator == "$in":
+        return args[0] in args[1]
+    if operator == "$size":
+        return len(args[0])
+    if operator == "$dateToString":
+        date = evaluate(operand["date"], doc)
+        return None if date is None else date.strftime(operand.get("format", "%Y-%m-%dT%H:%M:%S.%LZ").replace("%L", "000"))
+    raise OperationFailure(f"Unrecognized expression '{operator}'", 168)
+
+
+ACCUMULATORS = ("$sum", "$avg", "$min", "$max", "$first", "$last", "$push", "$addToSet", "$count")
+
+
+def group(docs: Iterable[dict], spec: dict) -> List[dict]:
+    groups: Dict[tuple, dict] = {}
+    states: Dict[tuple, dict] = {}
+    for doc in docs:
+        group_id = evaluate(spec["_id"], doc)
+        key = encode(group_id)
+        if key not in groups:
+            groups[key] = {"_id": group_id}
+            states[key] = {}
+        state = states[key]
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            (operator, expression), = accumulator.items()
+            if operator not in ACCUMULATORS:
+                raise OperationFailure(f"unknown group operator '{operator}'", 15952)
+            value = 1 if operator == "$count" else evaluate(expression, doc)
+            if operator in ("$sum", "$count", "$avg"):
+                total, count = state.get(field, (0, 0))
+                if bracket(value) == NUMBER:
+                    total, count = total + value, count + 1
+                state[field] = (total, count)
+            elif operator in ("$min", "$max"):
+                if value is not None and (field not in state or (
+                    encode(value) < encode(state[field]) if operator == "$min" else encode(value) > encode(state[field])
+                )):
+                    state[field] = value
+            elif operator == "$first":
+                state.setdefault(field, value)
+            elif operator == "$last":
+                state[field] = value
+            else:
+                items = state.setdefault(field, [])
+                if operator == "$push" or value not in items:
+                    items.append(value)
+    results = []
+    for key, result in groups.items():
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            operator = next(iter(accumulator))
+            value = states[key].get(field)
+            if operator in ("$sum", "$count"):
+                value = value[0] if value else 0
+            elif operator == "$avg":
+                value = value[0] / value[1] if value and value[1] else None
+            result[field] = value
+        results.append(result)
+    return results
+
+
+def run_pipeline(docs: Iterable[dict], pipeline: List[dict]) -> List[dict]:
+    docs = list(docs)
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == "$match":
+            test = compile_query(spec)
+            docs = [doc for doc in docs if test(doc)]
+        elif name == "$group":
+            docs = group(docs, spec)
+        elif name == "$sort":
+            docs.sort(key=lambda doc: sort_key(doc, normalize_sort(spec)))
+        elif name == "$skip":
+            docs = docs[spec:]
+        elif name == "$limit":
+            docs = docs[:spec]
+        elif name == "$count":
+            docs = [{spec: len(docs)}] if docs else []
+        elif name in ("$project", "$addFields", "$set"):
+            if name == "$project" and all(value in (0, 1, True, False) for value in spec.values()):
+                docs = [project(doc, spec) for doc in docs]
+                continue
+            reshaped = []
+            for doc in docs:
+                result = copy_value(doc) if name != "$project" else (
+                    {"_id": doc.get("_id")} if spec.get("_id", 1) else {}
+                )
+                for field, expression in spec.items():
+                    if field == "_id" and expression in (0, False):
+                        result.pop("_id", None)
+                    elif expression in (1, True):
+                        value = get_path(doc, field)
+                        if value is not MISSING:
+                            set_path(result, field, value)
+                    elif field != "_id" or expression not in (1, True):
+                        set_path(result, field, evaluate(expression, doc))
+                reshaped.append(result)
+            docs = reshaped
+        elif name == "$unwind":
+            path = (spec if isinstance(spec, str) else spec["path"])[1:]
+            keep_empty = isinstance(spec, dict) and spec.get("preserveNullAndEmptyArrays", False)
+            unwound = []
+            for doc in docs:
+                value = get_path(doc, path)
+                if isinstance(value, list) and value:
+                    for item in value:
+                        item_doc = copy_value(doc)
+                        set_path(item_doc, path, item)
+                        unwound.append(item_doc)
+                elif keep_empty or (value not in (MISSING, None) and not isinstance(value, list)):
+                    unwound.append(doc)
+            docs = unwound
+        else:
+            raise OperationFailure(f"Unrecognized pipeline stage name: '{name}'", 40324)
+    return docs
+
+
+# Collections
+
+class MemoryCursor:
+    """A lazily evaluated find() or aggregate() result with Motor's cursor methods"""
+
+    def __init__(self, run):
+        self._run = run
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+        self._results: Optional[Iterator[dict]] = None
+
+    def sort(self, key_or_list, direction=None) -> "MemoryCursor":
+        self._sort = normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, skip: int) -> "MemoryCursor":
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int) -> "MemoryCursor":
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size: int) -> "MemoryCursor":
+        return self
+
+    def _iterate(self) -> Iterator[dict]:
+        if self._results is None:
+            self._results = iter(self._run(self._sort, self._skip, self._limit))
+        return self._results
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        results = self._iterate()
+        return list(results if length is None else islice(results, length))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        try:
+            return next(self._iterate())
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class MemoryCollection:
+    def __init__(self, database: "MemoryStorage", name: str):
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+        self.docs: Dict[int, dict] = {}
+        self.indexes: Dict[str, Index] = {"_id_": Index("_id_", [("_id", 1)], unique=True)}
+        self.capped: Optional[dict] = None
+        self._capped_bytes = 0
+        self._next_seq = 0
+        self._ttl_checked = 0.0
+
+    # Planning and reading
+
+    def plan(self, query: dict, sort: List[Tuple[str, int]]) -> Plan:
+        best = Plan(self.docs.keys(), not sort, len(self.docs))
+        for index in self.indexes.values():
+            if index.multikey:
+                continue
+            if index.partial is not None and not all(
+                query.get(field) == condition for field, condition in index.partial.items()
+            ):
+                continue
+            plan = self.index_plan(index, query, sort)
+            if plan is not None and (
+                plan.estimate < best.estimate or (plan.estimate == best.estimate and plan.ordered and not best.ordered)
+            ):
+                best = plan
+        return best
+
+    def index_plan(self, index: Index, query: dict, sort: List[Tuple[str, int]]) -> Optional[Plan]:
+        prefixes = [()]
+        used = 0
+        for field in index.fields:
+            points = field_points(query, field)
+            if points is None or len(prefixes) * len(points) > MAX_KEY_PREFIXES:
+                break
+            prefixes = [prefix + (point,) for prefix, point in product(prefixes, points)]
+            used += 1
+        low, high = LOWEST, HIGHEST
+        if used < len(index.fields):
+            low, high = field_range(query, index.fields[used])
+
+        # The index yields the sort order when the sort fields follow the
+        # pinned ones, all in the index's direction or all against it
+        remaining = index.fields[used:]
+        reverse = False
+        ordered = not sort
+        if sort and len(prefixes) == 1 and len(sort) <= len(remaining):
+            if [field for field, _ in sort] == remaining[:len(sort)]:
+                directions = {direction > 0 for _, direction in sort}
+                if len(directions) == 1:
+                    ordered, reverse = True, directions == {False}
+
+        ranged = (low, high) != (LOWEST, HIGHEST)
+        if not used and not ranged and not ordered:
+            return None
+        total = len(self.docs) or 1
+        if used == len(index.fields) and index.unique:
+            estimate = len(prefixes)
+        elif used:
+            estimate = sum(
+                bisect_left(index.entries, (prefix + (HIGHEST,),)) - bisect_left(index.entries, (prefix,))
+                for prefix in prefixes
+            )
+        elif ranged:
+            estimate = (
+                bisect_left(index.entries, ((high, HIGHEST),)) - bisect_left(index.entries, ((low,),))
+            )
+        else:
+            estimate = total
+        if ranged and used:
+            estimate = min(estimate, estimate / 2 + 1)
+        if ordered and sort and not used and not ranged:
+            # A full ordered scan beats sorting only when a limit stops it early
+            estimate = total * 0.9
+
+        def seqs():
+            for prefix in (reversed(prefixes) if reverse else prefixes):
+                yield from index.scan(prefix, low, high, reverse)
+
+        return Plan(seqs(), ordered, estimate)
+
+    def _expire(self):
+        now = time.monotonic()
+        if now - self._ttl_checked < TTL_MONITOR_SECONDS:
+            return
+        self._ttl_checked = now
+        for index in self.indexes.values():
+            if index.expire_after is not None:
+                cutoff = datetime.utcnow().timestamp() - index.expire_after
+                expired = [
+                    seq for seq, doc in self.docs.items()
+                    if isinstance(value := get_path(doc, index.fields[0]), datetime)
+                    and value.replace(tzinfo=timezone.utc).timestamp() < cutoff
+                ]
+                for seq in expired:
+                    self._remove(seq)
+
+    def _select(self, query: Optional[dict], sort: List[Tuple[str, int]] = (), skip: int = 0,
+                limit: int = 0) -> Iterator[Tuple[int, dict]]:
+        self._expire()
+        query = query or {}
+        sort = list(sort)
+        if sort == [("$natural", -1)] or sort == [("$natural", 1)]:
+            seqs = reversed(list(self.docs)) if sort[0][1] < 0 else list(self.docs)
+            plan = Plan(seqs, True, len(self.docs))
+        else:
+            plan = self.plan(query, sort)
+        found = ((seq, self.docs[seq]) for seq in plan.seqs if seq in self.docs)
+        test = compile_query(query)
+        found = ((seq, doc) for seq, doc in found if test(doc))
+        if not plan.ordered:
+            found = iter(sorted(found, key=lambda item: sort_key(item[1], sort)))
+        if skip or limit:
+            found = islice(found, skip, skip + limit if limit else None)
+        return found
+
+    def find(self, filter: Optional[dict] = None, projection=None, *, sort=None, skip: int = 0, limit: int = 0,
+             batch_size: int = 0, **kwargs) -> MemoryCursor:
+        def run(order, cursor_skip, cursor_limit):
+            # Materialize before yielding so that writes during iteration cannot disturb it
+            selected = list(self._select(filter, order, cursor_skip, cursor_limit))
+            return [project(doc, projection) for _, doc in selected]
+
+        cursor = MemoryCursor(run)
+        if sort:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    async def find_one(self, filter: Optional[dict] = None, projection=None, *, sort=None, **kwargs) -> Optional[dict]:
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        for _, doc in self._select(filter, normalize_sort(sort), 0, 1):
+            return project(doc, projection)
+        return None
+
+    async def count_documents(self, filter: dict, skip: int = 0, limit: int = 0, **kwargs) -> int:
+        return sum(1 for _ in self._select(filter, (), skip, limit))
+
+    async def estimated_document_count(self, **kwargs) -> int:
+        return len(self.docs)
+
+    async def distinct(self, key: str, filter: Optional[dict] = None, **kwargs) -> list:
+        values, seen = [], set()
+        for _, doc in self._select(filter):
+            value = get_path(doc, key)
+            for item in (value if isinstance(value, list) else [value]):
+                if item is not MISSING and encode(item) not in seen:
+                    seen.add(encode(item))
+                    values.append(copy_value(item))
+        return values
+
+    def aggregate(self, pipeline: List[dict], **kwargs) -> MemoryCursor:
+        def run(order, cursor_skip, cursor_limit):
+            stages = list(pipeline)
+            query = stages.pop(0)["$match"] if stages and "$match" in stages[0] else {}
+            docs = run_pipeline((doc for _, doc in self._select(query)), stages)
+            return [copy_value(doc) for doc in docs]
+
+        return MemoryCursor(run)
+
+    # Writing
+
+    def _keys(self, doc: dict) -> Dict[str, Optional[tuple]]:
+        return {name: index.key(doc) for name, index in self.indexes.items()}
+
+    def _check_unique(self, keys: Dict[str, Optional[tuple]], seq: Optional[int] = None):
+        for name, key in keys.items():
+            index = self.indexes[name]
+            if index.unique and key is not None:
+                holder = index.holder(key)
+                if holder is not None and holder != seq:
+                    values = ", ".join(
+                        f"{field}: {value[1]!r}" if len(value) > 1 else f"{field}: null"
+                        for field, value in zip(index.fields, key)
+                    )
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self.full_name} index: {name} dup key: {{ {values} }}",
+                        11000, {"index": 0, "code": 11000, "keyPattern": dict(index.keys)},
+                    )
+
+    def _insert(self, doc: dict) -> Any:
+        doc = to_bson(doc)
+        if "_id" not in doc:
+            doc = {"_id": ObjectId(), **doc}
+        keys = self._keys(doc)
+        self._check_unique(keys)
+        seq = self._next_seq
+        self._next_seq += 1
+        self.docs[seq] = doc
+        for name, key in keys.items():
+            self.indexes[name].add(key, seq)
+        if self.capped:
+            self._trim(doc)
+        return doc["_id"]
+
+    def _replace(self, seq: int, new: dict) -> bool:
+        old = self.docs[seq]
+        if new == old:
+            return False
+        old_keys, new_keys = self._keys(old), self._keys(new)
+        changed = {name for name in new_keys if new_keys[name] != old_keys[name]}
+        self._check_unique({name: new_keys[name] for name in changed}, seq)
+        for name in changed:
+            self.indexes[name].remove(old_keys[name], seq)
+            self.indexes[name].add(new_keys[name], seq)
+        self.docs[seq] = new
+        return True
+
+    def _remove(self, seq: int) -> dict:
+        doc = self.docs.pop(seq)
+        for name, key in self._keys(doc).items():
+            self.indexes[name].remove(key, seq)
+        if self.capped:
+            self._capped_bytes -= len(bson.encode(doc))
+        return doc
+
+    def _trim(self, doc: dict):
+        self._capped_bytes += len(bson.encode(doc))
+        while self.docs and (
+            self._capped_bytes > self.capped["size"]
+            or (self.capped.get("max") and len(self.docs) > self.capped["max"])
+        ):
+            self._remove(next(iter(self.docs)))
+
+    def _update(self, query: dict, update: dict, upsert: bool, multi: bool, replace: bool = False) -> dict:
+        """Apply an update; returns a raw result with the before and after documents of the last one"""
+        if replace:
+            if any(key.startswith("$") for key in update):
+                raise ValueError("replacement can not include $ operators")
+        else:
+            check_update(update)
+        result = {"n": 0, "nModified": 0, "before": None, "after": None}
+        for seq, doc in list(self._select(query, (), 0, 0 if multi else 1)):
+            if replace:
+                new = {"_id": doc["_id"], **to_bson(update)}
+            else:
+                new = apply_update(doc, update)
+            result["n"] += 1
+            result["before"] = doc
+            if self._replace(seq, new):
+                result["nModified"] += 1
+            result["after"] = self.docs[seq]
+        if not result["n"] and upsert:
+            seed = upsert_seed(query)
+            new = {**seed, **to_bson(update)} if replace else apply_update(seed, update, inserting=True)
+            if "_id" in seed:
+                new["_id"] = seed["_id"]
+            result["upserted"] = self._insert(new)
+            result["after"] = self.docs[self._next_seq - 1]
+        return result
+
+    async def insert_one(self, document: dict, **kwargs) -> InsertOneResult:
+        inserted_id = self._insert(document)
+        # Like PyMongo, give the caller's document its generated _id
+        document.setdefault("_id", inserted_id)
+        return InsertOneResult(inserted_id, True)
+
+    async def insert_many(self, documents: Iterable[dict], ordered: bool = True, **kwargs) -> InsertManyResult:
+        documents = list(documents)
+        inserted, errors = [], []
+        for position, document in enumerate(documents):
+            try:
+                inserted_id = self._insert(document)
+                document.setdefault("_id", inserted_id)
+                inserted.append(inserted_id)
+            except DuplicateKeyError as e:
+                errors.append({"index": position, "code": 11000, "errmsg": str(e), "op": document})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({
+                "writeErrors": errors, "writeConcernErrors": [], "nInserted": len(inserted),
+                "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": [],
+            })
+        return InsertManyResult(inserted, True)
+
+    async def update_one(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update_result(self._update(filter, update, upsert, multi=False))
+
+    async def update_many(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update_result(self._update(filter, update, upsert, multi=True))
+
+    async def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update_result(self._update(filter, replacement, upsert, multi=False, replace=True))
+
+    @staticmethod
+    def _update_result(raw: dict) -> UpdateResult:
+        result = {"n": raw["n"], "nModified": raw["nModified"], "ok": 1.0}
+        if "upserted" in raw:
+            result["n"] = 1
+            result["upserted"] = raw["upserted"]
+        return UpdateResult(result, True)
+
+    async def find_one_and_update(self, filter: dict, update: dict, projection=None, sort=None, upsert: bool = False,
+                                  return_document: bool = ReturnDocument.BEFORE, **kwargs) -> Optional[dict]:
+        check_update(update)
+        if sort:
+            target = next(self._select(filter, normalize_sort(sort), 0, 1), None)
+            if target is not None:
+                filter = {"_id": target[1]["_id"]}
+        raw = self._update(filter, update, upsert, multi=False)
+        doc = raw["after"] if return_document else raw["before"]
+        return None if doc is None else project(doc, projection)
+
+    async def find_one_and_replace(self, filter: dict, replacement: dict, projection=None, upsert: bool = False,
+                                   return_document: bool = ReturnDocument.BEFORE, **kwargs) -> Optional[dict]:
+        raw = self._update(filter, replacement, upsert, multi=False, replace=True)
+        doc = raw["after"] if return_document else raw["before"]
+        return None if doc is None else project(doc, projection)
+
+    async def find_one_and_delete(self, filter: dict, projection=None, sort=None, **kwargs) -> Optional[dict]:
+        for seq, doc in list(self._select(filter, normalize_sort(sort), 0, 1)):
+            return project(self._remove(seq), projection)
+        return None
+
+    async def delete_one(self, filter: dict, **kwargs) -> DeleteResult:
+        removed = [self._remove(seq) for seq, _ in list(self._select(filter, (), 0, 1))]
+        return DeleteResult({"n": len(removed), "ok": 1.0}, True)
+
+    async def delete_many(self, filter: dict, **kwargs) -> DeleteResult:
+        removed = [self._remove(seq) for seq, _ in list(self._select(filter))]
+        return DeleteResult({"n": len(removed), "ok": 1.0}, True)
+
+    async def bulk_write(self, requests: List[Any], ordered: bool = True, **kwargs) -> BulkWriteResult:
+        result = {
+            "writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+            "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": [],
+        }
+        for position, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    self._insert(request._doc)
+                    result["nInserted"] += 1
+                elif isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+                    raw = self._update(
+                        request._filter, request._doc, request._upsert,
+                        multi=isinstance(request, UpdateMany), replace=isinstance(request, ReplaceOne),
+                    )
+                    if "upserted" in raw:
+                        result["nUpserted"] += 1
+                        result["upserted"].append({"index": position, "_id": raw["upserted"]})
+                    else:
+                        result["nMatched"] += raw["n"]
+                        result["nModified"] += raw["nModified"]
+                elif isinstance(request, (DeleteOne, DeleteMany)):
+                    limit = 1 if isinstance(request, DeleteOne) else 0
+                    removed = [self._remove(seq) for seq, _ in list(self._select(request._filter, (), 0, limit))]
+                    result["nRemoved"] += len(removed)
+                else:
+                    raise TypeError(f"{request!r} is not a valid request")
+            except WriteError as e:
+                result["writeErrors"].append({"index": position, "code": e.code, "errmsg": str(e), "op": request})
+                if ordered:
+                    break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    # Indexes and administration
+
+    async def create_indexes(self, indexes: List[IndexModel], **kwargs) -> List[str]:
+        names = []
+        for model in indexes:
+            spec = dict(model.document)
+            name = spec.pop("name")
+            keys = list(spec.pop("key").items())
+            existing = self.indexes.get(name)
+            if existing is not None:
+                if existing.keys != keys:
+                    raise OperationFailure(f"An existing index has the same name as the requested index: {name}", 86)
+                names.append(name)
+                continue
+            index = Index(
+                name, keys, unique=spec.pop("unique", False), partial=spec.pop("partialFilterExpression", None),
+                expire_after=spec.pop("expireAfterSeconds", None), **spec
+            )
+            for seq, doc in self.docs.items():
+                key = index.key(doc)
+                if index.unique and key is not None and index.holder(key) is not None:
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self.full_name} index: {name}", 11000
+                    )
+                index.add(key, seq)
+            self.indexes[name] = index
+            names.append(name)
+        return names
+
+    async def create_index(self, keys, **kwargs) -> str:
+        keys = normalize_sort(keys)
+        kwargs.setdefault("name", "_".join(f"{field}_{direction}" for field, direction in keys))
+        return (await self.create_indexes([IndexModel(keys, **kwargs)]))[0]
+
+    async def index_information(self) -> Dict[str, dict]:
+        return {name: index.info() for name, index in self.indexes.items()}
+
+    async def drop_index(self, name: str, **kwargs):
+        if name == "_id_" or name not in self.indexes:
+            raise OperationFailure(f"index not found with name [{name}]", 27)
+        del self.indexes[name]
+
+    async def drop(self, **kwargs):
+        self.database.collections.pop(self.name, None)
+        self.docs.clear()
+
+
+class MemoryFile:
+    def __init__(self, doc: dict):
+        self._id = doc["_id"]
+        self.filename = doc["filename"]
+        self.length = doc["length"]
+        self.metadata = doc.get("metadata")
+        self.upload_date = doc["uploadDate"]
+        self._data = doc["data"]
+
+    async def read(self, size: int = -1) -> bytes:
+        return self._data if size < 0 else self._data[:size]
+
+
+class MemoryGridFSBucket:
+    """GridFS upload, download and delete; files are stored whole in <bucket>.files"""
+
+    def __init__(self, database: "MemoryStorage", bucket_name: str = "fs"):
+        self.files = database[f"{bucket_name}.files"]
+
+    async def upload_from_stream(self, filename: str, source, metadata: Optional[dict] = None, **kwargs) -> ObjectId:
+        data = source if isinstance(source, bytes) else source.read()
+        file_id = ObjectId()
+        await self.files.insert_one({
+            "_id": file_id, "filename": filename, "length": len(data), "uploadDate": datetime.utcnow(),
+            "metadata": metadata, "data": data,
+        })
+        return file_id
+
+    async def open_download_stream(self, file_id) -> MemoryFile:
+        doc = await self.files.find_one({"_id": file_id})
+        if doc is None:
+            raise NoFile(f"no file in gridfs collection {self.files.full_name} with _id {file_id!r}")
+        return MemoryFile(doc)
+
+    async def delete(self, file_id):
+        result = await self.files.delete_one({"_id": file_id})
+        if not result.deleted_count:
+            raise NoFile(f"Received delete request for file {file_id!r} that does not exist")
+
+
+class MemoryStorage:
+    """A database held in this process; nothing persists when it exits"""
+
+    backend = "memory"
+
+    def __init__(self, name: str = "library"):
+        self.name = name
+        self.collections: Dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        collection = self.collections.get(name)
+        if collection is None:
+            collection = self.collections[name] = MemoryCollection(self, name)
+        return collection
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def list_collection_names(self, **kwargs) -> List[str]:
+        return sorted(self.collections)
+
+    async def create_collection(self, name: str, capped: bool = False, size: int = 0, max: int = 0, **kwargs):
+        if name in self.collections:
+            raise CollectionInvalid(f"collection {name} already exists")
+        collection = self[name]
+        if capped:
+            collection.capped = {"size": size, "max": max}
+        return collection
+
+    async def command(self, command, **kwargs) -> dict:
+        name = command if isinstance(command, str) else next(iter(command))
+        if name == "ping":
+            return {"ok": 1.0}
+        raise OperationFailure(f"no such command: '{name}'", 59)
+
+    def watch(self, pipeline=None, **kwargs):
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", 40573)
+
+    def gridfs_bucket(self, bucket_name: str) -> MemoryGridFSBucket:
+        return MemoryGridFSBucket(self, bucket_name)
+
+    async def drop_database(self):
+        self.collections.clear()
+
+    def close(self):
+        pass
@@ -0,0 +1,188 @@
+"""
+Minimal Prometheus instrumentation: labelled counters and histograms rendered
+in the text exposition format, and a PyMongo CommandListener that times every
+database command per collection
+Metrics are per worker process; scrape each worker (or aggregate upstream)
+"""
+
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Commands whose first argument (or "collection" for getMore) names a collection
+COLLECTION_COMMANDS = {
+    "find", "insert", "update", "delete", "aggregate", "count", "distinct",
+    "findAndModify", "createIndexes", "listIndexes", "drop",
+}
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in sorted(values):
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> per-bucket (non-cumulative) counts, the last one for +Inf, then the sum
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in sorted(snapshot):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series[:-1]):
+                cumulative += count
+                le = 'le="' + (bound if isinstance(bound, str) else format_value(bound)) + '"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(series[-1])}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class GaugeFunction:
+    """A gauge whose samples are read from a callback at scrape time"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 collect: Callable[[], Iterable[Tuple[tuple, float]]]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for labels, value in self.collect():
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Times MongoDB commands per collection and counts the documents they return or write
+
+    Command replies do not say how many documents the server examined; the
+    slow-operation log captures that through explain() for slow commands.
+    """
+
+    def __init__(self, registry: Registry):
+        self.enabled = True
+        self.duration = registry.register(Histogram(
+            "mongodb_command_duration_seconds", "MongoDB command latency", ("collection", "command")
+        ))
+        self.documents = registry.register(Counter(
+            "mongodb_command_documents_total",
+            "Documents returned by reads or affected by writes", ("collection", "command")
+        ))
+        self.failures = registry.register(Counter(
+            "mongodb_command_failures_total", "Failed MongoDB commands", ("collection", "command")
+        ))
+        self._pending: Dict[tuple, str] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if not self.enabled:
+            return
+        command = event.command
+        if event.command_name == "getMore":
+            collection = command.get("collection")
+        elif event.command_name in COLLECTION_COMMANDS:
+            collection = command.get(event.command_name)
+        else:
+            collection = None
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else "-"
+
+    def _finish(self, event) -> str:
+        with self._lock:
+            return self._pending.pop((event.connection_id, event.request_id), None)
+
+    def succeeded(self, event):
+        collection = self._finish(event)
+        if collection is None:
+            return
+        labels = (collection, event.command_name)
+        self.duration.observe(labels, event.duration_micros / 1e6)
+        reply = event.reply
+        cursor = reply.get("cursor")
+        if cursor is not None:
+            count = len(cursor.get("firstBatch", cursor.get("nextBatch", ())))
+        else:
+            count = reply.get("n", 0)
+        if count:
+            self.documents.inc(labels, count)
+
+    def failed(self, event):
+        collection = self._finish(event)
+        if collection is None:
+            return
+        labels = (collection, event.command_name)
+        self.duration.observe(labels, event.duration_micros / 1e6)
+        self.failures.inc(labels)
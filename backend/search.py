@@ -0,0 +1,246 @@
+"""
+In-process inverted index used by the /api/search routes
+Tokenizes a few text fields per document and answers prefix queries
+with relevance-ranked document ids
+"""
+
+import heapq
+import math
+import re
+from bisect import bisect_left
+from itertools import islice
+from operator import attrgetter
+from typing import AbstractSet, Dict, Iterable, List, Optional
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Each query token may expand to at most this many vocabulary terms; shorter
+# tokens, such as the single digits of an ISBN, only match whole terms
+MAX_PREFIX_EXPANSION = 2000
+MIN_PREFIX_LENGTH = 2
+
+# Rough cost of checking one candidate's terms relative to one posting entry
+CANDIDATE_PROBE_COST = 4
+
+# Bounds on the work for a query with a limit: postings of its most
+# selective token looked at, and matches ranked together per tier of results
+MAX_SCANNED_POSTINGS = 2000
+RANKED_TIER_SIZE = 250
+
+# Exact term matches rank above prefix-only matches
+PREFIX_MATCH_FACTOR = 0.6
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased alphanumeric runs, e.g. "978-0-06-112008-4" -> 978, 0, 06, 112008, 4"""
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+class InvertedIndex:
+    """Maps terms to postings of {doc_id: field weight} over a fixed set of fields"""
+
+    def __init__(self, fields: Dict[str, float]):
+        self.fields = fields
+        self.postings: Dict[str, Dict[str, float]] = {}
+        self.doc_terms: Dict[str, Dict[str, float]] = {}
+        self.vocabulary: List[str] = []
+        self._vocabulary_dirty = False
+
+    def __len__(self):
+        return len(self.doc_terms)
+
+    def _document_terms(self, doc: dict) -> Dict[str, float]:
+        weights: Dict[str, float] = {}
+        for field, weight in self.fields.items():
+            value = str(doc.get(field) or "")
+            tokens = tokenize(value)
+            # Also index identifiers (no whitespace) with their punctuation
+            # stripped so that "9780061120084" finds "978-0-06-112008-4"
+            if len(tokens) > 1 and len(value.split()) == 1:
+                tokens.append("".join(tokens))
+            for token in tokens:
+                weights[token] = max(weights.get(token, 0.0), weight)
+        return weights
+
+    def add(self, doc: dict):
+        doc_id = doc["id"]
+        if doc_id in self.doc_terms:
+            self.remove(doc_id)
+        terms = self._document_terms(doc)
+        for term, weight in terms.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                self._vocabulary_dirty = True
+            posting[doc_id] = weight
+        self.doc_terms[doc_id] = terms
+
+    def remove(self, doc_id: str):
+        for term in self.doc_terms.pop(doc_id, []):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(doc_id, None)
+            if not posting:
+                del self.postings[term]
+                self._vocabulary_dirty = True
+
+    @classmethod
+    def build(cls, fields: Dict[str, float], docs: Iterable[dict]) -> "InvertedIndex":
+        """Build a new index; CPU bound, so callers may run it in a thread"""
+        index = cls(fields)
+        for doc in docs:
+            index.add(doc)
+        index._refresh_vocabulary()
+        return index
+
+    def replace_with(self, other: "InvertedIndex"):
+        self.postings = other.postings
+        self.doc_terms = other.doc_terms
+        self.vocabulary = other.vocabulary
+        self._vocabulary_dirty = other._vocabulary_dirty
+
+    def _refresh_vocabulary(self):
+        if self._vocabulary_dirty:
+            self.vocabulary = sorted(self.postings)
+            self._vocabulary_dirty = False
+
+    def _expand(self, token: str) -> List[str]:
+        if len(token) < MIN_PREFIX_LENGTH:
+            return [token] if token in self.postings else []
+        self._refresh_vocabulary()
+        start = bisect_left(self.vocabulary, token)
+        # Tokens are [a-z0-9] runs, so every term with the prefix sorts before token + "{"
+        end = bisect_left(self.vocabulary, token + "{", start, min(start + MAX_PREFIX_EXPANSION, len(self.vocabulary)))
+        return self.vocabulary[start:end]
+
+    def _matching(self, token: "QueryToken", matched: Optional[AbstractSet[str]]) -> AbstractSet[str]:
+        """Documents containing any of the token's terms, restricted to matched if given"""
+        if matched is not None and not token.has_documents() and len(matched) * CANDIDATE_PROBE_COST < token.size:
+            # Look the terms up in the few surviving documents instead of
+            # walking every posting the prefix expands to
+            return {doc_id for doc_id in matched if not token.terms.isdisjoint(self.doc_terms[doc_id])}
+        # Set operations on the posting keys run in C, so even prefixes of
+        # common words that cover a large share of documents stay cheap
+        documents = token.documents()
+        return documents if matched is None else matched & documents
+
+    def _score(self, doc_id: str, tokens: List["QueryToken"]) -> float:
+        """Sum over query tokens of the document's best weighted term for each"""
+        terms = self.doc_terms[doc_id]
+        total = 0.0
+        for token in tokens:
+            total += max(terms[term] * token.boost(term) for term in token.terms.intersection(terms))
+        return total
+
+    def _rank(self, doc_ids: Iterable[str], tokens: List["QueryToken"], limit: Optional[int]) -> List[str]:
+        scored = [(-self._score(doc_id, tokens), doc_id) for doc_id in doc_ids]
+        # Ties go by id so that every worker ranks the same way
+        ranked = sorted(scored) if limit is None else heapq.nsmallest(limit, scored)
+        return [doc_id for _, doc_id in ranked]
+
+    def _select(self, tokens: List["QueryToken"], count: int) -> List[str]:
+        """
+        Up to count documents matching every token, taken from the most
+        selective token's highest-boost terms first. After MAX_SCANNED_POSTINGS
+        of its postings the rest come from the full set of matches by id,
+        so that sparse matches are still all found
+        """
+        first, rest = tokens[0], tokens[1:]
+        selected: List[str] = []
+        seen = set()
+        budget = MAX_SCANNED_POSTINGS
+        # Highest boost first: the exact term, then the rarest
+        postings = self.postings
+        for term in sorted(first.terms, key=lambda term: (term != first.token, len(postings[term]), term)):
+            if budget <= 0:
+                break
+            posting = postings[term]
+            hits: AbstractSet[str] = posting.keys() if len(posting) <= budget else set(islice(posting, budget))
+            budget -= len(hits)
+            for token in rest:
+                hits = self._matching(token, hits)
+                if not hits:
+                    break
+            # Sorted so that the same documents make the cut in every worker
+            hits = sorted(hits - seen)
+            seen.update(hits)
+            selected += hits[:count - len(selected)]
+            if len(selected) == count:
+                return selected
+        if budget <= 0:
+            matched: Optional[AbstractSet[str]] = None
+            for token in tokens:
+                matched = self._matching(token, matched)
+            selected += sorted(matched - seen)[:count - len(selected)]
+        return selected
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[str]:
+        """Return ids of documents matching every query token as a prefix, best first
+
+        Without a limit every match is ranked. With one, common words cost
+        no more than rare ones: matches are gathered from the highest-boost
+        terms of the most selective token (see _select) and ranked in tiers
+        of RANKED_TIER_SIZE, so only a query matching more than one tier is
+        ranked approximately. The hits for a smaller limit are always the
+        first hits for a larger one, as offset pagination needs.
+        """
+        tokens = []
+        for token in dict.fromkeys(tokenize(query)):
+            terms = self._expand(token)
+            if not terms:
+                return []
+            tokens.append(QueryToken(self, token, terms))
+        if not tokens:
+            return []
+
+        # Start from the most selective token so later tokens only need to
+        # check the surviving documents
+        tokens.sort(key=attrgetter("size"))
+        if limit is None:
+            matched: Optional[AbstractSet[str]] = None
+            for token in tokens:
+                matched = self._matching(token, matched)
+                if not matched:
+                    return []
+            return self._rank(matched, tokens, None)
+
+        tiers = -(-limit // RANKED_TIER_SIZE)
+        selected = self._select(tokens, tiers * RANKED_TIER_SIZE)
+        ranked: List[str] = []
+        for start in range(0, len(selected), RANKED_TIER_SIZE):
+            ranked += self._rank(selected[start:start + RANKED_TIER_SIZE], tokens, None)
+        return ranked[:limit]
+
+
+class QueryToken:
+    """One query token's expansion, with term boosts worked out as scoring needs them"""
+
+    def __init__(self, index: InvertedIndex, token: str, terms: List[str]):
+        self.index = index
+        self.token = token
+        self.terms = set(terms)
+        self.size = sum(map(len, map(index.postings.__getitem__, terms)))
+        self._boosts: Dict[str, float] = {}
+        self._documents: Optional[AbstractSet[str]] = None
+
+    def has_documents(self) -> bool:
+        """Whether documents() is free: a single posting, or already worked out"""
+        return len(self.terms) == 1 or self._documents is not None
+
+    def documents(self) -> AbstractSet[str]:
+        """Every document containing one of the terms"""
+        if self._documents is None:
+            postings = self.index.postings
+            if len(self.terms) == 1:
+                self._documents = postings[next(iter(self.terms))].keys()
+            else:
+                self._documents = set().union(*(postings[term] for term in self.terms))
+        return self._documents
+
+    def boost(self, term: str) -> float:
+        boost = self._boosts.get(term)
+        if boost is None:
+            idf = math.log(1 + (len(self.index.doc_terms) or 1) / len(self.index.postings[term]))
+            boost = self._boosts[term] = (1.0 if term == self.token else PREFIX_MATCH_FACTOR) * idf
+        return boost
@@ -1,25 +1,837 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, Response, UploadFile
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.responses import StreamingResponse
+from pymongo import ASCENDING, IndexModel, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+from gridfs.errors import NoFile
+from PIL import Image, UnidentifiedImageError
 import os
+import asyncio
 import logging
+import base64
+import binascii
+import csv
+import zlib
+from functools import lru_cache
+import hashlib
+import io
+import json
+import re
+import time
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, TypeAdapter
+from typing import Any, Dict, List, Optional, Type
 import uuid
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+import analytics
+import fines
+from search import InvertedIndex
+from cache import LRUCache
+from events import EventHub
+from storage import open_storage
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, CommandMetrics, GaugeFunction, Histogram, Registry
+from slow_queries import COLLECTION_NAME as SLOW_QUERY_COLLECTION, SlowQueryLog
+try:
+    import orjson
+except ImportError:  # pragma: no cover - falls back to Pydantic's encoder
+    orjson = None
+from catalogue_import import DEFAULT_CHUNK_SIZE, ImportReport, detect_format, import_books, iter_rows
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# Prometheus metrics for requests and database commands, served at /metrics
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+metrics_registry = Registry()
+command_metrics = CommandMetrics(metrics_registry)
+command_metrics.enabled = METRICS_ENABLED
+request_duration = metrics_registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route and status", ("method", "route", "status")
+))
+
+# Commands slower than the threshold are explained and kept in a capped
+# collection, newest first at /api/admin/slow-queries; 0 disables the log
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100))
+SLOW_QUERY_LOG_BYTES = int(os.environ.get('SLOW_QUERY_LOG_BYTES', 16 * 1024 * 1024))
+SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS = float(os.environ.get('SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS', 60))
+slow_query_log = SlowQueryLog(SLOW_QUERY_THRESHOLD_MS, SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS, SLOW_QUERY_LOG_BYTES)
+
+# Database connection. STORAGE_BACKEND=memory swaps MongoDB for the
+# in-process engine (see storage.py). Pool settings apply per worker
+# process; unset ones keep the driver defaults
+MONGO_CLIENT_OPTIONS = {
+    'maxPoolSize': ('MONGO_MAX_POOL_SIZE', int),
+    'minPoolSize': ('MONGO_MIN_POOL_SIZE', int),
+    'maxIdleTimeMS': ('MONGO_MAX_IDLE_TIME_MS', int),
+    'waitQueueTimeoutMS': ('MONGO_WAIT_QUEUE_TIMEOUT_MS', int),
+    'connectTimeoutMS': ('MONGO_CONNECT_TIMEOUT_MS', int),
+    'socketTimeoutMS': ('MONGO_SOCKET_TIMEOUT_MS', int),
+    'serverSelectionTimeoutMS': ('MONGO_SERVER_SELECTION_TIMEOUT_MS', int),
+    # Comma-separated, in order of preference: zstd, snappy, zlib
+    'compressors': ('MONGO_COMPRESSORS', str),
+}
+
+def mongo_client_options() -> Dict[str, Any]:
+    options = {}
+    for option, (variable, convert) in MONGO_CLIENT_OPTIONS.items():
+        value = os.environ.get(variable, '').strip()
+        if value:
+            options[option] = convert(value)
+    return options
+
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo')
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+db = open_storage(
+    STORAGE_BACKEND, mongo_url, os.environ['DB_NAME'],
+    event_listeners=[command_metrics, slow_query_log], **mongo_client_options()
+)
+
+# Member pictures live in GridFS; member documents only keep the file ids
+# and a content hash that doubles as the ETag
+PICTURE_THUMBNAIL_PX = int(os.environ.get('PICTURE_THUMBNAIL_PX', 128))
+PICTURE_CACHE_SECONDS = int(os.environ.get('PICTURE_CACHE_SECONDS', 86400))
+
+# Background jobs. Startup migrations and the jobs that maintain shared
+# state run in one worker at a time, whichever holds the job's lease; a
+# lease that is not renewed expires so another worker takes the job over
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+STARTUP_LEASE = "startup"
+STARTUP_LEASE_SECONDS = float(os.environ.get('STARTUP_LEASE_SECONDS', 120))
+STARTUP_WAIT_SECONDS = 1
+OVERDUE_SWEEP_INTERVAL_SECONDS = float(os.environ.get('OVERDUE_SWEEP_INTERVAL_SECONDS', 300))
+STATS_RECONCILE_INTERVAL_SECONDS = float(os.environ.get('STATS_RECONCILE_INTERVAL_SECONDS', 900))
+
+# Dashboard statistics are materialized in a single document, kept current
+# with $inc by the write routes and periodically reconciled
+STATS_ID = "dashboard"
+STATS_FIELDS = ["total_books", "total_members", "total_copies", "available_copies", "overdue_books"]
+
+# Per-collection version counters behind the ETag and Last-Modified headers;
+# the epoch changes if the document is ever recreated so old ETags can't match
+VERSIONS_ID = "versions"
+VERSIONED_COLLECTIONS = ["books", "members", "transactions"]
+
+# Circulation analytics are served from daily rollups (see analytics.py).
+# The rollup job recomputes every day from the watermark on; the watermark
+# only advances to the start of the day the job began
+ANALYTICS_ID = "analytics"
+ANALYTICS_ROLLUP_INTERVAL_SECONDS = float(os.environ.get('ANALYTICS_ROLLUP_INTERVAL_SECONDS', 300))
+ANALYTICS_DEFAULT_DAYS = int(os.environ.get('ANALYTICS_DEFAULT_DAYS', 365))
+LOAN_ROLLUP_PROJECTION = {"_id": 0, "book_id": 1, "member_id": 1, "checkout_date": 1, "return_date": 1}
+
+# Overdue fines: charged per whole day past due beyond the grace period,
+# optionally capped per loan; FINE_MAX is empty for no cap
+FINE_PER_DAY = float(os.environ.get('FINE_PER_DAY', 0.25))
+FINE_GRACE_DAYS = int(os.environ.get('FINE_GRACE_DAYS', 0))
+FINE_MAX = os.environ.get('FINE_MAX', '')
+OVERDUE_REPORT_PROJECTION = {"_id": 0, **{field: 1 for field in fines.LOAN_FIELDS}}
+
+# Loans that still hold a copy; "overdue" is set by the background sweeper
+ACTIVE_LOAN_STATUSES = ["borrowed", "overdue"]
+
+# Holds: a FIFO queue per book. A copy that comes back goes to the head of
+# the queue rather than the shelf, and is set aside for HOLD_PICKUP_DAYS.
+# Books count their waiting holds so that returning a book nobody waits for
+# stays a single update
+HOLD_PICKUP_DAYS = int(os.environ.get('HOLD_PICKUP_DAYS', 3))
+HOLD_SWEEP_INTERVAL_SECONDS = float(os.environ.get('HOLD_SWEEP_INTERVAL_SECONDS', 300))
+ACTIVE_HOLD_STATUSES = ["waiting", "ready"]
+
+# Copies free for walk-in checkouts: a returned copy is on the shelf for a
+# moment before it is set aside, and must not go to anyone but the queue
+FREE_COPIES = {"$subtract": ["$available_copies", {"$ifNull": ["$waiting_holds", 0]}]}
+
+# Bulk circulation
+MAX_BULK_ITEMS = 5000
+
+# Pagination
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# List and search routes encode projection-shaped documents straight to JSON
+# instead of building a model per item and validating it again on the way out
+FAST_SERIALIZATION = os.environ.get('FAST_SERIALIZATION', 'true').lower() in ('1', 'true', 'yes')
+
+# Full-text search: per-process inverted indexes, built at startup, kept
+# current by the write routes and refreshed periodically from updated_at and
+# tombstones to pick up other workers' writes
+SEARCH_INDEX_REFRESH_SECONDS = float(os.environ.get('SEARCH_INDEX_REFRESH_SECONDS', 60))
+book_search_index = InvertedIndex({"title": 3.0, "isbn": 3.0, "author": 2.0})
+member_search_index = InvertedIndex({"name": 3.0, "student_id": 3.0, "email": 1.0})
+search_refreshed_at: Dict[str, datetime] = {}
+
+# Read-through caches for single book and member documents, invalidated by
+# this worker's writes; the TTL bounds staleness from other workers' writes
+BOOK_CACHE_SIZE = int(os.environ.get('BOOK_CACHE_SIZE', 10000))
+MEMBER_CACHE_SIZE = int(os.environ.get('MEMBER_CACHE_SIZE', 10000))
+CACHE_TTL_SECONDS = float(os.environ.get('CACHE_TTL_SECONDS', 30))
+book_cache = LRUCache(BOOK_CACHE_SIZE, CACHE_TTL_SECONDS)
+member_cache = LRUCache(MEMBER_CACHE_SIZE, CACHE_TTL_SECONDS)
+
+# Delta sync: records are stamped with updated_at on every write and deletes
+# leave a tombstone. Sync only hands out records older than the settle window
+# so that writes still in flight (or stamped by a worker with a slightly
+# behind clock) are never skipped by a token that has already moved past them
+SYNC_SETTLE_SECONDS = float(os.environ.get('SYNC_SETTLE_SECONDS', 5))
+SYNC_TOMBSTONE_TTL_DAYS = int(os.environ.get('SYNC_TOMBSTONE_TTL_DAYS', 30))
+SYNC_COLLECTIONS = ["books", "members", "transactions"]
+DEFAULT_SYNC_LIMIT = 500
+MAX_SYNC_LIMIT = 5000
+
+# Server-Sent Events: one change stream watcher per worker feeds every
+# connected client; without a replica set the write routes publish instead
+CHANGE_STREAMS_ENABLED = os.environ.get('CHANGE_STREAMS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+SSE_KEEPALIVE_SECONDS = float(os.environ.get('SSE_KEEPALIVE_SECONDS', 15))
+SSE_QUEUE_SIZE = int(os.environ.get('SSE_QUEUE_SIZE', 1000))
+CHANGE_STREAM_RETRY_SECONDS = 5
+BOOK_EVENT_FIELDS = ["id", "title", "total_copies", "available_copies"]
+TRANSACTION_EVENT_FIELDS = ["id", "book_id", "member_id", "status", "due_date", "return_date"]
+event_hub = EventHub(SSE_QUEUE_SIZE, lambda data: dump_json(data))
+
+# /readyz fails until startup has finished and again once shutdown begins,
+# so that a load balancer stops routing to a worker before it exits
+HEALTH_CHECK_TIMEOUT_SECONDS = float(os.environ.get('HEALTH_CHECK_TIMEOUT_SECONDS', 2))
+ready = False
+
+logger = logging.getLogger(__name__)
+
+# Declared indexes per collection. Names are fixed so that startup can
+# compare them with what the database actually has and report drift.
+INDEXES = {
+    "books": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("isbn", ASCENDING)], name="isbn_unique", unique=True),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="created_at_id"),
+        IndexModel([("updated_at", ASCENDING), ("id", ASCENDING)], name="updated_at_id"),
+        # Books with a hold queue, for the hold sweep; the rest are left out
+        IndexModel(
+            [("waiting_holds", ASCENDING)],
+            name="waiting_holds_queued", partialFilterExpression={"waiting_holds": {"$gt": 0}}
+        ),
+    ],
+    "members": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("student_id", ASCENDING)], name="student_id_unique", unique=True),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="created_at_id"),
+        IndexModel([("updated_at", ASCENDING), ("id", ASCENDING)], name="updated_at_id"),
+    ],
+    "transactions": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel(
+            [("book_id", ASCENDING), ("member_id", ASCENDING), ("status", ASCENDING)],
+            name="book_id_member_id_status"
+        ),
+        # At most one open loan of a book per member; "active" is set on
+        # checkout and removed on return
+        IndexModel(
+            [("book_id", ASCENDING), ("member_id", ASCENDING)],
+            name="active_loan_unique", unique=True, partialFilterExpression={"active": True}
+        ),
+        IndexModel([("member_id", ASCENDING), ("status", ASCENDING)], name="member_id_status"),
+        IndexModel([("status", ASCENDING), ("due_date", ASCENDING)], name="status_due_date"),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="created_at_id"),
+        IndexModel([("updated_at", ASCENDING), ("id", ASCENDING)], name="updated_at_id"),
+    ],
+    "holds": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # The queue itself; only waiting holds are indexed, so the head of a
+        # book's queue is the first entry whatever its history
+        IndexModel(
+            [("book_id", ASCENDING), ("position", ASCENDING)],
+            name="book_id_position", unique=True, partialFilterExpression={"status": "waiting"}
+        ),
+        # At most one open hold of a book per member; "active" is set while
+        # the hold is waiting or ready
+        IndexModel(
+            [("book_id", ASCENDING), ("member_id", ASCENDING)],
+            name="active_hold_unique", unique=True, partialFilterExpression={"active": True}
+        ),
+        IndexModel([("member_id", ASCENDING), ("created_at", ASCENDING)], name="member_id_created_at"),
+        IndexModel([("status", ASCENDING), ("expires_at", ASCENDING)], name="status_expires_at"),
+    ],
+    "circulation_daily": [
+        IndexModel([("day", ASCENDING)], name="day"),
+    ],
+    "book_circulation_daily": [
+        IndexModel([("day", ASCENDING)], name="day"),
+    ],
+    "book_circulation_monthly": [
+        IndexModel([("month", ASCENDING)], name="month"),
+    ],
+    "tombstones": [
+        IndexModel([("updated_at", ASCENDING), ("id", ASCENDING)], name="updated_at_id"),
+        IndexModel(
+            [("deleted_at", ASCENDING)],
+            name="deleted_at_ttl", expireAfterSeconds=SYNC_TOMBSTONE_TTL_DAYS * 86400
+        ),
+    ],
+}
+
+def index_signature(spec: dict) -> tuple:
+    keys = tuple(
+        (field, direction if isinstance(direction, str) else int(direction))
+        for field, direction in dict(spec["key"]).items()
+    )
+    return (
+        keys,
+        bool(spec.get("unique", False)),
+        bool(spec.get("sparse", False)),
+        spec.get("partialFilterExpression"),
+        spec.get("expireAfterSeconds"),
+    )
+
+async def ensure_indexes():
+    """Create missing declared indexes and log any drift; safe to run repeatedly"""
+    for collection_name, models in INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        
+        for model in models:
+            spec = model.document
+            name = spec["name"]
+            if name not in existing:
+                try:
+                    await collection.create_indexes([model])
+                    logger.info("Created index %s.%s", collection_name, name)
+                except OperationFailure as e:
+                    logger.error("Could not create index %s.%s: %s", collection_name, name, e)
+            elif index_signature(existing[name]) != index_signature(spec):
+                logger.warning(
+                    "Index drift on %s.%s: declared %s, found %s",
+                    collection_name, name, index_signature(spec), index_signature(existing[name])
+                )
+        
+        declared = {model.document["name"] for model in models}
+        for name in sorted(existing.keys() - declared - {"_id_"}):
+            logger.warning("Undeclared index %s.%s", collection_name, name)
+
+async def mark_active_loans():
+    """Backfill the "active" marker used by the active_loan_unique index"""
+    await db.transactions.update_many(
+        {"status": {"$in": ACTIVE_LOAN_STATUSES}, "active": {"$exists": False}},
+        {"$set": {"active": True}}
+    )
+
+async def backfill_updated_at():
+    """Stamp documents written before updated_at existed so delta sync sees them once"""
+    now = datetime.utcnow()
+    for collection_name in SYNC_COLLECTIONS:
+        await db[collection_name].update_many({"updated_at": {"$exists": False}}, {"$set": {"updated_at": now}})
+
+async def record_tombstone(collection_name: str, doc_id: str):
+    now = datetime.utcnow()
+    await db.tombstones.insert_one(
+        {"id": doc_id, "collection": collection_name, "deleted_at": now, "updated_at": now}
+    )
+
+def bson_now() -> datetime:
+    """The current time truncated to BSON's millisecond precision, so it compares equal once stored"""
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+def overdue_filter(now: datetime) -> dict:
+    return {"status": {"$in": ACTIVE_LOAN_STATUSES}, "due_date": {"$lt": now}}
+
+async def mark_overdue_loans() -> int:
+    now = datetime.utcnow()
+    result = await db.transactions.update_many(
+        {"status": "borrowed", "due_date": {"$lt": now}},
+        {"$set": {"status": "overdue", "updated_at": now}}
+    )
+    if result.modified_count:
+        await bump_stats(overdue_books=result.modified_count)
+        await touch_collections("transactions")
+        await publish_changes()
+        logger.info("Marked %d loans as overdue", result.modified_count)
+    return result.modified_count
+
+async def bump_stats(**deltas):
+    await db.stats.update_one({"_id": STATS_ID}, {"$inc": deltas}, upsert=True)
+
+async def touch_collections(*names: str):
+    """Record a write to the named collections for conditional GETs"""
+    now = datetime.utcnow()
+    await db.stats.update_one(
+        {"_id": VERSIONS_ID},
+        {
+            "$inc": {name: 1 for name in names},
+            "$max": {f"{name}_modified": now for name in names},
+            "$setOnInsert": {"epoch": uuid.uuid4().hex}
+        },
+        upsert=True
+    )
+
+async def get_versions() -> dict:
+    versions = await db.stats.find_one({"_id": VERSIONS_ID})
+    if not versions:
+        await touch_collections(*VERSIONED_COLLECTIONS)
+        versions = await db.stats.find_one({"_id": VERSIONS_ID})
+    return versions
+
+def dashboard_stats(stats: dict) -> dict:
+    return {
+        "total_books": stats.get("total_books", 0),
+        "total_members": stats.get("total_members", 0),
+        "total_copies": stats.get("total_copies", 0),
+        "borrowed_books": stats.get("total_copies", 0) - stats.get("available_copies", 0),
+        "available_copies": stats.get("available_copies", 0),
+        "overdue_books": stats.get("overdue_books", 0)
+    }
+
+async def compute_stats() -> dict:
+    books_stats = await db.books.aggregate([
+        {
+            "$group": {
+                "_id": None,
+                "total_books": {"$sum": 1},
+                "total_copies": {"$sum": "$total_copies"},
+                "available_copies": {"$sum": "$available_copies"}
+            }
+        }
+    ]).to_list(1)
+    stats = {
+        "total_books": books_stats[0]["total_books"] if books_stats else 0,
+        "total_copies": books_stats[0]["total_copies"] if books_stats else 0,
+        "available_copies": books_stats[0]["available_copies"] if books_stats else 0,
+    }
+    stats["total_members"] = await db.members.count_documents({})
+    # The same loans the sweeper counted in: a loan past due that it has not
+    # marked yet is counted when it is marked, not here as well
+    stats["overdue_books"] = await db.transactions.count_documents({"status": "overdue"})
+    return stats
+
+async def reconcile_stats(log_drift: bool = True) -> dict:
+    """Recompute the materialized stats from scratch and correct any drift"""
+    current = await db.stats.find_one({"_id": STATS_ID})
+    stats = await compute_stats()
+    if current is None:
+        await db.stats.update_one({"_id": STATS_ID}, {"$setOnInsert": stats}, upsert=True)
+        return stats
+    drift = {field: stats[field] - current.get(field, 0) for field in STATS_FIELDS if stats[field] != current.get(field, 0)}
+    if not drift:
+        return stats
+    # Correct by $inc, and only if nothing bumped the stats while they were
+    # recounted; a $set would erase those bumps. Otherwise retry next run
+    unchanged = {field: current[field] if field in current else {"$exists": False} for field in STATS_FIELDS}
+    result = await db.stats.update_one({"_id": STATS_ID, **unchanged}, {"$inc": drift})
+    if not result.matched_count:
+        logger.info("Dashboard stats changed while reconciling; correcting on the next run")
+        return stats
+    if log_drift:
+        logger.warning("Corrected dashboard stats drift: %s", drift)
+    # Cached dashboard responses are keyed on the collection versions
+    await touch_collections(*VERSIONED_COLLECTIONS)
+    return stats
+
+async def allocate_holds(book_id: str) -> List[dict]:
+    """Set copies on the shelf aside for waiting holds, head of the queue first"""
+    now = datetime.utcnow()
+    ready = []
+    taken = False
+    while True:
+        # Claim one copy for one waiting hold, atomically on the book
+        book = await db.books.find_one_and_update(
+            {"id": book_id, "available_copies": {"$gt": 0}, "waiting_holds": {"$gt": 0}},
+            {"$inc": {"available_copies": -1, "waiting_holds": -1}, "$set": {"updated_at": now}},
+            projection={"_id": 1}
+        )
+        if not book:
+            break
+        taken = True
+        hold = await db.holds.find_one_and_update(
+            {"book_id": book_id, "status": "waiting"},
+            {"$set": {
+                "status": "ready",
+                "ready_at": now,
+                "expires_at": now + timedelta(days=HOLD_PICKUP_DAYS),
+                "updated_at": now
+            }},
+            sort=[("position", ASCENDING)],
+            projection={"_id": 0, "active": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if not hold:
+            # The count ran ahead of the queue (a cancel still in flight);
+            # put both back and leave the rest to the cancel
+            await db.books.update_one({"id": book_id}, {"$inc": {"available_copies": 1, "waiting_holds": 1}})
+            break
+        ready.append(hold)
+    if taken:
+        book_cache.invalidate(book_id)
+    if ready:
+        await bump_stats(available_copies=-len(ready))
+        await touch_collections("books")
+        await publish_changes(book_ids=[book_id])
+    return ready
+
+async def shelve_copy(book_id: str) -> List[dict]:
+    """Put a copy back on the shelf, or aside for the next waiting hold; returns holds made ready"""
+    book = await db.books.find_one_and_update(
+        {"id": book_id},
+        {"$inc": {"available_copies": 1}, "$set": {"updated_at": datetime.utcnow()}},
+        projection={"_id": 0, "waiting_holds": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    book_cache.invalidate(book_id)
+    if book and book.get("waiting_holds", 0) > 0:
+        return await allocate_holds(book_id)
+    return []
+
+async def close_hold(hold_id: str, status: str) -> Optional[dict]:
+    """End an open hold; a waiting one leaves the queue, a ready one passes its copy on"""
+    hold = await db.holds.find_one_and_update(
+        {"id": hold_id, "status": {"$in": ACTIVE_HOLD_STATUSES}},
+        {"$set": {"status": status, "updated_at": datetime.utcnow()}, "$unset": {"active": ""}}
+    )
+    if not hold:
+        return None
+    if hold["status"] == "waiting":
+        await db.books.update_one({"id": hold["book_id"]}, {"$inc": {"waiting_holds": -1}})
+    else:
+        await shelve_copy(hold["book_id"])
+        await bump_stats(available_copies=1)
+        await touch_collections("books")
+    return hold
+
+async def sweep_holds():
+    """Expire holds not picked up in time and correct drifted waiting_holds counts"""
+    now = datetime.utcnow()
+    expired = await db.holds.find({"status": "ready", "expires_at": {"$lt": now}}, {"_id": 0, "id": 1}).to_list(None)
+    for hold in expired:
+        await close_hold(hold["id"], "expired")
+    if expired:
+        logger.info("Expired %d holds", len(expired))
+    
+    waiting = {
+        row["_id"]: row["count"]
+        async for row in db.holds.aggregate([
+            {"$match": {"status": "waiting"}},
+            {"$group": {"_id": "$book_id", "count": {"$sum": 1}}}
+        ])
+    }
+    books = await db.books.find(
+        {"$or": [{"waiting_holds": {"$gt": 0}}, {"id": {"$in": list(waiting)}}]},
+        {"_id": 0, "id": 1, "waiting_holds": 1}
+    ).to_list(None)
+    for book in books:
+        count = waiting.get(book["id"], 0)
+        if book.get("waiting_holds", 0) != count:
+            # Only if the counter has not moved since it was read: a hold
+            # placed, cancelled or allocated meanwhile makes the count stale
+            unchanged = book["waiting_holds"] if "waiting_holds" in book else {"$exists": False}
+            result = await db.books.update_one(
+                {"id": book["id"], "waiting_holds": unchanged}, {"$set": {"waiting_holds": count}}
+            )
+            if result.modified_count:
+                logger.warning("Corrected waiting_holds of book %s: %s -> %d", book["id"], book.get("waiting_holds"), count)
+        if count:
+            await allocate_holds(book["id"])
+
+async def replace_rollups(collection, rows: List[dict], field: str, since: Optional[datetime], rolled_at: datetime):
+    """Upsert rollup rows, then drop rows from since on that this run did not produce"""
+    if rows:
+        await collection.bulk_write(
+            [ReplaceOne({"_id": row["_id"]}, {**row, "rolled_at": rolled_at}, upsert=True) for row in rows],
+            ordered=False
+        )
+    # $lt rather than $ne so that a concurrent run in another worker keeps its rows
+    stale = {"rolled_at": {"$lt": rolled_at}}
+    if since is not None:
+        stale[field] = {"$gte": since}
+    await collection.delete_many(stale)
+
+async def rollup_circulation(rebuild: bool = False) -> dict:
+    """Bring the analytics rollups up to date; rebuild recomputes them from all loans"""
+    rolled_at = bson_now()
+    state = None if rebuild else await db.stats.find_one({"_id": ANALYTICS_ID})
+    since = state["rolled_up_through"] if state else None
+    
+    # Every checkout or return on or after since also stamped updated_at
+    query = {"updated_at": {"$gte": since}} if since else {}
+    loans = await db.transactions.find(query, LOAN_ROLLUP_PROJECTION).to_list(None)
+    member_ids = list({loan["member_id"] for loan in loans})
+    book_ids = list({loan["book_id"] for loan in loans})
+    grades = {
+        member["id"]: member.get("grade")
+        async for member in db.members.find({"id": {"$in": member_ids}}, {"_id": 0, "id": 1, "grade": 1})
+    }
+    genres = {
+        book["id"]: book.get("genre")
+        async for book in db.books.find({"id": {"$in": book_ids}}, {"_id": 0, "id": 1, "genre": 1})
+    }
+    circulation, book_days = analytics.daily_rollups(loans, grades, genres, since)
+    await replace_rollups(db.circulation_daily, circulation, "day", since, rolled_at)
+    await replace_rollups(db.book_circulation_daily, book_days, "day", since, rolled_at)
+    
+    # Refold every month the recomputed days fall in
+    month = analytics.month_start(since) if since else None
+    book_days = await db.book_circulation_daily.find(
+        {"day": {"$gte": month}} if month else {}, {"_id": 0, "day": 1, "book_id": 1, "genre": 1, "checkouts": 1}
+    ).to_list(None)
+    book_months = analytics.monthly_book_rollups(book_days)
+    await replace_rollups(db.book_circulation_monthly, book_months, "month", month, rolled_at)
+    
+    rolled_up_through = analytics.day_start(rolled_at)
+    await db.stats.update_one(
+        {"_id": ANALYTICS_ID},
+        {"$set": {"rolled_up_through": rolled_up_through, "rolled_at": rolled_at}},
+        upsert=True
+    )
+    return {
+        "since": since,
+        "rolled_up_through": rolled_up_through,
+        "loans": len(loans),
+        "circulation_rows": len(circulation),
+        "book_month_rows": len(book_months),
+    }
+
+SEARCH_INDEXES = {"books": book_search_index, "members": member_search_index}
+
+async def rebuild_search_indexes():
+    for collection_name, index in SEARCH_INDEXES.items():
+        started = bson_now()
+        projection = {"_id": 0, "id": 1, **{field: 1 for field in index.fields}}
+        docs = await db[collection_name].find({}, projection).to_list(None)
+        index.replace_with(await asyncio.to_thread(InvertedIndex.build, index.fields, docs))
+        search_refreshed_at[collection_name] = started
+
+async def refresh_search_indexes():
+    """Apply other workers' writes since the last refresh instead of rebuilding"""
+    for collection_name, index in SEARCH_INDEXES.items():
+        started = bson_now()
+        # Overlap by the settle window for writes stamped by a worker whose
+        # clock is slightly behind; re-adding a document just replaces it
+        since = search_refreshed_at[collection_name] - timedelta(seconds=SYNC_SETTLE_SECONDS)
+        projection = {"_id": 0, "id": 1, **{field: 1 for field in index.fields}}
+        async for doc in db[collection_name].find({"updated_at": {"$gte": since}}, projection):
+            index.add(doc)
+        deleted = db.tombstones.find(
+            {"collection": collection_name, "updated_at": {"$gte": since}}, {"_id": 0, "id": 1}
+        )
+        async for tombstone in deleted:
+            index.remove(tombstone["id"])
+        search_refreshed_at[collection_name] = started
+
+
+def picture_bucket():
+    return db.gridfs_bucket("member_pictures")
+
+def decode_picture(picture_base64: str) -> bytes:
+    # Accept both bare base64 and data URLs ("data:image/png;base64,...")
+    data = picture_base64.partition(",")[2] if picture_base64.startswith("data:") else picture_base64
+    try:
+        return base64.b64decode(data, validate=True)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid picture")
+
+def make_thumbnail(raw: bytes) -> tuple:
+    """Return the picture's content type and a JPEG thumbnail of it"""
+    try:
+        with Image.open(io.BytesIO(raw)) as image:
+            content_type = Image.MIME.get(image.format, "application/octet-stream")
+            thumbnail = image.convert("RGB")
+            thumbnail.thumbnail((PICTURE_THUMBNAIL_PX, PICTURE_THUMBNAIL_PX))
+            output = io.BytesIO()
+            thumbnail.save(output, format="JPEG", quality=85)
+    except (UnidentifiedImageError, OSError):
+        raise HTTPException(status_code=400, detail="Invalid picture")
+    return content_type, output.getvalue()
+
+async def store_member_picture(member_id: str, picture_base64: str) -> dict:
+    """Upload a picture and its thumbnail; returns the member fields to set"""
+    raw = decode_picture(picture_base64)
+    content_type, thumbnail = await asyncio.to_thread(make_thumbnail, raw)
+    
+    full_id = await picture_bucket().upload_from_stream(
+        member_id, raw, metadata={"member_id": member_id, "content_type": content_type}
+    )
+    thumb_id = await picture_bucket().upload_from_stream(
+        member_id, thumbnail, metadata={"member_id": member_id, "content_type": "image/jpeg"}
+    )
+    return {
+        "picture_etag": hashlib.sha256(raw).hexdigest()[:32],
+        "picture_files": {"full": full_id, "thumb": thumb_id},
+    }
+
+async def delete_member_picture(member: dict):
+    for file_id in (member.get("picture_files") or {}).values():
+        try:
+            await picture_bucket().delete(file_id)
+        except NoFile:
+            pass
+
+async def migrate_inline_pictures():
+    """Move pictures still stored inline as picture_base64 into GridFS"""
+    async for member in db.members.find({"picture_base64": {"$nin": ["", None]}}, {"id": 1, "picture_base64": 1}):
+        try:
+            picture_fields = await store_member_picture(member["id"], member["picture_base64"])
+        except HTTPException:
+            logger.warning("Dropping unreadable inline picture of member %s", member["id"])
+            picture_fields = {"picture_etag": None, "picture_files": None}
+        await db.members.update_one(
+            {"id": member["id"]},
+            {"$set": {**picture_fields, "updated_at": datetime.utcnow()}, "$unset": {"picture_base64": ""}}
+        )
+        await touch_collections("members")
+    
+    await db.members.update_many({"picture_base64": {"$exists": True}}, {"$unset": {"picture_base64": ""}})
+
+async def publish_changes(book_ids=(), transactions=(), deleted_book_ids=(), stats: bool = True):
+    """Push circulation changes to SSE clients when no change stream does it for us"""
+    if not event_hub.wants_local_events():
+        return
+    if book_ids:
+        projection = {"_id": 0, **{field: 1 for field in BOOK_EVENT_FIELDS}}
+        async for book in db.books.find({"id": {"$in": list(book_ids)}}, projection):
+            event_hub.publish("book", book)
+    for transaction in transactions:
+        event_hub.publish("transaction", {field: transaction.get(field) for field in TRANSACTION_EVENT_FIELDS})
+    for book_id in deleted_book_ids:
+        event_hub.publish("deleted", {"collection": "books", "id": book_id})
+    if stats:
+        current = await db.stats.find_one({"_id": STATS_ID})
+        if current:
+            event_hub.publish("stats", dashboard_stats(current))
+
+CHANGE_STREAM_PIPELINE = [{"$match": {
+    "operationType": {"$in": ["insert", "update", "replace"]},
+    "ns.coll": {"$in": ["books", "transactions", "stats", "tombstones"]},
+    "$or": [{"ns.coll": {"$ne": "stats"}}, {"documentKey._id": STATS_ID}],
+}}]
+
+def change_event(change: dict) -> Optional[tuple]:
+    doc = change.get("fullDocument")
+    if doc is None:
+        # Deleted again before the update lookup ran
+        return None
+    collection_name = change["ns"]["coll"]
+    if collection_name == "books":
+        return "book", {field: doc.get(field) for field in BOOK_EVENT_FIELDS}
+    if collection_name == "transactions":
+        return "transaction", {field: doc.get(field) for field in TRANSACTION_EVENT_FIELDS}
+    if collection_name == "stats":
+        return "stats", dashboard_stats(doc)
+    return "deleted", {"collection": doc["collection"], "id": doc["id"]}
+
+async def watch_changes():
+    """Feed the event hub from a change stream, resuming after transient errors"""
+    resume_token = None
+    supported = False
+    while True:
+        try:
+            async with db.watch(CHANGE_STREAM_PIPELINE, full_document="updateLookup", resume_after=resume_token) as stream:
+                supported = True
+                event_hub.upstream_active = True
+                logger.info("Publishing change events from MongoDB change streams")
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    event = change_event(change)
+                    if event:
+                        event_hub.publish(*event)
+        except OperationFailure as e:
+            event_hub.upstream_active = False
+            if not supported:
+                # Standalone servers have no change streams
+                logger.info("Change streams unavailable (%s); publishing change events in-process", e)
+                return
+            logger.warning("Change stream failed, retrying: %s", e)
+            # The resume token may have fallen off the oplog
+            resume_token = None
+        except PyMongoError as e:
+            event_hub.upstream_active = False
+            logger.warning("Change stream interrupted, retrying: %s", e)
+        await asyncio.sleep(CHANGE_STREAM_RETRY_SECONDS)
+
+async def acquire_lease(name: str, seconds: float, **fields) -> bool:
+    """Take the named lease if it is free or expired, or renew it if this worker holds it"""
+    now = datetime.utcnow()
+    try:
+        await db.leases.update_one(
+            {"_id": name, "$or": [{"owner": WORKER_ID}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": WORKER_ID, "expires_at": now + timedelta(seconds=seconds), **fields}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # Another worker holds it: the upsert collided with its document
+        return False
+    return True
+
+async def keep_lease(name: str, seconds: float):
+    while True:
+        await asyncio.sleep(seconds / 3)
+        await acquire_lease(name, seconds)
+
+async def run_migrations():
+    await mark_active_loans()
+    await backfill_updated_at()
+    await ensure_indexes()
+    await migrate_inline_pictures()
+    await mark_overdue_loans()
+    await reconcile_stats()
+    await rollup_circulation()
+    await sweep_holds()
+
+async def migrate_once():
+    """
+    Run the startup migrations in the first worker to start; the others wait
+    for it to finish. Workers starting while the finished lease is still
+    current skip them, later restarts run them again (they are idempotent,
+    just not safe to run concurrently)
+    """
+    while True:
+        lease = await db.leases.find_one({"_id": STARTUP_LEASE})
+        if lease and lease.get("done") and lease["expires_at"] > datetime.utcnow():
+            return
+        if await acquire_lease(STARTUP_LEASE, STARTUP_LEASE_SECONDS, done=False):
+            renewal = asyncio.create_task(keep_lease(STARTUP_LEASE, STARTUP_LEASE_SECONDS))
+            try:
+                await run_migrations()
+            finally:
+                renewal.cancel()
+            await db.leases.update_one({"_id": STARTUP_LEASE, "owner": WORKER_ID}, {"$set": {"done": True}})
+            return
+        await asyncio.sleep(STARTUP_WAIT_SECONDS)
+
+async def run_periodically(job, interval: float, singleton: bool = False):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # The holder renews its lease every run, so it keeps the job
+            # until it stops; two intervals lets another worker take over
+            if singleton and not await acquire_lease(job.__name__, interval * 2):
+                continue
+            await job()
+        except Exception:
+            logger.exception("Background job %s failed", job.__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await migrate_once()
+    await rebuild_search_indexes()
+    tasks = [
+        asyncio.create_task(run_periodically(mark_overdue_loans, OVERDUE_SWEEP_INTERVAL_SECONDS, singleton=True)),
+        asyncio.create_task(run_periodically(refresh_search_indexes, SEARCH_INDEX_REFRESH_SECONDS)),
+        asyncio.create_task(run_periodically(reconcile_stats, STATS_RECONCILE_INTERVAL_SECONDS, singleton=True)),
+        asyncio.create_task(run_periodically(rollup_circulation, ANALYTICS_ROLLUP_INTERVAL_SECONDS, singleton=True)),
+        asyncio.create_task(run_periodically(sweep_holds, HOLD_SWEEP_INTERVAL_SECONDS, singleton=True)),
+    ]
+    if CHANGE_STREAMS_ENABLED:
+        tasks.append(asyncio.create_task(watch_changes()))
+    if SLOW_QUERY_THRESHOLD_MS > 0:
+        await slow_query_log.ensure_collection(db)
+        tasks.append(asyncio.create_task(slow_query_log.run(db)))
+    global ready
+    ready = True
+    yield
+    ready = False
+    for task in tasks:
+        task.cancel()
+    db.close()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -35,6 +847,7 @@ class Book(BaseModel):
     available_copies: int
     description: Optional[str] = ""
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class BookCreate(BaseModel):
     title: str
@@ -49,10 +862,11 @@ class Member(BaseModel):
     name: str
     student_id: str
     grade: str
-    picture_base64: Optional[str] = ""
+    picture_etag: Optional[str] = None
     email: Optional[str] = ""
     phone: Optional[str] = ""
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class MemberCreate(BaseModel):
     name: str
@@ -71,11 +885,29 @@ class Transaction(BaseModel):
     return_date: Optional[datetime] = None
     status: str = "borrowed"  # borrowed, returned, overdue
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class TransactionCreate(BaseModel):
     book_id: str
     member_id: str
 
+class BulkCheckoutRequest(BaseModel):
+    items: List[TransactionCreate] = Field(..., max_length=MAX_BULK_ITEMS)
+
+class BulkReturnRequest(BaseModel):
+    transaction_ids: List[str] = Field(..., max_length=MAX_BULK_ITEMS)
+
+class BulkItemResult(BaseModel):
+    index: int
+    status: str  # ok, error
+    transaction_id: Optional[str] = None
+    detail: Optional[str] = None
+
+class BulkResult(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[BulkItemResult]
+
 class TransactionWithDetails(BaseModel):
     id: str
     book: dict
@@ -86,25 +918,284 @@ class TransactionWithDetails(BaseModel):
     status: str
     days_overdue: Optional[int] = 0
 
+class Hold(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    book_id: str
+    member_id: str
+    position: int
+    status: str = "waiting"  # waiting, ready, fulfilled, cancelled, expired
+    ready_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class HoldCreate(BaseModel):
+    book_id: str
+    member_id: str
+
+class HoldWithDetails(BaseModel):
+    id: str
+    book: dict
+    status: str
+    queue_position: Optional[int] = None  # 1 is next in line; waiting holds only
+    ready_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+    created_at: datetime
+
+class SyncResponse(BaseModel):
+    books: List[Book]
+    members: List[Member]
+    transactions: List[Transaction]
+    deleted: Dict[str, List[str]]
+    next_token: str
+    has_more: bool
+
+class BookPage(BaseModel):
+    items: List[Book]
+    next_cursor: Optional[str] = None
+
+class MemberPage(BaseModel):
+    items: List[Member]
+    next_cursor: Optional[str] = None
+
+class TransactionPage(BaseModel):
+    items: List[TransactionWithDetails]
+    next_cursor: Optional[str] = None
+
+def model_projection(model: Type[BaseModel]) -> dict:
+    return {"_id": 0, **{field: 1 for field in model.model_fields}}
+
+BOOK_LIST_PROJECTION = model_projection(Book)
+MEMBER_LIST_PROJECTION = model_projection(Member)
+SYNC_PROJECTIONS = {
+    "books": BOOK_LIST_PROJECTION,
+    "members": MEMBER_LIST_PROJECTION,
+    "transactions": model_projection(Transaction),
+    "tombstones": {"_id": 0, "id": 1, "collection": 1, "updated_at": 1},
+}
+
+async def load_book(book_id: str, version: Optional[tuple] = None) -> Optional[dict]:
+    """Cached book document projected to Book's fields; callers must not mutate it"""
+    return await book_cache.get_or_load(
+        book_id, lambda: db.books.find_one({"id": book_id}, BOOK_LIST_PROJECTION), version
+    )
+
+async def load_member(member_id: str, version: Optional[tuple] = None) -> Optional[dict]:
+    """Cached member document projected to Member's fields; callers must not mutate it"""
+    return await member_cache.get_or_load(
+        member_id, lambda: db.members.find_one({"id": member_id}, MEMBER_LIST_PROJECTION), version
+    )
+
+async def load_many(
+    cache: LRUCache, collection, ids: List[str], projection: dict, version: Optional[tuple] = None
+) -> Dict[str, dict]:
+    # Serve what the cache has and fetch the rest with one $in query
+    found, missing = cache.get_many(ids, version)
+    if missing:
+        async for doc in collection.find({"id": {"$in": missing}}, projection):
+            cache.set(doc["id"], doc, version)
+            found[doc["id"]] = doc
+    return found
+
+def cache_version(request: Request, collection_name: str) -> tuple:
+    """
+    The collection's version from the ETag computed for this request. Cached
+    documents loaded at another version may predate a write by another
+    worker, so they are reloaded rather than served under this ETag
+    """
+    versions = request.state.versions
+    return versions["epoch"], versions.get(collection_name, 0)
+
+@lru_cache(maxsize=None)
+def model_defaults(model: Type[BaseModel]) -> dict:
+    # Static defaults only; fields with a default_factory are always stored
+    return {
+        name: field.default
+        for name, field in model.model_fields.items()
+        if not field.is_required() and field.default_factory is None
+    }
+
+_json_adapter = TypeAdapter(Any)
+
+def dump_json(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return _json_adapter.dump_json(content)
+
+def fill_defaults(item_model: Type[BaseModel], docs: List[dict]) -> List[dict]:
+    defaults = model_defaults(item_model)
+    return [{**defaults, **doc} for doc in docs]
+
+def page_response(item_model: Type[BaseModel], page_model: Type[BaseModel], docs: List[dict], next_cursor: Optional[str]):
+    """Build a page response; in fast mode the documents must already be projected to item_model's fields"""
+    if not FAST_SERIALIZATION:
+        return page_model(items=[item_model(**doc) for doc in docs], next_cursor=next_cursor)
+    
+    content = {"items": fill_defaults(item_model, docs), "next_cursor": next_cursor}
+    return Response(content=dump_json(content), media_type="application/json")
+
+async def conditional_get(request: Request, collections: List[str], max_age_seconds: Optional[float] = None) -> tuple:
+    """ETag and Last-Modified headers for a read of the given collections, plus a
+    ready 304 response when If-None-Match already matches
+
+    Only the versions document is read, never the collections themselves.
+    Reads whose content also depends on the clock pass max_age_seconds so the
+    ETag rolls over at least that often.
+    """
+    versions = await get_versions()
+    request.state.versions = versions
+    state = [versions["epoch"], *(str(versions.get(name, 0)) for name in collections)]
+    state += [request.url.path, request.url.query]
+    if max_age_seconds:
+        state.append(str(int(datetime.utcnow().timestamp() // max_age_seconds)))
+    etag = 'W/"' + hashlib.sha1("|".join(state).encode()).hexdigest() + '"'
+    
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    modified = [versions[f"{name}_modified"] for name in collections if versions.get(f"{name}_modified")]
+    if modified:
+        headers["Last-Modified"] = max(modified).strftime("%a, %d %b %Y %H:%M:%S GMT")
+    
+    if_none_match = request.headers.get("if-none-match", "")
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    if if_none_match.strip() == "*" or etag in tags or etag[2:] in tags:
+        return Response(status_code=304, headers=headers), headers
+    return None, headers
+
+def with_headers(result, response: Response, headers: dict):
+    # Fast-path results are already Responses; models get the injected one's headers
+    (result if isinstance(result, Response) else response).headers.update(headers)
+    return result
+
+# Keyset pagination over (created_at, id); the cursor is an opaque
+# urlsafe-base64 encoding of the last document's sort key
+def encode_cursor(doc: dict) -> str:
+    key = {"created_at": doc["created_at"].isoformat(), "id": doc["id"]}
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(key["created_at"]), str(key["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def encode_offset_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode()).decode()
+
+def decode_offset_cursor(cursor: str) -> int:
+    try:
+        offset = int(json.loads(base64.urlsafe_b64decode(cursor.encode()))["offset"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return offset
+
+# Sync tokens hold one (updated_at, id) keyset position per collection plus
+# one for tombstones, so each stream can advance independently
+def encode_sync_token(positions: Dict[str, tuple]) -> str:
+    token = {name: [updated_at.isoformat(), doc_id] for name, (updated_at, doc_id) in positions.items()}
+    return base64.urlsafe_b64encode(json.dumps(token).encode()).decode()
+
+def decode_sync_token(token: str) -> Dict[str, tuple]:
+    try:
+        positions = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return {
+            name: (datetime.fromisoformat(positions[name][0]), str(positions[name][1]))
+            for name in [*SYNC_COLLECTIONS, "tombstones"]
+        }
+    except (ValueError, KeyError, TypeError, IndexError):
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+async def paginate(collection, query: dict, limit: int, cursor: Optional[str] = None, direction: int = 1,
+                   projection: Optional[dict] = None):
+    if cursor:
+        created_at, last_id = decode_cursor(cursor)
+        op = "$gt" if direction > 0 else "$lt"
+        query = {"$and": [query, {"$or": [
+            {"created_at": {op: created_at}},
+            {"created_at": created_at, "id": {op: last_id}}
+        ]}]}
+    
+    # Fetch one extra document to know whether another page follows
+    docs = await collection.find(query, projection).sort(
+        [("created_at", direction), ("id", direction)]
+    ).limit(limit + 1).to_list(limit + 1)
+    
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+async def paginate_ranked(collection, index: InvertedIndex, q: str, query: dict, limit: int, cursor: Optional[str] = None,
+                          projection: Optional[dict] = None):
+    """Page through search hits in rank order, applying the remaining filters in Mongo"""
+    position = decode_offset_cursor(cursor) if cursor else 0
+    # Only rank as many hits as this page can need; widen if filters reject most
+    window = position + 2 * limit
+    ranked_ids = index.search(q, limit=window)
+    docs = []
+    while position < len(ranked_ids) and len(docs) < limit:
+        chunk = ranked_ids[position:position + limit]
+        found = {
+            doc["id"]: doc
+            async for doc in collection.find({**query, "id": {"$in": chunk}}, projection)
+        }
+        for doc_id in chunk:
+            position += 1
+            if doc_id in found:
+                docs.append(found[doc_id])
+                if len(docs) == limit:
+                    break
+        if position == len(ranked_ids) == window:
+            window *= 4
+            ranked_ids = index.search(q, limit=window)
+    
+    has_more = position < len(ranked_ids) or len(ranked_ids) == window
+    next_cursor = encode_offset_cursor(position) if has_more else None
+    return docs, next_cursor
+
 # Book Routes
 @api_router.post("/books", response_model=Book)
 async def create_book(book: BookCreate):
+    # Check if ISBN already exists
+    existing_book = await db.books.find_one({"isbn": book.isbn})
+    if existing_book:
+        raise HTTPException(status_code=400, detail="ISBN already exists")
+    
     book_dict = book.dict()
     book_dict["available_copies"] = book_dict["total_copies"]
     book_obj = Book(**book_dict)
-    await db.books.insert_one(book_obj.dict())
+    try:
+        await db.books.insert_one(book_obj.dict())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="ISBN already exists")
+    book_search_index.add(book_obj.dict())
+    await bump_stats(total_books=1, total_copies=book_obj.total_copies, available_copies=book_obj.available_copies)
+    await touch_collections("books")
+    await publish_changes(book_ids=[book_obj.id])
     return book_obj
 
-@api_router.get("/books", response_model=List[Book])
-async def get_books():
-    books = await db.books.find().to_list(1000)
-    return [Book(**book) for book in books]
+@api_router.get("/books", response_model=BookPage)
+async def get_books(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    not_modified, headers = await conditional_get(request, ["books"])
+    if not_modified:
+        return not_modified
+    books, next_cursor = await paginate(db.books, {}, limit, cursor, projection=BOOK_LIST_PROJECTION)
+    return with_headers(page_response(Book, BookPage, books, next_cursor), response, headers)
 
 @api_router.get("/books/{book_id}", response_model=Book)
-async def get_book(book_id: str):
-    book = await db.books.find_one({"id": book_id})
+async def get_book(book_id: str, request: Request, response: Response):
+    not_modified, headers = await conditional_get(request, ["books"])
+    if not_modified:
+        return not_modified
+    book = await load_book(book_id, cache_version(request, "books"))
     if not book:
         raise HTTPException(status_code=404, detail="Book not found")
+    response.headers.update(headers)
     return Book(**book)
 
 @api_router.put("/books/{book_id}", response_model=Book)
@@ -113,28 +1204,63 @@ async def update_book(book_id: str, book: BookCreate):
     if not existing_book:
         raise HTTPException(status_code=404, detail="Book not found")
     
-    book_dict = book.dict()
-    # Maintain the same available copies ratio if total copies changed
-    if book_dict["total_copies"] != existing_book["total_copies"]:
-        borrowed_copies = existing_book["total_copies"] - existing_book["available_copies"]
-        book_dict["available_copies"] = max(0, book_dict["total_copies"] - borrowed_copies)
-    else:
-        book_dict["available_copies"] = existing_book["available_copies"]
+    # Check if ISBN is being changed and if it conflicts
+    if book.isbn != existing_book["isbn"]:
+        conflicting_book = await db.books.find_one({"isbn": book.isbn})
+        if conflicting_book:
+            raise HTTPException(status_code=400, detail="ISBN already exists")
     
-    await db.books.update_one({"id": book_id}, {"$set": book_dict})
-    updated_book = await db.books.find_one({"id": book_id})
+    book_dict = book.dict()
+    # Added or withdrawn copies change the shelf count by the same amount.
+    # Apply it as an $inc relative to the stored counts so a checkout, return
+    # or hold allocation in between is kept; the filter refuses to withdraw
+    # copies that are out on loan or set aside for holds
+    copies = book_dict.pop("total_copies") - existing_book["total_copies"]
+    book_dict["updated_at"] = datetime.utcnow()
+    updated_book = await db.books.find_one_and_update(
+        {"id": book_id, "available_copies": {"$gte": -copies}},
+        {"$set": book_dict, "$inc": {"total_copies": copies, "available_copies": copies}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated_book:
+        if not await db.books.find_one({"id": book_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Book not found")
+        raise HTTPException(status_code=400, detail="Cannot remove copies that are borrowed or on hold")
+    book_cache.invalidate(book_id)
+    if copies:
+        await bump_stats(total_copies=copies, available_copies=copies)
+    if updated_book.get("waiting_holds", 0) > 0 and updated_book["available_copies"] > 0:
+        await allocate_holds(book_id)
+        updated_book = await db.books.find_one({"id": book_id})
+    await touch_collections("books")
+    await publish_changes(book_ids=[book_id])
+    book_search_index.add(updated_book)
     return Book(**updated_book)
 
 @api_router.delete("/books/{book_id}")
 async def delete_book(book_id: str):
     # Check if book is borrowed
-    borrowed_count = await db.transactions.count_documents({"book_id": book_id, "status": "borrowed"})
+    borrowed_count = await db.transactions.count_documents({"book_id": book_id, "status": {"$in": ACTIVE_LOAN_STATUSES}})
     if borrowed_count > 0:
         raise HTTPException(status_code=400, detail="Cannot delete book that is currently borrowed")
     
-    result = await db.books.delete_one({"id": book_id})
-    if result.deleted_count == 0:
+    deleted_book = await db.books.find_one_and_delete({"id": book_id})
+    if not deleted_book:
         raise HTTPException(status_code=404, detail="Book not found")
+    book_cache.invalidate(book_id)
+    await db.holds.update_many(
+        {"book_id": book_id, "active": True},
+        {"$set": {"status": "cancelled", "updated_at": datetime.utcnow()}, "$unset": {"active": ""}}
+    )
+    await record_tombstone("books", book_id)
+    book_search_index.remove(book_id)
+    await bump_stats(
+        total_books=-1,
+        total_copies=-deleted_book["total_copies"],
+        available_copies=-deleted_book["available_copies"]
+    )
+    await touch_collections("books")
+    await publish_changes(deleted_book_ids=[book_id])
     return {"message": "Book deleted successfully"}
 
 # Member Routes
@@ -145,22 +1271,68 @@ async def create_member(member: MemberCreate):
     if existing_member:
         raise HTTPException(status_code=400, detail="Student ID already exists")
     
-    member_obj = Member(**member.dict())
-    await db.members.insert_one(member_obj.dict())
+    member_obj = Member(**member.dict(exclude={"picture_base64"}))
+    member_doc = member_obj.dict()
+    if member.picture_base64:
+        member_doc.update(await store_member_picture(member_obj.id, member.picture_base64))
+        member_obj.picture_etag = member_doc["picture_etag"]
+    
+    try:
+        await db.members.insert_one(member_doc)
+    except DuplicateKeyError:
+        await delete_member_picture(member_doc)
+        raise HTTPException(status_code=400, detail="Student ID already exists")
+    member_search_index.add(member_doc)
+    await bump_stats(total_members=1)
+    await touch_collections("members")
+    await publish_changes()
     return member_obj
 
-@api_router.get("/members", response_model=List[Member])
-async def get_members():
-    members = await db.members.find().to_list(1000)
-    return [Member(**member) for member in members]
+@api_router.get("/members", response_model=MemberPage)
+async def get_members(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    not_modified, headers = await conditional_get(request, ["members"])
+    if not_modified:
+        return not_modified
+    members, next_cursor = await paginate(db.members, {}, limit, cursor, projection=MEMBER_LIST_PROJECTION)
+    return with_headers(page_response(Member, MemberPage, members, next_cursor), response, headers)
 
 @api_router.get("/members/{member_id}", response_model=Member)
-async def get_member(member_id: str):
-    member = await db.members.find_one({"id": member_id})
+async def get_member(member_id: str, request: Request, response: Response):
+    not_modified, headers = await conditional_get(request, ["members"])
+    if not_modified:
+        return not_modified
+    member = await load_member(member_id, cache_version(request, "members"))
     if not member:
         raise HTTPException(status_code=404, detail="Member not found")
+    response.headers.update(headers)
     return Member(**member)
 
+@api_router.get("/members/{member_id}/picture")
+async def get_member_picture(member_id: str, request: Request, size: str = Query("full", pattern="^(full|thumb)$")):
+    member = await db.members.find_one({"id": member_id}, {"picture_etag": 1, "picture_files": 1})
+    if not member:
+        raise HTTPException(status_code=404, detail="Member not found")
+    if not member.get("picture_files"):
+        raise HTTPException(status_code=404, detail="Picture not found")
+    
+    etag = f'"{member["picture_etag"]}-{size}"'
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={PICTURE_CACHE_SECONDS}"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        stream = await picture_bucket().open_download_stream(member["picture_files"][size])
+    except NoFile:
+        raise HTTPException(status_code=404, detail="Picture not found")
+    content = await stream.read()
+    return Response(content=content, media_type=stream.metadata["content_type"], headers=headers)
+
 @api_router.put("/members/{member_id}", response_model=Member)
 async def update_member(member_id: str, member: MemberCreate):
     existing_member = await db.members.find_one({"id": member_id})
@@ -173,46 +1345,72 @@ async def update_member(member_id: str, member: MemberCreate):
         if conflicting_member:
             raise HTTPException(status_code=400, detail="Student ID already exists")
     
-    await db.members.update_one({"id": member_id}, {"$set": member.dict()})
+    # The picture is replaced (or cleared) along with the other fields
+    update = member.dict(exclude={"picture_base64"})
+    if member.picture_base64:
+        update.update(await store_member_picture(member_id, member.picture_base64))
+    else:
+        update.update({"picture_etag": None, "picture_files": None})
+    update["updated_at"] = datetime.utcnow()
+    
+    await db.members.update_one({"id": member_id}, {"$set": update})
+    member_cache.invalidate(member_id)
+    await touch_collections("members")
+    await delete_member_picture(existing_member)
     updated_member = await db.members.find_one({"id": member_id})
+    member_search_index.add(updated_member)
     return Member(**updated_member)
 
 @api_router.delete("/members/{member_id}")
 async def delete_member(member_id: str):
     # Check if member has borrowed books
-    borrowed_count = await db.transactions.count_documents({"member_id": member_id, "status": "borrowed"})
+    borrowed_count = await db.transactions.count_documents({"member_id": member_id, "status": {"$in": ACTIVE_LOAN_STATUSES}})
     if borrowed_count > 0:
         raise HTTPException(status_code=400, detail="Cannot delete member who has borrowed books")
     
-    result = await db.members.delete_one({"id": member_id})
-    if result.deleted_count == 0:
+    deleted_member = await db.members.find_one_and_delete({"id": member_id})
+    if not deleted_member:
         raise HTTPException(status_code=404, detail="Member not found")
+    member_cache.invalidate(member_id)
+    # Ready holds pass their copies on to the next in line
+    async for hold in db.holds.find({"member_id": member_id, "active": True}, {"_id": 0, "id": 1}):
+        await close_hold(hold["id"], "cancelled")
+    await record_tombstone("members", member_id)
+    await delete_member_picture(deleted_member)
+    member_search_index.remove(member_id)
+    await bump_stats(total_members=-1)
+    await touch_collections("members")
+    await publish_changes()
     return {"message": "Member deleted successfully"}
 
 # Transaction Routes
 @api_router.post("/transactions/checkout", response_model=Transaction)
 async def checkout_book(transaction: TransactionCreate):
-    # Check if book exists and is available
-    book = await db.books.find_one({"id": transaction.book_id})
-    if not book:
-        raise HTTPException(status_code=404, detail="Book not found")
-    
-    if book["available_copies"] <= 0:
-        raise HTTPException(status_code=400, detail="Book not available")
-    
     # Check if member exists
-    member = await db.members.find_one({"id": transaction.member_id})
+    member = await load_member(transaction.member_id)
     if not member:
         raise HTTPException(status_code=404, detail="Member not found")
     
-    # Check if member already has this book
-    existing_transaction = await db.transactions.find_one({
-        "book_id": transaction.book_id, 
-        "member_id": transaction.member_id, 
-        "status": "borrowed"
-    })
-    if existing_transaction:
-        raise HTTPException(status_code=400, detail="Member already has this book borrowed")
+    # A ready hold has already set a copy aside for this member
+    hold = await db.holds.find_one_and_update(
+        {"book_id": transaction.book_id, "member_id": transaction.member_id, "active": True, "status": "ready"},
+        {"$set": {"status": "fulfilled", "updated_at": datetime.utcnow()}, "$unset": {"active": ""}},
+        projection={"_id": 0, "id": 1}
+    )
+    if not hold:
+        # Take a copy atomically; the filter makes concurrent checkouts of the
+        # last copy fail instead of driving the count negative, and leaves
+        # copies owed to waiting holds alone
+        book = await db.books.find_one_and_update(
+            {"id": transaction.book_id, "$expr": {"$gt": [FREE_COPIES, 0]}},
+            {"$inc": {"available_copies": -1}, "$set": {"updated_at": datetime.utcnow()}},
+            projection={"_id": 1}
+        )
+        if not book:
+            if not await load_book(transaction.book_id):
+                raise HTTPException(status_code=404, detail="Book not found")
+            raise HTTPException(status_code=400, detail="Book not available")
+        book_cache.invalidate(transaction.book_id)
     
     # Create transaction
     due_date = datetime.utcnow() + timedelta(days=14)  # 14 days borrowing period
@@ -222,13 +1420,28 @@ async def checkout_book(transaction: TransactionCreate):
         due_date=due_date
     )
     
-    await db.transactions.insert_one(transaction_obj.dict())
+    # The active_loan_unique index rejects a second open loan of the same
+    # book for this member; give the copy back (or reopen the hold) if the
+    # insert fails
+    try:
+        await db.transactions.insert_one({**transaction_obj.dict(), "active": True})
+    except Exception as e:
+        if hold:
+            await db.holds.update_one({"id": hold["id"]}, {"$set": {"status": "ready", "active": True}})
+        else:
+            await db.books.update_one(
+                {"id": transaction.book_id}, 
+                {"$inc": {"available_copies": 1}, "$set": {"updated_at": datetime.utcnow()}}
+            )
+            book_cache.invalidate(transaction.book_id)
+        if isinstance(e, DuplicateKeyError):
+            raise HTTPException(status_code=400, detail="Member already has this book borrowed")
+        raise
     
-    # Update book available copies
-    await db.books.update_one(
-        {"id": transaction.book_id}, 
-        {"$inc": {"available_copies": -1}}
-    )
+    if not hold:
+        await bump_stats(available_copies=-1)
+    await touch_collections("books", "transactions")
+    await publish_changes(book_ids=[transaction.book_id], transactions=[transaction_obj.dict()])
     
     return transaction_obj
 
@@ -238,128 +1451,826 @@ async def return_book(transaction_id: str):
     if not transaction:
         raise HTTPException(status_code=404, detail="Transaction not found")
     
-    if transaction["status"] != "borrowed":
+    if transaction["status"] not in ACTIVE_LOAN_STATUSES:
         raise HTTPException(status_code=400, detail="Book is not currently borrowed")
     
-    # Update transaction
+    # Update transaction; conditional so a concurrent return cannot count twice
     return_date = datetime.utcnow()
-    await db.transactions.update_one(
-        {"id": transaction_id}, 
-        {"$set": {"return_date": return_date, "status": "returned"}}
+    previous = await db.transactions.find_one_and_update(
+        {"id": transaction_id, "status": {"$in": ACTIVE_LOAN_STATUSES}}, 
+        {"$set": {"return_date": return_date, "status": "returned", "updated_at": return_date}, "$unset": {"active": ""}}
     )
+    if not previous:
+        raise HTTPException(status_code=400, detail="Book is not currently borrowed")
     
-    # Update book available copies
-    await db.books.update_one(
-        {"id": transaction["book_id"]}, 
-        {"$inc": {"available_copies": 1}}
+    # Update book available copies; the copy goes to the next hold if anyone is waiting
+    ready = await shelve_copy(transaction["book_id"])
+    await bump_stats(available_copies=1, overdue_books=-1 if previous["status"] == "overdue" else 0)
+    await touch_collections("books", "transactions")
+    await publish_changes(
+        book_ids=[transaction["book_id"]],
+        transactions=[{**transaction, "status": "returned", "return_date": return_date}]
     )
     
-    return {"message": "Book returned successfully"}
+    return {"message": "Book returned successfully", "hold_id": ready[0]["id"] if ready else None}
+
+async def take_copies(book_id: str, wanted: int) -> int:
+    """Atomically take up to `wanted` free copies of a book; returns how many were taken"""
+    while wanted > 0:
+        book = await db.books.find_one_and_update(
+            {"id": book_id, "$expr": {"$gte": [FREE_COPIES, wanted]}},
+            {"$inc": {"available_copies": -wanted}, "$set": {"updated_at": datetime.utcnow()}},
+            projection={"_id": 1}
+        )
+        if book:
+            book_cache.invalidate(book_id)
+            return wanted
+        current = await db.books.find_one({"id": book_id}, {"available_copies": 1, "waiting_holds": 1})
+        free = current["available_copies"] - current.get("waiting_holds", 0) if current else 0
+        wanted = min(wanted, max(free, 0))
+    return 0
+
+async def give_back_copies(counts: Dict[str, int]):
+    if counts:
+        now = datetime.utcnow()
+        await db.books.bulk_write(
+            [
+                UpdateOne({"id": book_id}, {"$inc": {"available_copies": count}, "$set": {"updated_at": now}})
+                for book_id, count in counts.items()
+            ],
+            ordered=False
+        )
+        book_cache.invalidate(*counts)
+        # Hand copies on to waiting holds; placing a hold checks the shelf
+        # after counting itself, so a hold placed meanwhile is not missed
+        waiting = [
+            book["id"]
+            async for book in db.books.find({"id": {"$in": list(counts)}, "waiting_holds": {"$gt": 0}}, {"id": 1})
+        ]
+        await asyncio.gather(*[allocate_holds(book_id) for book_id in waiting])
 
-@api_router.get("/transactions", response_model=List[TransactionWithDetails])
-async def get_transactions():
-    transactions = await db.transactions.find().sort("created_at", -1).to_list(1000)
+def bulk_result(results: List[BulkItemResult]) -> BulkResult:
+    succeeded = sum(1 for result in results if result.status == "ok")
+    return BulkResult(succeeded=succeeded, failed=len(results) - succeeded, results=results)
+
+@api_router.post("/transactions/bulk-checkout", response_model=BulkResult)
+async def bulk_checkout_books(request: BulkCheckoutRequest):
+    items = request.items
+    results = [BulkItemResult(index=index, status="error") for index in range(len(items))]
+    book_ids = list({item.book_id for item in items})
+    member_ids = list({item.member_id for item in items})
+    
+    # Validate everything with one read per collection
+    known_books = {book["id"] async for book in db.books.find({"id": {"$in": book_ids}}, {"id": 1})}
+    known_members = {member["id"] async for member in db.members.find({"id": {"$in": member_ids}}, {"id": 1})}
+    active_loans = {
+        (loan["book_id"], loan["member_id"])
+        async for loan in db.transactions.find(
+            {"book_id": {"$in": book_ids}, "member_id": {"$in": member_ids}, "active": True},
+            {"book_id": 1, "member_id": 1}
+        )
+    }
+    
+    eligible = []
+    for index, item in enumerate(items):
+        pair = (item.book_id, item.member_id)
+        if item.book_id not in known_books:
+            results[index].detail = "Book not found"
+        elif item.member_id not in known_members:
+            results[index].detail = "Member not found"
+        elif pair in active_loans:
+            results[index].detail = "Member already has this book borrowed"
+        else:
+            active_loans.add(pair)
+            eligible.append(index)
     
+    # As in checkout_book, a member with a ready hold collects the copy set
+    # aside for them; claiming the hold is conditional so that an expiry
+    # or cancel racing with it sends the item to the shelf instead
+    ready_holds = {
+        (hold["book_id"], hold["member_id"]): hold["id"]
+        async for hold in db.holds.find(
+            {"book_id": {"$in": book_ids}, "member_id": {"$in": member_ids}, "active": True, "status": "ready"},
+            {"id": 1, "book_id": 1, "member_id": 1}
+        )
+    }
+    holding = [index for index in eligible if (items[index].book_id, items[index].member_id) in ready_holds]
+    fulfilled = await asyncio.gather(*[
+        db.holds.update_one(
+            {"id": ready_holds[(items[index].book_id, items[index].member_id)], "status": "ready", "active": True},
+            {"$set": {"status": "fulfilled", "updated_at": datetime.utcnow()}, "$unset": {"active": ""}}
+        )
+        for index in holding
+    ])
+    from_holds = {
+        index: ready_holds[(items[index].book_id, items[index].member_id)]
+        for index, result in zip(holding, fulfilled) if result.modified_count
+    }
+    
+    wanted: Dict[str, List[int]] = {}
+    for index in eligible:
+        if index not in from_holds:
+            wanted.setdefault(items[index].book_id, []).append(index)
+    
+    # Take copies per book; items beyond what is available fail in request order
+    taken = await asyncio.gather(*[take_copies(book_id, len(indexes)) for book_id, indexes in wanted.items()])
+    due_date = datetime.utcnow() + timedelta(days=14)  # 14 days borrowing period
+    granted = [
+        (index, Transaction(book_id=items[index].book_id, member_id=items[index].member_id, due_date=due_date))
+        for index in from_holds
+    ]
+    for (book_id, indexes), count in zip(wanted.items(), taken):
+        for index in indexes[count:]:
+            results[index].detail = "Book not available"
+        for index in indexes[:count]:
+            transaction_obj = Transaction(book_id=book_id, member_id=items[index].member_id, due_date=due_date)
+            granted.append((index, transaction_obj))
+    
+    if granted:
+        failed_inserts = set()
+        opened = []
+        try:
+            await db.transactions.insert_many(
+                [{**transaction_obj.dict(), "active": True} for _, transaction_obj in granted],
+                ordered=False
+            )
+        except BulkWriteError as e:
+            # Loans opened concurrently by single checkouts; return their
+            # copies, or reopen the holds they came from
+            failed_inserts = {error["index"] for error in e.details["writeErrors"]}
+        
+        compensation: Dict[str, int] = {}
+        reopened = []
+        for position, (index, transaction_obj) in enumerate(granted):
+            if position in failed_inserts:
+                results[index].detail = "Member already has this book borrowed"
+                if index in from_holds:
+                    reopened.append(from_holds[index])
+                else:
+                    compensation[transaction_obj.book_id] = compensation.get(transaction_obj.book_id, 0) + 1
+            else:
+                results[index].status = "ok"
+                results[index].transaction_id = transaction_obj.id
+                opened.append(transaction_obj.dict())
+        if reopened:
+            await db.holds.update_many({"id": {"$in": reopened}}, {"$set": {"status": "ready", "active": True}})
+        await give_back_copies(compensation)
+        
+        if opened:
+            # Copies from holds were already counted off when set aside
+            shelved = len(opened) - (len(from_holds) - len(reopened))
+            await bump_stats(available_copies=-shelved)
+            await touch_collections("books", "transactions")
+            await publish_changes(book_ids=list({transaction["book_id"] for transaction in opened}), transactions=opened)
+    
+    return bulk_result(results)
+
+@api_router.post("/transactions/bulk-return", response_model=BulkResult)
+async def bulk_return_books(request: BulkReturnRequest):
+    transaction_ids = request.transaction_ids
+    results = [BulkItemResult(index=index, status="error", transaction_id=transaction_id)
+               for index, transaction_id in enumerate(transaction_ids)]
+    
+    loans = {
+        loan["id"]: loan
+        async for loan in db.transactions.find(
+            {"id": {"$in": transaction_ids}}, {"id": 1, "book_id": 1, "member_id": 1, "due_date": 1, "status": 1}
+        )
+    }
+    
+    # Tag the loans this request returns so that concurrent returns of the
+    # same ids are attributed to exactly one caller
+    batch_id = str(uuid.uuid4())
+    now = datetime.utcnow()
+    await db.transactions.update_many(
+        {"id": {"$in": transaction_ids}, "status": {"$in": ACTIVE_LOAN_STATUSES}},
+        {
+            "$set": {"return_date": now, "status": "returned", "return_batch": batch_id, "updated_at": now},
+            "$unset": {"active": ""}
+        }
+    )
+    returned = {loan["id"] async for loan in db.transactions.find({"return_batch": batch_id}, {"id": 1})}
+    
+    copies: Dict[str, int] = {}
+    overdue_returned = 0
+    seen = set()
+    for index, transaction_id in enumerate(transaction_ids):
+        loan = loans.get(transaction_id)
+        if loan is None:
+            results[index].detail = "Transaction not found"
+        elif transaction_id not in returned or transaction_id in seen:
+            results[index].detail = "Book is not currently borrowed"
+        else:
+            seen.add(transaction_id)
+            results[index].status = "ok"
+            copies[loan["book_id"]] = copies.get(loan["book_id"], 0) + 1
+            overdue_returned += loan["status"] == "overdue"
+    
+    await give_back_copies(copies)
+    if seen:
+        await bump_stats(available_copies=len(seen), overdue_books=-overdue_returned)
+        await touch_collections("books", "transactions")
+        await publish_changes(
+            book_ids=list(copies),
+            transactions=[{**loans[transaction_id], "status": "returned", "return_date": now} for transaction_id in seen]
+        )
+    
+    return bulk_result(results)
+
+@api_router.get("/transactions", response_model=TransactionPage)
+async def get_transactions(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    # Joined books and members are part of the page, and overdue status is
+    # derived from the clock, so the ETag also rolls over every sweep interval
+    not_modified, headers = await conditional_get(
+        request, VERSIONED_COLLECTIONS, max_age_seconds=OVERDUE_SWEEP_INTERVAL_SECONDS
+    )
+    if not_modified:
+        return not_modified
+    
+    # Newest first
+    transactions, next_cursor = await paginate(db.transactions, {}, limit, cursor, direction=-1)
+    
+    # Resolve books and members from the read-through caches, fetching the
+    # misses with one batched $in query each
+    book_ids = list({transaction["book_id"] for transaction in transactions})
+    member_ids = list({transaction["member_id"] for transaction in transactions})
+    books = await load_many(book_cache, db.books, book_ids, BOOK_LIST_PROJECTION, cache_version(request, "books"))
+    members = await load_many(
+        member_cache, db.members, member_ids, MEMBER_LIST_PROJECTION, cache_version(request, "members")
+    )
+    
+    now = datetime.utcnow()
     result = []
     for transaction in transactions:
-        book = await db.books.find_one({"id": transaction["book_id"]}, {"_id": 0})
-        member = await db.members.find_one({"id": transaction["member_id"]}, {"_id": 0})
+        book = books.get(transaction["book_id"])
+        member = members.get(transaction["member_id"])
         
+        # Overdue status is persisted by the background sweeper; reads only
+        # report it so that loans past due between sweeps still show up
         days_overdue = 0
-        if transaction["status"] == "borrowed" and transaction["due_date"] < datetime.utcnow():
-            days_overdue = (datetime.utcnow() - transaction["due_date"]).days
-            # Update status to overdue
-            await db.transactions.update_one(
-                {"id": transaction["id"]}, 
-                {"$set": {"status": "overdue"}}
-            )
+        if transaction["status"] in ACTIVE_LOAN_STATUSES and transaction["due_date"] < now:
+            days_overdue = (now - transaction["due_date"]).days
             transaction["status"] = "overdue"
         
-        result.append(TransactionWithDetails(
-            id=transaction["id"],
-            book=book or {},
-            member=member or {},
-            checkout_date=transaction["checkout_date"],
-            due_date=transaction["due_date"],
-            return_date=transaction.get("return_date"),
-            status=transaction["status"],
-            days_overdue=days_overdue
-        ))
+        result.append({
+            "id": transaction["id"],
+            "book": book or {},
+            "member": member or {},
+            "checkout_date": transaction["checkout_date"],
+            "due_date": transaction["due_date"],
+            "return_date": transaction.get("return_date"),
+            "status": transaction["status"],
+            "days_overdue": days_overdue
+        })
     
+    return with_headers(page_response(TransactionWithDetails, TransactionPage, result, next_cursor), response, headers)
+
+# Hold Routes
+@api_router.post("/holds", response_model=Hold)
+async def place_hold(hold: HoldCreate):
+    member = await load_member(hold.member_id)
+    if not member:
+        raise HTTPException(status_code=404, detail="Member not found")
+    if await db.transactions.find_one(
+        {"book_id": hold.book_id, "member_id": hold.member_id, "active": True}, {"_id": 1}
+    ):
+        raise HTTPException(status_code=400, detail="Member already has this book borrowed")
+    
+    # Take the next place in the book's queue; holds are for books with no copy left
+    book = await db.books.find_one_and_update(
+        {"id": hold.book_id, "available_copies": {"$lte": 0}},
+        {"$inc": {"hold_sequence": 1}},
+        projection={"_id": 0, "hold_sequence": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not book:
+        if not await load_book(hold.book_id):
+            raise HTTPException(status_code=404, detail="Book not found")
+        raise HTTPException(status_code=400, detail="Book is available")
+    
+    hold_obj = Hold(book_id=hold.book_id, member_id=hold.member_id, position=book["hold_sequence"])
+    try:
+        await db.holds.insert_one({**hold_obj.dict(), "active": True})
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Member already has a hold on this book")
+    
+    # Counted only once the hold is in the queue, so an allocation that sees
+    # the count finds the hold. A copy returned in between is still on the
+    # shelf, and is set aside here
+    book = await db.books.find_one_and_update(
+        {"id": hold.book_id},
+        {"$inc": {"waiting_holds": 1}},
+        projection={"_id": 0, "available_copies": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if book and book["available_copies"] > 0:
+        for ready in await allocate_holds(hold.book_id):
+            if ready["id"] == hold_obj.id:
+                return Hold(**ready)
+    return hold_obj
+
+@api_router.delete("/holds/{hold_id}")
+async def cancel_hold(hold_id: str):
+    if not await close_hold(hold_id, "cancelled"):
+        if not await db.holds.find_one({"id": hold_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Hold not found")
+        raise HTTPException(status_code=400, detail="Hold is no longer open")
+    return {"message": "Hold cancelled successfully"}
+
+@api_router.get("/members/{member_id}/holds", response_model=List[HoldWithDetails])
+async def get_member_holds(member_id: str, include_closed: bool = False):
+    """The member's holds, oldest first; open ones only unless include_closed"""
+    if not await load_member(member_id):
+        raise HTTPException(status_code=404, detail="Member not found")
+    query = {"member_id": member_id}
+    if not include_closed:
+        query["status"] = {"$in": ACTIVE_HOLD_STATUSES}
+    holds = await db.holds.find(query, {"_id": 0}).sort("created_at", 1).to_list(None)
+    books = await load_many(book_cache, db.books, list({hold["book_id"] for hold in holds}), BOOK_LIST_PROJECTION)
+    
+    # Waiting holds ahead of each of the member's, counted per book in one
+    # aggregation on the queue index; a member has one open hold per book
+    waiting = [hold for hold in holds if hold["status"] == "waiting"]
+    ahead = {}
+    if waiting:
+        ahead = {
+            row["_id"]: row["count"]
+            async for row in db.holds.aggregate([
+                {"$match": {"$or": [
+                    {"book_id": hold["book_id"], "status": "waiting", "position": {"$lt": hold["position"]}}
+                    for hold in waiting
+                ]}},
+                {"$group": {"_id": "$book_id", "count": {"$sum": 1}}}
+            ])
+        }
+    
+    result = []
+    for hold in holds:
+        result.append({
+            "id": hold["id"],
+            "book": books.get(hold["book_id"]) or {},
+            "status": hold["status"],
+            "queue_position": ahead.get(hold["book_id"], 0) + 1 if hold["status"] == "waiting" else None,
+            "ready_at": hold.get("ready_at"),
+            "expires_at": hold.get("expires_at"),
+            "created_at": hold["created_at"],
+        })
     return result
 
 @api_router.get("/dashboard/stats")
-async def get_dashboard_stats():
-    total_books = await db.books.count_documents({})
-    total_members = await db.members.count_documents({})
+async def get_dashboard_stats(request: Request, response: Response):
+    not_modified, headers = await conditional_get(
+        request, VERSIONED_COLLECTIONS, max_age_seconds=OVERDUE_SWEEP_INTERVAL_SECONDS
+    )
+    if not_modified:
+        return not_modified
+    response.headers.update(headers)
     
-    # Calculate total copies and available copies
-    books_cursor = db.books.aggregate([
+    # Single primary-key read of the materialized stats document
+    stats = await db.stats.find_one({"_id": STATS_ID})
+    if not stats:
+        stats = await reconcile_stats()
+    
+    return dashboard_stats(stats)
+
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    # Per-worker counters; each worker process has its own caches
+    return {"books": book_cache.stats(), "members": member_cache.stats()}
+
+# Analytics Routes
+def analytics_range(start: Optional[date], end: Optional[date]) -> tuple:
+    """Inclusive start and end days as a [start, end) datetime range"""
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    return datetime(start.year, start.month, start.day), datetime(end.year, end.month, end.day) + timedelta(days=1)
+
+async def circulation_rows(start: datetime, end: datetime) -> List[dict]:
+    return await db.circulation_daily.find(
+        {"day": {"$gte": start, "$lt": end}}, {"_id": 0, "rolled_at": 0}
+    ).to_list(None)
+
+def analytics_response(start: datetime, end: datetime, **fields) -> dict:
+    return {"start": start.date(), "end": (end - timedelta(days=1)).date(), **fields}
+
+@api_router.get("/analytics/top-books")
+async def get_top_books(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    genre: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100)
+):
+    """Most borrowed books by checkouts between start and end"""
+    start, end = analytics_range(start, end)
+    query = {"genre": genre} if genre else {}
+    projection = {"_id": 0, "book_id": 1, "checkouts": 1}
+    months, day_spans = analytics.split_months(start, end)
+    rows = []
+    if months:
+        rows += await db.book_circulation_monthly.find(
+            {**query, "month": {"$gte": months[0], "$lt": months[1]}}, projection
+        ).to_list(None)
+    for low, high in day_spans:
+        rows += await db.book_circulation_daily.find({**query, "day": {"$gte": low, "$lt": high}}, projection).to_list(None)
+    
+    ranked = analytics.top_books(rows, limit)
+    books = await load_many(book_cache, db.books, [book_id for book_id, _ in ranked], BOOK_LIST_PROJECTION)
+    return analytics_response(start, end, books=[
         {
-            "$group": {
-                "_id": None,
-                "total_copies": {"$sum": "$total_copies"},
-                "available_copies": {"$sum": "$available_copies"}
-            }
+            "book_id": book_id,
+            "title": books.get(book_id, {}).get("title"),
+            "author": books.get(book_id, {}).get("author"),
+            "genre": books.get(book_id, {}).get("genre"),
+            "checkouts": checkouts,
         }
+        for book_id, checkouts in ranked
     ])
-    books_stats = await books_cursor.to_list(1)
+
+@api_router.get("/analytics/borrowing")
+async def get_borrowing(
+    by: str = Query("grade", pattern="^(grade|genre)$"),
+    start: Optional[date] = None,
+    end: Optional[date] = None
+):
+    """Checkouts, returns and average loan length per member grade or book genre"""
+    start, end = analytics_range(start, end)
+    rows = await circulation_rows(start, end)
+    return analytics_response(start, end, by=by, groups=analytics.borrowing_by(rows, by))
+
+@api_router.get("/analytics/trends")
+async def get_trends(
+    interval: str = Query("month", pattern="^(day|week|month)$"),
+    start: Optional[date] = None,
+    end: Optional[date] = None
+):
+    """Checkouts and returns per day, week or month, including empty periods"""
+    start, end = analytics_range(start, end)
+    rows = await circulation_rows(start, end)
+    return analytics_response(start, end, interval=interval, periods=analytics.trends(rows, start, end, interval))
+
+@api_router.get("/analytics/loan-duration")
+async def get_loan_duration(start: Optional[date] = None, end: Optional[date] = None):
+    """Average length of the loans returned between start and end"""
+    start, end = analytics_range(start, end)
+    rows = await circulation_rows(start, end)
+    return analytics_response(start, end, **analytics.loan_duration(rows))
+
+# Report Routes
+@api_router.get("/reports/overdue")
+async def get_overdue_report(
+    group_by: str = Query("loan", pattern="^(loan|member|grade)$"),
+    format: str = Query("json", pattern="^(json|csv)$"),
+    limit: Optional[int] = Query(None, ge=1)
+):
+    """Days overdue and fines for every open loan past due, per loan, member or grade"""
+    now = datetime.utcnow()
+    loans = await db.transactions.find(overdue_filter(now), OVERDUE_REPORT_PROJECTION).to_list(None)
+    columns = fines.fine_columns(
+        loans, now,
+        cents_per_day=round(FINE_PER_DAY * 100),
+        grace_days=FINE_GRACE_DAYS,
+        cap_cents=round(float(FINE_MAX) * 100) if FINE_MAX else None
+    )
+    members = {
+        member["id"]: member
+        async for member in db.members.find(
+            {"id": {"$in": columns["member_ids"]}}, {"_id": 0, "id": 1, "name": 1, "student_id": 1, "grade": 1}
+        )
+    }
+    rows = fines.report(columns, group_by, members, limit)
+    if group_by == "loan":
+        book_ids = list({row["book_id"] for row in rows})
+        titles = {
+            book["id"]: book.get("title") or ""
+            async for book in db.books.find({"id": {"$in": book_ids}}, {"_id": 0, "id": 1, "title": 1})
+        }
+        for row in rows:
+            row["title"] = titles.get(row["book_id"], "")
     
-    total_copies = books_stats[0]["total_copies"] if books_stats else 0
-    available_copies = books_stats[0]["available_copies"] if books_stats else 0
-    borrowed_books = total_copies - available_copies
+    if format == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fines.report_columns(group_by))
+        writer.writeheader()
+        writer.writerows({field: export_value(value) for field, value in row.items()} for row in rows)
+        return Response(
+            content=buffer.getvalue(),
+            media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="overdue-{group_by}.csv"'}
+        )
+    content = {
+        "as_of": now,
+        "fine_per_day": FINE_PER_DAY,
+        "totals": fines.totals(columns),
+        "group_by": group_by,
+        "rows": rows,
+    }
+    return Response(content=dump_json(content), media_type="application/json")
+
+# Admin Routes
+@api_router.post("/admin/analytics/rebuild")
+async def rebuild_analytics():
+    """Recompute the analytics rollups from every loan, e.g. after importing history"""
+    return await rollup_circulation(rebuild=True)
+
+@api_router.get("/admin/slow-queries")
+async def get_slow_queries(
+    collection: Optional[str] = None,
+    command: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """Recently logged slow commands, newest first, with their filter shape and explain() summary"""
+    query = {}
+    if collection:
+        query["collection"] = collection
+    if command:
+        query["command"] = command
+    entries = await db[SLOW_QUERY_COLLECTION].find(query, {"_id": 0}).sort("$natural", -1).to_list(limit)
+    return {
+        "threshold_ms": SLOW_QUERY_THRESHOLD_MS,
+        "dropped": slow_query_log.dropped,
+        "entries": entries,
+    }
+
+# Sync Routes
+@api_router.get("/sync", response_model=SyncResponse)
+async def sync_changes(
+    since: Optional[str] = None,
+    limit: int = Query(DEFAULT_SYNC_LIMIT, ge=1, le=MAX_SYNC_LIMIT)
+):
+    """Records changed and deleted since the token from the previous call
+
+    Without a token everything is returned, in pages of up to `limit` records
+    per collection. Keep calling with next_token while has_more is true;
+    apply each response's changed records before its deletions.
+    """
+    now = datetime.utcnow()
+    cutoff = now - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    if since:
+        positions = decode_sync_token(since)
+        if positions["tombstones"][0] < now - timedelta(days=SYNC_TOMBSTONE_TTL_DAYS):
+            raise HTTPException(status_code=410, detail="Sync token expired; sync again without a token")
+    else:
+        # A client starting from scratch has nothing to delete
+        positions = {name: None for name in SYNC_COLLECTIONS}
+        positions["tombstones"] = (cutoff, "")
     
-    overdue_count = await db.transactions.count_documents({
-        "status": "borrowed",
-        "due_date": {"$lt": datetime.utcnow()}
-    })
+    changes: Dict[str, List[dict]] = {}
+    has_more = False
+    for name, projection in SYNC_PROJECTIONS.items():
+        query = {"updated_at": {"$lt": cutoff}}
+        if positions[name]:
+            updated_at, last_id = positions[name]
+            query = {"$and": [query, {"$or": [
+                {"updated_at": {"$gt": updated_at}},
+                {"updated_at": updated_at, "id": {"$gt": last_id}}
+            ]}]}
+        docs = await db[name].find(query, projection).sort(
+            [("updated_at", ASCENDING), ("id", ASCENDING)]
+        ).limit(limit + 1).to_list(limit + 1)
+        
+        if len(docs) > limit:
+            has_more = True
+            docs = docs[:limit]
+            positions[name] = (docs[-1]["updated_at"], docs[-1]["id"])
+        else:
+            # Everything before the cutoff has been handed out
+            positions[name] = (cutoff, "")
+        changes[name] = docs
     
-    return {
-        "total_books": total_books,
-        "total_members": total_members,
-        "total_copies": total_copies,
-        "borrowed_books": borrowed_books,
-        "available_copies": available_copies,
-        "overdue_books": overdue_count
+    deleted = {name: [] for name in SYNC_COLLECTIONS}
+    for tombstone in changes.pop("tombstones"):
+        deleted.setdefault(tombstone["collection"], []).append(tombstone["id"])
+    
+    next_token = encode_sync_token(positions)
+    if not FAST_SERIALIZATION:
+        return SyncResponse(
+            books=[Book(**doc) for doc in changes["books"]],
+            members=[Member(**doc) for doc in changes["members"]],
+            transactions=[Transaction(**doc) for doc in changes["transactions"]],
+            deleted=deleted, next_token=next_token, has_more=has_more
+        )
+    content = {
+        "books": fill_defaults(Book, changes["books"]),
+        "members": fill_defaults(Member, changes["members"]),
+        "transactions": fill_defaults(Transaction, changes["transactions"]),
+        "deleted": deleted,
+        "next_token": next_token,
+        "has_more": has_more,
     }
+    return Response(content=dump_json(content), media_type="application/json")
+
+# Event Routes
+@api_router.get("/events")
+async def stream_events(request: Request):
+    """Server-Sent Events: book, transaction, deleted and stats changes as they happen"""
+    return StreamingResponse(
+        event_hub.stream(SSE_KEEPALIVE_SECONDS, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Export Routes
+EXPORT_MODELS = {"books": Book, "members": Member, "transactions": Transaction}
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+async def export_chunks(collection_name: str, file_format: str, batch_size: int, compress: bool):
+    """Encode documents straight off the cursor, one batch_size block at a time"""
+    fields = list(EXPORT_MODELS[collection_name].model_fields)
+    cursor = db[collection_name].find({}, {"_id": 0, **{field: 1 for field in fields}}, batch_size=batch_size)
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+    
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore") if file_format == "csv" else None
+    if writer:
+        writer.writeheader()
+    
+    def flush() -> bytes:
+        data = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+    
+    pending = 0
+    async for doc in cursor:
+        row = {field: export_value(doc.get(field)) for field in fields}
+        if writer:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(row))
+            buffer.write("\n")
+        pending += 1
+        if pending >= batch_size:
+            yield flush()
+            pending = 0
+    
+    yield flush()
+    if compressor:
+        yield compressor.flush()
+
+@api_router.get("/export/{collection_name}")
+async def export_collection(
+    collection_name: str,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    batch_size: int = Query(1000, ge=1, le=10000),
+    gzip: bool = False
+):
+    if collection_name not in EXPORT_MODELS:
+        raise HTTPException(status_code=404, detail="Unknown collection")
+    
+    filename = f"{collection_name}.{format}" + (".gz" if gzip else "")
+    media_type = "application/gzip" if gzip else ("text/csv" if format == "csv" else "application/x-ndjson")
+    return StreamingResponse(
+        export_chunks(collection_name, format, batch_size, gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# Import Routes
+@api_router.post("/import/books", response_model=ImportReport)
+async def import_books_file(
+    file: UploadFile,
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$"),
+    chunk_size: int = Query(DEFAULT_CHUNK_SIZE, ge=1, le=10000)
+):
+    file_format = format or detect_format(file.filename or "")
+    if not file_format:
+        raise HTTPException(status_code=400, detail="Cannot tell the file format; pass format=csv or format=ndjson")
+    
+    # The upload is spooled to disk by Starlette and read back one chunk at a time
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    report = await import_books(db, iter_rows(stream, file_format), BookCreate, chunk_size)
+    
+    if report.inserted or report.updated:
+        # Imports bypass the per-write $inc, so recompute instead
+        book_cache.clear()
+        await reconcile_stats(log_drift=False)
+        await touch_collections("books")
+        await publish_changes()
+        await rebuild_search_indexes()
+    return report
 
 # Search Routes
-@api_router.get("/search/books")
-async def search_books(q: str = "", genre: str = "", available_only: bool = False):
+@api_router.get("/search/books", response_model=BookPage)
+async def search_books(
+    q: str = "",
+    genre: str = "",
+    available_only: bool = False,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
     query = {}
     
-    if q:
-        query["$or"] = [
-            {"title": {"$regex": q, "$options": "i"}},
-            {"author": {"$regex": q, "$options": "i"}},
-            {"isbn": {"$regex": q, "$options": "i"}}
-        ]
-    
     if genre:
-        query["genre"] = {"$regex": genre, "$options": "i"}
+        query["genre"] = {"$regex": re.escape(genre), "$options": "i"}
     
     if available_only:
         query["available_copies"] = {"$gt": 0}
     
-    books = await db.books.find(query).to_list(1000)
-    return [Book(**book) for book in books]
+    # Text matching and ranking come from the inverted index; Mongo only
+    # applies the remaining filters to the ranked ids
+    if q:
+        books, next_cursor = await paginate_ranked(
+            db.books, book_search_index, q, query, limit, cursor, projection=BOOK_LIST_PROJECTION
+        )
+    else:
+        books, next_cursor = await paginate(db.books, query, limit, cursor, projection=BOOK_LIST_PROJECTION)
+    return page_response(Book, BookPage, books, next_cursor)
 
-@api_router.get("/search/members")
-async def search_members(q: str = "", grade: str = ""):
+@api_router.get("/search/members", response_model=MemberPage)
+async def search_members(
+    q: str = "",
+    grade: str = "",
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
     query = {}
     
+    if grade:
+        query["grade"] = {"$regex": re.escape(grade), "$options": "i"}
+    
     if q:
-        query["$or"] = [
-            {"name": {"$regex": q, "$options": "i"}},
-            {"student_id": {"$regex": q, "$options": "i"}},
-            {"email": {"$regex": q, "$options": "i"}}
-        ]
+        members, next_cursor = await paginate_ranked(
+            db.members, member_search_index, q, query, limit, cursor, projection=MEMBER_LIST_PROJECTION
+        )
+    else:
+        members, next_cursor = await paginate(db.members, query, limit, cursor, projection=MEMBER_LIST_PROJECTION)
+    return page_response(Member, MemberPage, members, next_cursor)
+
+class MetricsMiddleware:
+    """Records request latency per route template, method and status"""
     
-    if grade:
-        query["grade"] = {"$regex": grade, "$options": "i"}
+    def __init__(self, app):
+        self.app = app
     
-    members = await db.members.find(query).to_list(1000)
-    return [Member(**member) for member in members]
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        
+        status = 500
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router records the matched route in the shared scope
+            route = scope.get("route")
+            request_duration.observe(
+                (scope["method"], getattr(route, "path", "unmatched"), str(status)), time.perf_counter() - start
+            )
+
+def collect_cache_metrics():
+    for name, cache in (("books", book_cache), ("members", member_cache)):
+        stats = cache.stats()
+        for counter in ("hits", "misses", "evictions", "expirations", "invalidations", "stale", "size"):
+            yield (name, counter), stats[counter]
+
+metrics_registry.register(GaugeFunction(
+    "library_cache", "Read-through cache counters and size", ("cache", "counter"), collect_cache_metrics
+))
+metrics_registry.register(GaugeFunction(
+    "library_sse_subscribers", "Connected Server-Sent Events clients", (), lambda: [((), len(event_hub))]
+))
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(content=metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+async def ping_database() -> Dict[str, Any]:
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(db.command("ping"), HEALTH_CHECK_TIMEOUT_SECONDS)
+    except (PyMongoError, asyncio.TimeoutError) as e:
+        return {"status": "unreachable", "error": str(e) or type(e).__name__}
+    return {"status": "ok", "latency_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    # Liveness: the worker answers even when the database is down, since
+    # restarting it would not help; the ping result is informational
+    return {"status": "ok", "pid": os.getpid(), "database": await ping_database()}
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz(response: Response):
+    database = await ping_database()
+    ok = ready and database["status"] == "ok"
+    if not ok:
+        response.status_code = 503
+    return {"status": "ready" if ok else "not ready", "started": ready, "database": database}
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -371,14 +2282,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
-logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
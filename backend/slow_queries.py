@@ -0,0 +1,196 @@
+"""
+Slow-operation log: a PyMongo CommandListener that picks out commands slower
+than a threshold, records their filter shape and an explain() summary, and
+writes them to a capped collection for the admin endpoint
+The listener runs on the driver's threads, so it only hands slow commands to
+the event loop; explaining and writing happen in a background task
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from pymongo import monitoring
+from pymongo.errors import CollectionInvalid, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_NAME = "slow_queries"
+
+# Commands that can be explained without side effects, and the parts of
+# them that explain() needs
+EXPLAINABLE = {
+    "find": ("filter", "sort", "projection", "limit", "skip", "hint", "collation"),
+    "aggregate": ("pipeline", "hint", "collation"),
+    "count": ("query", "limit", "skip", "hint", "collation"),
+    "distinct": ("key", "query", "collation"),
+}
+# Commands worth logging when slow; writes are logged but not explained
+LOGGED = set(EXPLAINABLE) | {"getMore", "insert", "update", "delete", "findAndModify"}
+MAX_QUEUED = 1000
+
+
+def shape(value):
+    """The structure of a filter with every literal replaced by its type name"""
+    if isinstance(value, dict):
+        return {key: shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        # Keep operator lists ($and, $or, pipelines) but collapse $in-style value lists
+        if value and all(isinstance(item, dict) for item in value):
+            return [shape(item) for item in value]
+        return [type(value[0]).__name__] if value else []
+    return type(value).__name__
+
+
+def command_shape(command_name: str, command: dict) -> dict:
+    if command_name == "find":
+        return {key: shape(command[key]) for key in ("filter", "sort", "projection") if key in command}
+    if command_name == "aggregate":
+        return {"pipeline": shape(command.get("pipeline", []))}
+    if command_name in ("count", "distinct"):
+        return {"query": shape(command.get("query", {}))}
+    if command_name in ("update", "delete"):
+        statements = command.get("updates" if command_name == "update" else "deletes") or []
+        return {"filter": shape(statements[0].get("q", {}))} if statements else {}
+    if command_name == "findAndModify":
+        return {"filter": shape(command.get("query", {}))}
+    return {}
+
+
+def summarize_plan(plan: dict) -> dict:
+    """Collect the stages and index names of a (possibly nested) winning plan"""
+    stages, indexes = [], []
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, dict):
+            continue
+        if "stage" in node:
+            stages.append(node["stage"])
+        if "indexName" in node:
+            indexes.append(node["indexName"])
+        for key in ("inputStage", "queryPlan", "winningPlan"):
+            if key in node:
+                stack.append(node[key])
+        stack.extend(node.get("inputStages", []))
+    return {"stages": stages, "indexes": indexes}
+
+
+def summarize_explain(explain: dict) -> dict:
+    # Aggregations nest the find-layer explain under their first stage
+    if "stages" in explain and "queryPlanner" not in explain:
+        explain = explain["stages"][0].get("$cursor", {})
+    planner = explain.get("queryPlanner", {})
+    stats = explain.get("executionStats", {})
+    summary = summarize_plan(planner.get("winningPlan", {}))
+    summary.update({
+        "collscan": "COLLSCAN" in summary["stages"],
+        "keys_examined": stats.get("totalKeysExamined"),
+        "docs_examined": stats.get("totalDocsExamined"),
+        "returned": stats.get("nReturned"),
+        "execution_ms": stats.get("executionTimeMillis"),
+    })
+    return summary
+
+
+class SlowQueryLog(monitoring.CommandListener):
+    def __init__(self, threshold_ms: float, explain_interval: float, log_bytes: int):
+        self.threshold_ms = threshold_ms
+        self.explain_interval = explain_interval
+        self.log_bytes = log_bytes
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self.dropped = 0
+        self._pending: Dict[tuple, dict] = {}
+        self._lock = threading.Lock()
+        # shape key -> (monotonic time, explain summary); explain each shape at most once per interval
+        self._explained: Dict[str, tuple] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0 and self.loop is not None
+
+    def started(self, event):
+        if not self.enabled or event.command_name not in LOGGED:
+            return
+        if event.command.get(event.command_name) == COLLECTION_NAME:
+            return
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = event.command
+
+    def succeeded(self, event):
+        with self._lock:
+            command = self._pending.pop((event.connection_id, event.request_id), None)
+        if command is None or event.duration_micros < self.threshold_ms * 1000:
+            return
+        record = {
+            "collection": command.get("collection") if event.command_name == "getMore"
+            else command.get(event.command_name),
+            "command": event.command_name,
+            "duration_ms": event.duration_micros / 1000,
+            "database": event.database_name,
+            "at": datetime.utcnow(),
+        }
+        self.loop.call_soon_threadsafe(self._enqueue, record, command)
+
+    def failed(self, event):
+        with self._lock:
+            self._pending.pop((event.connection_id, event.request_id), None)
+
+    def _enqueue(self, record: dict, command: dict):
+        try:
+            self.queue.put_nowait((record, command))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def ensure_collection(self, db):
+        try:
+            await db.create_collection(COLLECTION_NAME, capped=True, size=self.log_bytes)
+        except CollectionInvalid:
+            pass
+
+    async def run(self, db):
+        """Explain and store slow commands handed over by the listener"""
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=MAX_QUEUED)
+        try:
+            while True:
+                record, command = await self.queue.get()
+                try:
+                    record["shape"] = command_shape(record["command"], command)
+                    record["explain"] = await self.explain(db, record, command)
+                    await db[COLLECTION_NAME].insert_one(record)
+                    logger.warning(
+                        "Slow %s on %s took %.1f ms: %s",
+                        record["command"], record["collection"], record["duration_ms"], record["explain"]
+                    )
+                except Exception:
+                    logger.exception("Could not record slow %s on %s", record["command"], record["collection"])
+        finally:
+            self.loop = None
+
+    async def explain(self, db, record: dict, command: dict) -> Optional[dict]:
+        fields = EXPLAINABLE.get(record["command"])
+        if fields is None:
+            return None
+        key = f'{record["collection"]}.{record["command"]}:{record["shape"]}'
+        cached = self._explained.get(key)
+        if cached and time.monotonic() - cached[0] < self.explain_interval:
+            return cached[1]
+
+        explained = {record["command"]: command[record["command"]]}
+        explained.update({field: command[field] for field in fields if field in command})
+        if record["command"] == "aggregate":
+            explained["cursor"] = {}
+        try:
+            result = await db.command({"explain": explained, "verbosity": "executionStats"})
+            summary = summarize_explain(result)
+        except PyMongoError as e:
+            summary = {"error": str(e)}
+        if len(self._explained) > 10000:
+            self._explained.clear()
+        self._explained[key] = (time.monotonic(), summary)
+        return summary
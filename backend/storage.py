@@ -0,0 +1,74 @@
+"""
+Storage backends behind one interface, so that route handlers never depend on
+where the data lives
+
+A storage object hands out collections by attribute or key (`db.books`,
+`db["books"]`) with the Motor collection API: find/find_one with projection,
+sort, skip and limit; count_documents; aggregate; insert/update/replace/delete
+one or many; find_one_and_update/delete; bulk_write; index_information and
+create_indexes. Errors are PyMongo's (DuplicateKeyError, BulkWriteError,
+OperationFailure) on every backend. Beyond collections it offers command(),
+create_collection(), watch(), gridfs_bucket(), drop_database() and close().
+
+    mongo   Motor client on MONGO_URL (the default)
+    memory  In-process engine with indexes, for tests and benchmarks; nothing
+            persists and there are no change streams
+"""
+
+from typing import Any, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+
+from memory_storage import MemoryStorage
+
+BACKENDS = ("mongo", "memory")
+
+
+class MotorStorage:
+    """A MongoDB database through Motor"""
+
+    backend = "mongo"
+
+    def __init__(self, client: AsyncIOMotorClient, name: str):
+        self.client = client
+        self.database = client[name]
+        self.name = name
+
+    def __getitem__(self, name: str):
+        return self.database[name]
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.database[name]
+
+    async def list_collection_names(self, **kwargs) -> List[str]:
+        return await self.database.list_collection_names(**kwargs)
+
+    async def create_collection(self, name: str, **kwargs):
+        return await self.database.create_collection(name, **kwargs)
+
+    async def command(self, command, **kwargs) -> Dict[str, Any]:
+        return await self.database.command(command, **kwargs)
+
+    def watch(self, pipeline: Optional[List[dict]] = None, **kwargs):
+        return self.database.watch(pipeline, **kwargs)
+
+    def gridfs_bucket(self, bucket_name: str) -> AsyncIOMotorGridFSBucket:
+        # Created per use so it binds to the running event loop
+        return AsyncIOMotorGridFSBucket(self.database, bucket_name=bucket_name)
+
+    async def drop_database(self):
+        await self.client.drop_database(self.name)
+
+    def close(self):
+        self.client.close()
+
+
+def open_storage(backend: str, url: str, name: str, **client_options):
+    """Storage for the named database; client_options go to the Motor client"""
+    if backend == "mongo":
+        return MotorStorage(AsyncIOMotorClient(url, **client_options), name)
+    if backend == "memory":
+        return MemoryStorage(name)
+    raise ValueError(f"Unknown storage backend {backend!r}; choose from {', '.join(BACKENDS)}")
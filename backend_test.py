@@ -9,6 +9,7 @@ import json
 import base64
 from datetime import datetime, timedelta
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Get backend URL from environment
 BACKEND_URL = "https://8b7e9b12-41dd-49d1-aad1-c9bae2bb635e.preview.emergentagent.com/api"
@@ -100,7 +101,7 @@ class LibraryBackendTester:
         try:
             response = self.session.get(f"{self.base_url}/books")
             if response.status_code == 200:
-                books = response.json()
+                books = response.json()["items"]
                 self.log(f"✅ Retrieved {len(books)} books")
                 if len(books) >= len(self.created_books):
                     self.log("✅ All created books are retrievable")
@@ -194,7 +195,7 @@ class LibraryBackendTester:
                     self.log(f"✅ Created member: {member['name']} (ID: {member['student_id']})")
                     
                     # Verify picture was stored
-                    if member.get('picture_base64'):
+                    if member.get('picture_etag'):
                         self.log(f"✅ Picture successfully stored for {member['name']}")
                     else:
                         self.log(f"⚠️ Picture not stored for {member['name']}")
@@ -226,12 +227,29 @@ class LibraryBackendTester:
         try:
             response = self.session.get(f"{self.base_url}/members")
             if response.status_code == 200:
-                members = response.json()
+                members = response.json()["items"]
                 self.log(f"✅ Retrieved {len(members)} members")
                 
-                # Verify pictures are included
-                members_with_pictures = [m for m in members if m.get('picture_base64')]
+                # Verify pictures are referenced but not embedded
+                members_with_pictures = [m for m in members if m.get('picture_etag')]
                 self.log(f"✅ {len(members_with_pictures)} members have pictures stored")
+                if any('picture_base64' in m for m in members):
+                    self.log("❌ Member list still embeds picture data")
+                
+                # Verify the picture endpoint serves the image and honours its ETag
+                if members_with_pictures:
+                    member = members_with_pictures[0]
+                    picture_url = f"{self.base_url}/members/{member['id']}/picture?size=thumb"
+                    response = self.session.get(picture_url)
+                    if response.status_code == 200 and response.headers.get('ETag'):
+                        self.log("✅ Member picture thumbnail served with ETag")
+                        cached = self.session.get(picture_url, headers={'If-None-Match': response.headers['ETag']})
+                        if cached.status_code == 304:
+                            self.log("✅ Conditional picture request returned 304")
+                        else:
+                            self.log(f"❌ Conditional picture request returned {cached.status_code}")
+                    else:
+                        self.log(f"❌ Failed to get member picture: {response.status_code}")
             else:
                 self.log(f"❌ Failed to get members: {response.status_code}")
         except Exception as e:
@@ -402,7 +420,7 @@ class LibraryBackendTester:
                     # Verify transaction status updated
                     transactions_response = self.session.get(f"{self.base_url}/transactions")
                     if transactions_response.status_code == 200:
-                        transactions = transactions_response.json()
+                        transactions = transactions_response.json()["items"]
                         returned_transaction = next((t for t in transactions if t['id'] == transaction_id), None)
                         if returned_transaction and returned_transaction['status'] == 'returned':
                             self.log("✅ Transaction status correctly updated to 'returned'")
@@ -435,7 +453,7 @@ class LibraryBackendTester:
         try:
             response = self.session.get(f"{self.base_url}/search/books?q=Mockingbird")
             if response.status_code == 200:
-                books = response.json()
+                books = response.json()["items"]
                 if any("Mockingbird" in book['title'] for book in books):
                     self.log("✅ Book search by title working")
                 else:
@@ -450,7 +468,7 @@ class LibraryBackendTester:
         try:
             response = self.session.get(f"{self.base_url}/search/books?q=Harper")
             if response.status_code == 200:
-                books = response.json()
+                books = response.json()["items"]
                 if any("Harper" in book['author'] for book in books):
                     self.log("✅ Book search by author working")
                 else:
@@ -465,7 +483,7 @@ class LibraryBackendTester:
         try:
             response = self.session.get(f"{self.base_url}/search/books?q=978-0-06-112008-4")
             if response.status_code == 200:
-                books = response.json()
+                books = response.json()["items"]
                 if any("978-0-06-112008-4" in book['isbn'] for book in books):
                     self.log("✅ Book search by ISBN working")
                 else:
@@ -480,7 +498,7 @@ class LibraryBackendTester:
         try:
             response = self.session.get(f"{self.base_url}/search/books?genre=Fiction")
             if response.status_code == 200:
-                books = response.json()
+                books = response.json()["items"]
                 if all("Fiction" in book['genre'] for book in books if books):
                     self.log("✅ Book filter by genre working")
                 else:
@@ -495,7 +513,7 @@ class LibraryBackendTester:
         try:
             response = self.session.get(f"{self.base_url}/search/books?available_only=true")
             if response.status_code == 200:
-                books = response.json()
+                books = response.json()["items"]
                 if all(book['available_copies'] > 0 for book in books):
                     self.log("✅ Book filter by availability working")
                 else:
@@ -510,7 +528,7 @@ class LibraryBackendTester:
         try:
             response = self.session.get(f"{self.base_url}/search/members?q=Emma")
             if response.status_code == 200:
-                members = response.json()
+                members = response.json()["items"]
                 if any("Emma" in member['name'] for member in members):
                     self.log("✅ Member search by name working")
                 else:
@@ -525,7 +543,7 @@ class LibraryBackendTester:
         try:
             response = self.session.get(f"{self.base_url}/search/members?q=STU2024001")
             if response.status_code == 200:
-                members = response.json()
+                members = response.json()["items"]
                 if any("STU2024001" in member['student_id'] for member in members):
                     self.log("✅ Member search by student ID working")
                 else:
@@ -540,7 +558,7 @@ class LibraryBackendTester:
         try:
             response = self.session.get(f"{self.base_url}/search/members?grade=10th")
             if response.status_code == 200:
-                members = response.json()
+                members = response.json()["items"]
                 if all("10th" in member['grade'] for member in members if members):
                     self.log("✅ Member filter by grade working")
                 else:
@@ -611,7 +629,7 @@ class LibraryBackendTester:
         try:
             response = self.session.get(f"{self.base_url}/transactions")
             if response.status_code == 200:
-                transactions = response.json()
+                transactions = response.json()["items"]
                 self.log(f"✅ Retrieved {len(transactions)} transactions")
                 
                 if transactions:
@@ -640,6 +658,97 @@ class LibraryBackendTester:
         
         return True
     
+    def test_concurrent_checkout(self, copies=5, parallel_requests=200):
+        """Stress test: hundreds of parallel checkouts must never oversell a book"""
+        self.log("\n=== Testing Concurrent Checkout (No Overselling) ===")
+        run_id = datetime.now().strftime('%Y%m%d%H%M%S')
+        
+        try:
+            response = self.session.post(f"{self.base_url}/books", json={
+                "title": f"Concurrency Test Book {run_id}",
+                "author": "Load Tester",
+                "isbn": f"CONC-{run_id}",
+                "genre": "Test",
+                "total_copies": copies
+            })
+            if response.status_code != 200:
+                self.log(f"❌ Failed to create stress test book: {response.status_code}")
+                return False
+            book = response.json()
+            
+            member_ids = []
+            for i in range(parallel_requests):
+                response = self.session.post(f"{self.base_url}/members", json={
+                    "name": f"Concurrent Student {i}",
+                    "student_id": f"CONC{run_id}{i:04d}",
+                    "grade": "12th Grade"
+                })
+                if response.status_code == 200:
+                    member_ids.append(response.json()['id'])
+            self.log(f"Created {len(member_ids)} members for the stress test")
+            
+            def checkout(member_id):
+                # requests.Session is not thread-safe, so each call uses its own
+                return requests.post(f"{self.base_url}/transactions/checkout", json={
+                    "book_id": book['id'],
+                    "member_id": member_id
+                }).status_code
+            
+            start = time.time()
+            with ThreadPoolExecutor(max_workers=parallel_requests) as executor:
+                statuses = list(executor.map(checkout, member_ids))
+            elapsed = time.time() - start
+            
+            succeeded = statuses.count(200)
+            rejected = statuses.count(400)
+            self.log(f"{len(statuses)} parallel checkouts in {elapsed:.2f}s: {succeeded} succeeded, {rejected} rejected")
+            
+            book_after = self.session.get(f"{self.base_url}/books/{book['id']}").json()
+            if succeeded == copies and book_after['available_copies'] == 0:
+                self.log(f"✅ No overselling: exactly {copies} copies checked out, 0 available")
+                return True
+            self.log(f"❌ Oversold: {succeeded} checkouts succeeded, available_copies={book_after['available_copies']}")
+            return False
+        except Exception as e:
+            self.log(f"❌ Error in concurrent checkout test: {str(e)}")
+            return False
+    
+    def test_conditional_get(self):
+        """Unchanged collections answer If-None-Match with 304; a write changes the ETag"""
+        self.log("\n=== Testing Conditional GET (ETag) ===")
+        run_id = datetime.now().strftime('%Y%m%d%H%M%S')
+        
+        try:
+            for path in ["/books", "/members", "/transactions", "/dashboard/stats"]:
+                response = self.session.get(f"{self.base_url}{path}")
+                etag = response.headers.get("ETag")
+                if response.status_code != 200 or not etag or "Last-Modified" not in response.headers:
+                    self.log(f"❌ {path} did not return ETag and Last-Modified headers")
+                    return False
+                response = self.session.get(f"{self.base_url}{path}", headers={"If-None-Match": etag})
+                if response.status_code != 304:
+                    self.log(f"❌ {path} returned {response.status_code} for a matching If-None-Match")
+                    return False
+            self.log("✅ Matching If-None-Match returns 304 on books, members, transactions and stats")
+            
+            etag = self.session.get(f"{self.base_url}/books").headers["ETag"]
+            self.session.post(f"{self.base_url}/books", json={
+                "title": f"ETag Test Book {run_id}",
+                "author": "Cache Tester",
+                "isbn": f"ETAG-{run_id}",
+                "genre": "Test",
+                "total_copies": 1
+            })
+            response = self.session.get(f"{self.base_url}/books", headers={"If-None-Match": etag})
+            if response.status_code != 200 or response.headers.get("ETag") == etag:
+                self.log(f"❌ Book list still reported as unchanged after adding a book ({response.status_code})")
+                return False
+            self.log("✅ Adding a book changes the book list ETag")
+            return True
+        except Exception as e:
+            self.log(f"❌ Error in conditional GET test: {str(e)}")
+            return False
+    
     def run_all_tests(self):
         """Run all backend tests"""
         self.log("🚀 Starting Comprehensive Backend Testing for Library Management System")
@@ -658,7 +767,9 @@ class LibraryBackendTester:
             "Book Return System": self.test_book_return_system(),
             "Search and Filter Functionality": self.test_search_and_filter_functionality(),
             "Dashboard Statistics": self.test_dashboard_statistics(),
-            "Transaction Retrieval": self.test_get_transactions()
+            "Transaction Retrieval": self.test_get_transactions(),
+            "Concurrent Checkout": self.test_concurrent_checkout(),
+            "Conditional GET": self.test_conditional_get()
         }
         
         # Summary
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark for bulk checkout and bulk return
+Hands a class set of textbooks to 5000 students and reports items per second
+for the bulk endpoints against one-at-a-time checkout and return
+"""
+
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+from storage import open_storage  # noqa: E402
+
+NUM_MEMBERS = 5000
+NUM_TEXTBOOKS = 5
+SINGLE_SAMPLE = 500
+
+
+async def seed(db):
+    now = datetime.utcnow()
+    books = [
+        {
+            "id": str(uuid.uuid4()),
+            "title": f"Textbook {i}",
+            "author": "Curriculum Board",
+            "isbn": f"TXT-{i:04d}",
+            "genre": "Textbook",
+            "total_copies": NUM_MEMBERS,
+            "available_copies": NUM_MEMBERS,
+            "description": "",
+            "created_at": now,
+        }
+        for i in range(NUM_TEXTBOOKS)
+    ]
+    members = [
+        {
+            "id": str(uuid.uuid4()),
+            "name": f"Student {i}",
+            "student_id": f"STU{i:06d}",
+            "grade": f"{9 + i % 4}th Grade",
+            "email": "",
+            "phone": "",
+            "created_at": now,
+        }
+        for i in range(NUM_MEMBERS)
+    ]
+    await db.books.insert_many(books)
+    await db.members.insert_many(members)
+    return [book["id"] for book in books], [member["id"] for member in members]
+
+
+def report(label, items, elapsed):
+    print(f"{label:<28} {items:>6} items in {elapsed:7.2f} s   {items / elapsed:9.0f} items/s")
+
+
+async def main():
+    db = open_storage(
+        server.STORAGE_BACKEND, os.environ["MONGO_URL"], os.environ["DB_NAME"] + "_bench_bulk"
+    )
+    await db.drop_database()
+    server.db = db
+
+    try:
+        await server.ensure_indexes()
+        book_ids, member_ids = await seed(db)
+
+        # One-at-a-time baseline on a sample, using the first textbook
+        start = time.perf_counter()
+        singles = []
+        for member_id in member_ids[:SINGLE_SAMPLE]:
+            transaction = await server.checkout_book(
+                server.TransactionCreate(book_id=book_ids[0], member_id=member_id)
+            )
+            singles.append(transaction.id)
+        report("single checkout", len(singles), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for transaction_id in singles:
+            await server.return_book(transaction_id)
+        report("single return", len(singles), time.perf_counter() - start)
+
+        # Every student gets every other textbook in one bulk call per book
+        for book_id in book_ids[1:]:
+            items = [server.TransactionCreate(book_id=book_id, member_id=member_id) for member_id in member_ids]
+            start = time.perf_counter()
+            result = await server.bulk_checkout_books(server.BulkCheckoutRequest(items=items))
+            report("bulk checkout", result.succeeded, time.perf_counter() - start)
+
+            transaction_ids = [item.transaction_id for item in result.results if item.status == "ok"]
+            start = time.perf_counter()
+            result = await server.bulk_return_books(server.BulkReturnRequest(transaction_ids=transaction_ids))
+            report("bulk return", result.succeeded, time.perf_counter() - start)
+    finally:
+        await db.drop_database()
+        db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the cost of request and database command instrumentation
+Times the metric primitives directly, then compares requests per second on a
+route that does no database work with METRICS_ENABLED off and on
+"""
+
+import asyncio
+import logging
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import httpx  # noqa: E402
+import server  # noqa: E402
+
+ITERATIONS = 200000
+REQUESTS = 5000
+ROUTE = "/api/cache/stats"
+
+
+def time_per_call(fn, iterations=ITERATIONS):
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def command_roundtrip(i):
+    listener = server.command_metrics
+    listener.started(SimpleNamespace(
+        command={"find": "books"}, command_name="find", connection_id=("localhost", 27017), request_id=i
+    ))
+    listener.succeeded(SimpleNamespace(
+        command_name="find", connection_id=("localhost", 27017), request_id=i,
+        duration_micros=800, reply={"cursor": {"firstBatch": [{}] * 20}}
+    ))
+
+
+async def requests_per_second(http):
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        (await http.get(ROUTE)).raise_for_status()
+    return REQUESTS / (time.perf_counter() - start)
+
+
+async def main():
+    histogram_us = time_per_call(lambda i: server.request_duration.observe(("GET", ROUTE, "200"), 0.004))
+    listener_us = time_per_call(command_roundtrip)
+    print(f"histogram observe:          {histogram_us:6.2f} us")
+    print(f"command listener roundtrip: {listener_us:6.2f} us")
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        await requests_per_second(http)  # warm up
+        server.METRICS_ENABLED = False
+        baseline = await requests_per_second(http)
+        server.METRICS_ENABLED = True
+        instrumented = await requests_per_second(http)
+    overhead_us = (1 / instrumented - 1 / baseline) * 1e6
+    print(f"{ROUTE}: {baseline:.0f} req/s without metrics, {instrumented:.0f} req/s with metrics "
+          f"({overhead_us:+.1f} us per request)")
+    print(f"{len(server.metrics_registry.render())} bytes of /metrics output")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
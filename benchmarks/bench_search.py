@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the in-process search index behind /api/search/books
+Builds an index over 100k synthetic books and reports query latency percentiles
+"""
+
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from search import InvertedIndex  # noqa: E402
+
+NUM_BOOKS = 100000
+NUM_QUERIES = 2000
+SEARCH_LIMIT = 200
+
+VOCABULARY_SIZE = 20000
+NUM_SURNAMES = 3000
+SYLLABLES = (
+    "ka ri to mo na le si ve da lo ur an el or in ta be co mi pe "
+    "sha ther ston wood ber gar land ley son ham well ford ridge"
+).split()
+
+
+def make_words(rng, count):
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def zipf_weights(count):
+    # Word frequencies in titles roughly follow Zipf's law
+    return [1 / (rank + 1) for rank in range(count)]
+
+
+def make_books(rng):
+    words = make_words(rng, VOCABULARY_SIZE)
+    rng.shuffle(words)
+    surnames = make_words(rng, NUM_SURNAMES)
+    weights = zipf_weights(len(words))
+    books = []
+    for i in range(NUM_BOOKS):
+        title = " ".join(rng.choices(words, weights, k=rng.randint(2, 6)))
+        books.append({
+            "id": f"book-{i}",
+            "title": title,
+            "author": f"{rng.choice(surnames).title()} {rng.choice(surnames).title()}",
+            "isbn": f"978-{rng.randint(0, 9)}-{rng.randint(10000, 99999)}-{rng.randint(100, 999)}-{i % 10}",
+        })
+    return books
+
+
+def make_queries(rng, books):
+    queries = []
+    for _ in range(NUM_QUERIES):
+        book = rng.choice(books)
+        kind = rng.random()
+        if kind < 0.4:
+            # A few title words, the last one partially typed
+            words = book["title"].split()[:rng.randint(1, 3)]
+            words[-1] = words[-1][:max(3, len(words[-1]) - 2)]
+            queries.append(" ".join(words))
+        elif kind < 0.7:
+            queries.append(book["author"].split()[-1][:5])
+        elif kind < 0.9:
+            queries.append(book["isbn"])
+        else:
+            queries.append(book["title"].split()[0][:3] + " " + book["author"].split()[0][:3])
+    return queries
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def main():
+    rng = random.Random(42)
+    books = make_books(rng)
+
+    start = time.perf_counter()
+    index = InvertedIndex.build({"title": 3.0, "isbn": 3.0, "author": 2.0}, books)
+    print(f"Indexed {len(index)} books in {time.perf_counter() - start:.2f} s")
+
+    timings = []
+    for query in make_queries(rng, books):
+        start = time.perf_counter()
+        index.search(query, limit=SEARCH_LIMIT)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings.sort()
+    print(
+        f"{NUM_QUERIES} queries   "
+        f"p50: {percentile(timings, 0.50):.2f} ms   "
+        f"p95: {percentile(timings, 0.95):.2f} ms   "
+        f"p99: {percentile(timings, 0.99):.2f} ms   "
+        f"mean: {statistics.mean(timings):.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Benchmark for list-route response serialization
+Serves full 1000-row pages of /api/books, /api/members and /api/transactions
+in one process and reports requests per second with FAST_SERIALIZATION off
+and on
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import httpx  # noqa: E402
+import server  # noqa: E402
+from storage import open_storage  # noqa: E402
+
+NUM_DOCUMENTS = 1000
+PAGE_SIZE = 1000
+DURATION_SECONDS = 5
+ROUTES = ["/api/books", "/api/members", "/api/transactions"]
+
+
+async def seed(db):
+    now = datetime.utcnow()
+    books = [
+        {
+            "id": str(uuid.uuid4()),
+            "title": f"Book {i}",
+            "author": f"Author {i % 97}",
+            "isbn": f"BENCH-{i:06d}",
+            "genre": "Fiction",
+            "total_copies": 3,
+            "available_copies": 2,
+            "description": "A short description of the book",
+            "created_at": now + timedelta(microseconds=i),
+        }
+        for i in range(NUM_DOCUMENTS)
+    ]
+    members = [
+        {
+            "id": str(uuid.uuid4()),
+            "name": f"Student {i}",
+            "student_id": f"STU{i:06d}",
+            "grade": f"{9 + i % 4}th Grade",
+            "email": f"student{i}@school.edu",
+            "phone": "",
+            "created_at": now + timedelta(microseconds=i),
+        }
+        for i in range(NUM_DOCUMENTS)
+    ]
+    transactions = [
+        {
+            "id": str(uuid.uuid4()),
+            "book_id": books[i]["id"],
+            "member_id": members[i]["id"],
+            "checkout_date": now,
+            "due_date": now + timedelta(days=14),
+            "return_date": None,
+            "status": "borrowed",
+            "created_at": now + timedelta(microseconds=i),
+            "active": True,
+        }
+        for i in range(NUM_DOCUMENTS)
+    ]
+    await db.books.insert_many(books)
+    await db.members.insert_many(members)
+    await db.transactions.insert_many(transactions)
+
+
+async def requests_per_second(http, route):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < DURATION_SECONDS:
+        response = await http.get(route, params={"limit": PAGE_SIZE})
+        response.raise_for_status()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+async def main():
+    db = open_storage(
+        server.STORAGE_BACKEND, os.environ["MONGO_URL"], os.environ["DB_NAME"] + "_bench_serialization"
+    )
+    await db.drop_database()
+    server.db = db
+
+    try:
+        await server.ensure_indexes()
+        await seed(db)
+
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        # One process and one event loop, i.e. what a single worker can serve
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            print(f"{'route':<20} {'models':>10} {'fast':>10} {'speedup':>8}")
+            for route in ROUTES:
+                server.FAST_SERIALIZATION = False
+                baseline = await requests_per_second(http, route)
+                server.FAST_SERIALIZATION = True
+                fast = await requests_per_second(http, route)
+                print(f"{route:<20} {baseline:8.1f}/s {fast:8.1f}/s {fast / baseline:7.2f}x")
+    finally:
+        await db.drop_database()
+        db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
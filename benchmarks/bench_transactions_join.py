@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Benchmark for GET /api/transactions
+Compares the old per-row find_one joins with the batched $in joins
+by counting MongoDB round trips and measuring latency at 10k transactions
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from pymongo import monitoring
+from starlette.requests import Request
+from starlette.responses import Response
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+from storage import open_storage  # noqa: E402
+
+NUM_BOOKS = 500
+NUM_MEMBERS = 1000
+NUM_TRANSACTIONS = 10000
+RUNS = 5
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+async def get_transactions_n_plus_one(db):
+    """The previous implementation: two find_one calls per transaction"""
+    transactions = await db.transactions.find().sort("created_at", -1).to_list(1000)
+    result = []
+    for transaction in transactions:
+        book = await db.books.find_one({"id": transaction["book_id"]}, {"_id": 0})
+        member = await db.members.find_one({"id": transaction["member_id"]}, {"_id": 0})
+        result.append((transaction, book, member))
+    return result
+
+
+async def get_transactions_batched():
+    """The route itself for one page as large as the old list, with cold book and member caches"""
+    server.book_cache.clear()
+    server.member_cache.clear()
+    request = Request({"type": "http", "method": "GET", "path": "/api/transactions", "query_string": b"", "headers": []})
+    return await server.get_transactions(request, Response(), limit=server.MAX_PAGE_SIZE, cursor=None)
+
+
+async def seed(db):
+    now = datetime.utcnow()
+    books = [
+        {
+            "id": str(uuid.uuid4()),
+            "title": f"Book {i}",
+            "author": f"Author {i % 50}",
+            "isbn": f"978-0-{i:06d}",
+            "genre": "Fiction",
+            "total_copies": 100,
+            "available_copies": 80,
+            "description": "",
+            "created_at": now,
+        }
+        for i in range(NUM_BOOKS)
+    ]
+    members = [
+        {
+            "id": str(uuid.uuid4()),
+            "name": f"Student {i}",
+            "student_id": f"STU{i:06d}",
+            "grade": f"{9 + i % 4}th Grade",
+            "picture_base64": "",
+            "email": f"student{i}@school.edu",
+            "phone": "",
+            "created_at": now,
+        }
+        for i in range(NUM_MEMBERS)
+    ]
+    transactions = []
+    for i in range(NUM_TRANSACTIONS):
+        checkout_date = now - timedelta(minutes=i)
+        transactions.append({
+            "id": str(uuid.uuid4()),
+            "book_id": books[i % NUM_BOOKS]["id"],
+            "member_id": members[i % NUM_MEMBERS]["id"],
+            "checkout_date": checkout_date,
+            "due_date": checkout_date + timedelta(days=14),
+            "return_date": checkout_date + timedelta(days=3),
+            "status": "returned",
+            "created_at": checkout_date,
+        })
+    await db.books.insert_many(books)
+    await db.members.insert_many(members)
+    await db.transactions.insert_many(transactions)
+
+
+async def measure(label, func, counter):
+    timings = []
+    round_trips = 0
+    for _ in range(RUNS):
+        counter.count = 0
+        start = time.perf_counter()
+        await func()
+        timings.append((time.perf_counter() - start) * 1000)
+        round_trips = counter.count
+    # The memory backend has no command monitoring, so only latency is comparable there
+    if server.STORAGE_BACKEND != "mongo":
+        round_trips = "n/a"
+    print(
+        f"{label:<22} round trips: {round_trips:>5}   "
+        f"median: {statistics.median(timings):8.1f} ms   "
+        f"min: {min(timings):8.1f} ms"
+    )
+
+
+async def main():
+    counter = CommandCounter()
+    db = open_storage(
+        server.STORAGE_BACKEND, os.environ["MONGO_URL"], os.environ["DB_NAME"] + "_bench_transactions",
+        event_listeners=[counter]
+    )
+    await db.drop_database()
+    server.db = db
+
+    try:
+        print(f"Seeding {NUM_TRANSACTIONS} transactions...")
+        await seed(db)
+        await measure("N+1 find_one joins", lambda: get_transactions_n_plus_one(db), counter)
+        await measure("batched $in joins", get_transactions_batched, counter)
+    finally:
+        await db.drop_database()
+        db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
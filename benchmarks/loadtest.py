@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Load test for the library API
+Drives a weighted mix of search, list, checkout and return requests at a fixed
+concurrency and reports latency percentiles and throughput per route. Results
+are written as JSON so runs can be compared across versions.
+
+    # In-process against a local mongod (MONGO_URL / DB_NAME from backend/.env)
+    python benchmarks/loadtest.py --concurrency 50 --duration 30 --output run.json
+
+    # In-process against the in-memory storage backend, no database needed
+    python benchmarks/loadtest.py --backend memory
+
+    # Against a running server, compared with an earlier run
+    python benchmarks/loadtest.py --url http://localhost:8001 --compare run.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from contextlib import AsyncExitStack
+from datetime import datetime
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+import httpx  # noqa: E402
+from dotenv import load_dotenv  # noqa: E402
+
+DEFAULT_MIX = "search=35,list=35,checkout=15,return=15"
+# Mix name -> LoadTest method
+OPERATIONS = {"search": "search", "list": "list_page", "checkout": "checkout", "return": "return_loan"}
+WORDS = (
+    "history science river garden winter shadow ocean mountain silent city "
+    "secret journey light empire stone forest lost island star voice"
+).split()
+GENRES = ["Fiction", "Science", "History", "Mathematics", "Poetry", "Biography"]
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in OPERATIONS:
+            raise SystemExit(f"Unknown operation {name!r}; choose from {', '.join(OPERATIONS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class LoadTest:
+    def __init__(self, http: httpx.AsyncClient, rng: random.Random):
+        self.http = http
+        self.rng = rng
+        self.book_ids = []
+        self.member_ids = []
+        self.titles = []
+        self.open_loans = []
+        self.timings = {}
+        self.statuses = {}
+        self.errors = {}
+
+    async def seed(self, num_books: int, num_members: int, concurrency: int):
+        run_id = uuid.uuid4().hex[:8]
+        rows = []
+        for i in range(num_books):
+            title = " ".join(self.rng.sample(WORDS, self.rng.randint(2, 4))).title()
+            rows.append(json.dumps({
+                "title": title,
+                "author": f"Author {self.rng.randint(1, max(1, num_books // 10))}",
+                "isbn": f"LOAD-{run_id}-{i:07d}",
+                "genre": self.rng.choice(GENRES),
+                "total_copies": self.rng.randint(1, 5),
+            }))
+        files = {"file": ("books.ndjson", "\n".join(rows).encode(), "application/x-ndjson")}
+        response = await self.http.post("/api/import/books", files=files, timeout=None)
+        response.raise_for_status()
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def create_member(i):
+            async with semaphore:
+                response = await self.http.post("/api/members", json={
+                    "name": f"Load Student {i}",
+                    "student_id": f"LOAD-{run_id}-{i:06d}",
+                    "grade": f"{9 + i % 4}th Grade",
+                })
+                response.raise_for_status()
+
+        await asyncio.gather(*[create_member(i) for i in range(num_members)])
+        await self.load_ids()
+
+    async def load_ids(self):
+        for path, target in (("/api/books", self.book_ids), ("/api/members", self.member_ids)):
+            cursor = None
+            while True:
+                params = {"limit": 1000, **({"cursor": cursor} if cursor else {})}
+                page = (await self.http.get(path, params=params, timeout=None)).json()
+                for item in page["items"]:
+                    target.append(item["id"])
+                    if path == "/api/books":
+                        self.titles.append(item["title"])
+                cursor = page["next_cursor"]
+                if not cursor:
+                    break
+        if not self.book_ids or not self.member_ids:
+            raise SystemExit("No books or members to test with; seed some first")
+
+    def record(self, route: str, elapsed: float, status: int):
+        self.timings.setdefault(route, []).append(elapsed)
+        self.statuses.setdefault(route, {})
+        self.statuses[route][status] = self.statuses[route].get(status, 0) + 1
+
+    async def call(self, route: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.http.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.errors[route] = self.errors.get(route, 0) + 1
+            logging.debug("%s failed: %s", route, e)
+            return None
+        self.record(route, time.perf_counter() - start, response.status_code)
+        return response
+
+    async def search(self):
+        words = self.rng.choice(self.titles).split()
+        query = words[0][:self.rng.randint(3, len(words[0]))]
+        await self.call("GET /api/search/books", "GET", "/api/search/books", params={"q": query, "limit": 50})
+
+    async def list_page(self):
+        path = self.rng.choice(["/api/books", "/api/members", "/api/transactions"])
+        await self.call(f"GET {path}", "GET", path, params={"limit": 100})
+
+    async def checkout(self):
+        response = await self.call("POST /api/transactions/checkout", "POST", "/api/transactions/checkout", json={
+            "book_id": self.rng.choice(self.book_ids),
+            "member_id": self.rng.choice(self.member_ids),
+        })
+        if response is not None and response.status_code == 200:
+            self.open_loans.append(response.json()["id"])
+
+    async def return_loan(self):
+        if not self.open_loans:
+            await self.checkout()
+            return
+        loan_id = self.open_loans.pop(self.rng.randrange(len(self.open_loans)))
+        await self.call("POST /api/transactions/{id}/return", "POST", f"/api/transactions/{loan_id}/return")
+
+    async def worker(self, weights: dict, deadline: float):
+        names = list(weights)
+        weight_values = list(weights.values())
+        while time.perf_counter() < deadline:
+            name = self.rng.choices(names, weight_values)[0]
+            await getattr(self, OPERATIONS[name])()
+
+    async def run(self, weights: dict, concurrency: int, duration: float) -> float:
+        start = time.perf_counter()
+        await asyncio.gather(*[self.worker(weights, start + duration) for _ in range(concurrency)])
+        return time.perf_counter() - start
+
+    def summary(self, elapsed: float) -> dict:
+        routes = {}
+        for route, timings in sorted(self.timings.items()):
+            timings = sorted(timings)
+            routes[route] = {
+                "requests": len(timings),
+                "throughput_rps": len(timings) / elapsed,
+                "p50_ms": percentile(timings, 0.50) * 1000,
+                "p95_ms": percentile(timings, 0.95) * 1000,
+                "p99_ms": percentile(timings, 0.99) * 1000,
+                "mean_ms": statistics.mean(timings) * 1000,
+                "statuses": {str(status): count for status, count in sorted(self.statuses[route].items())},
+                "errors": self.errors.get(route, 0),
+            }
+        total = sum(route["requests"] for route in routes.values())
+        return {"total_requests": total, "throughput_rps": total / elapsed, "routes": routes}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(results: dict, baseline: dict = None):
+    print(f"{'route':<36} {'reqs':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses")
+    for route, stats in results["routes"].items():
+        line = (
+            f"{route:<36} {stats['requests']:>7} {stats['throughput_rps']:>8.1f} "
+            f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}  "
+            + " ".join(f"{status}:{count}" for status, count in stats["statuses"].items())
+        )
+        if stats["errors"]:
+            line += f" errors:{stats['errors']}"
+        print(line)
+        previous = (baseline or {}).get("routes", {}).get(route)
+        if previous:
+            print(
+                f"{'  vs baseline':<36} {'':>7} {stats['throughput_rps'] / previous['throughput_rps'] - 1:>+8.0%} "
+                f"{stats['p50_ms'] / previous['p50_ms'] - 1:>+8.0%} {stats['p95_ms'] / previous['p95_ms'] - 1:>+8.0%} "
+                f"{stats['p99_ms'] / previous['p99_ms'] - 1:>+8.0%}"
+            )
+    print(f"Total: {results['total_requests']} requests, {results['throughput_rps']:.1f} req/s")
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    weights = parse_mix(args.mix)
+
+    async with AsyncExitStack() as stack:
+        if args.url:
+            http = await stack.enter_async_context(httpx.AsyncClient(base_url=args.url, timeout=30))
+        else:
+            # The app runs in this process; keep its own background work quiet
+            os.environ.setdefault("CHANGE_STREAMS_ENABLED", "false")
+            os.environ["STORAGE_BACKEND"] = args.backend
+            if args.backend == "mongo":
+                load_dotenv(BACKEND_DIR / ".env")
+                os.environ["DB_NAME"] += "_loadtest"
+            import server
+
+            await server.db.drop_database()
+            stack.push_async_callback(server.db.drop_database)
+
+            logging.getLogger("server").setLevel(logging.WARNING)
+            await stack.enter_async_context(server.app.router.lifespan_context(server.app))
+            transport = httpx.ASGITransport(app=server.app)
+            http = await stack.enter_async_context(
+                httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=30)
+            )
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+
+        test = LoadTest(http, rng)
+        if args.url and not args.seed_url:
+            await test.load_ids()
+        else:
+            start = time.perf_counter()
+            await test.seed(args.books, args.members, args.concurrency)
+            print(f"Seeded {len(test.book_ids)} books and {len(test.member_ids)} members "
+                  f"in {time.perf_counter() - start:.1f} s")
+
+        if args.warmup:
+            await test.run(weights, args.concurrency, args.warmup)
+            test.timings, test.statuses, test.errors = {}, {}, {}
+
+        elapsed = await test.run(weights, args.concurrency, args.duration)
+
+    results = {
+        "revision": git_revision(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "config": {
+            "target": args.url or f"in-process ({args.backend})",
+            "concurrency": args.concurrency,
+            "duration_seconds": args.duration,
+            "mix": weights,
+            "books": len(test.book_ids),
+            "members": len(test.member_ids),
+            "seed": args.seed,
+        },
+        **test.summary(elapsed),
+    }
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    print_report(results, baseline)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--url", help="Base URL of a running server; default runs the app in-process")
+    parser.add_argument("--backend", choices=["mongo", "memory"], default="mongo",
+                        help="Storage for in-process runs: local mongod or the in-memory backend")
+    parser.add_argument("--seed-url", action="store_true",
+                        help="Also seed data when testing a running server (otherwise existing data is used)")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of measured load")
+    parser.add_argument("--warmup", type=float, default=2, help="Seconds of unmeasured load first")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--books", type=int, default=5000)
+    parser.add_argument("--members", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for data and request choice")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    asyncio.run(main(parser.parse_args()))
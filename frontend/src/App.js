@@ -5,6 +5,18 @@ import axios from "axios";
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Follow next_cursor until a paginated list endpoint is exhausted
+const fetchAllPages = async (url) => {
+  const items = [];
+  let cursor = null;
+  do {
+    const response = await axios.get(url, { params: { limit: 1000, cursor } });
+    items.push(...response.data.items);
+    cursor = response.data.next_cursor;
+  } while (cursor);
+  return items;
+};
+
 // Book Management Component
 const BookManager = ({ onBookAdded }) => {
   const [showForm, setShowForm] = useState(false);
@@ -240,7 +252,7 @@ const MemberManager = ({ onMemberAdded }) => {
 };
 
 // Borrowing Component
-const BorrowingManager = ({ books, members, onTransactionUpdate }) => {
+const BorrowingManager = ({ books, members, onTransactionUpdate, transactionsVersion }) => {
   const [selectedBook, setSelectedBook] = useState("");
   const [selectedMember, setSelectedMember] = useState("");
   const [transactions, setTransactions] = useState([]);
@@ -249,16 +261,17 @@ const BorrowingManager = ({ books, members, onTransactionUpdate }) => {
 
   const fetchTransactions = async () => {
     try {
-      const response = await axios.get(`${API}/transactions`);
-      setTransactions(response.data);
+      setTransactions(await fetchAllPages(`${API}/transactions`));
     } catch (error) {
       console.error("Error fetching transactions:", error);
     }
   };
 
+  // Refetch when another desk checks out or returns a book; unchanged pages
+  // come back as 304s thanks to the ETag headers
   useEffect(() => {
     fetchTransactions();
-  }, []);
+  }, [transactionsVersion]);
 
   const handleCheckout = async (e) => {
     e.preventDefault();
@@ -379,9 +392,9 @@ const BorrowingManager = ({ books, members, onTransactionUpdate }) => {
                 <tr key={transaction.id} className="border-b">
                   <td className="px-4 py-2">
                     <div className="flex items-center">
-                      {transaction.member.picture_base64 && (
+                      {transaction.member.picture_etag && (
                         <img
-                          src={transaction.member.picture_base64}
+                          src={`${API}/members/${transaction.member.id}/picture?size=thumb&v=${transaction.member.picture_etag}`}
                           alt={transaction.member.name}
                           className="w-8 h-8 rounded-full mr-2 object-cover"
                         />
@@ -466,16 +479,17 @@ function App() {
   const [books, setBooks] = useState([]);
   const [members, setMembers] = useState([]);
   const [stats, setStats] = useState({});
+  const [transactionsVersion, setTransactionsVersion] = useState(0);
 
   const fetchData = async () => {
     try {
-      const [booksRes, membersRes, statsRes] = await Promise.all([
-        axios.get(`${API}/books`),
-        axios.get(`${API}/members`),
+      const [booksList, membersList, statsRes] = await Promise.all([
+        fetchAllPages(`${API}/books`),
+        fetchAllPages(`${API}/members`),
         axios.get(`${API}/dashboard/stats`)
       ]);
-      setBooks(booksRes.data);
-      setMembers(membersRes.data);
+      setBooks(booksList);
+      setMembers(membersList);
       setStats(statsRes.data);
     } catch (error) {
       console.error("Error fetching data:", error);
@@ -486,6 +500,37 @@ function App() {
     fetchData();
   }, []);
 
+  // Live circulation updates pushed by the backend over Server-Sent Events
+  useEffect(() => {
+    const events = new EventSource(`${API}/events`);
+    events.addEventListener("stats", (e) => setStats(JSON.parse(e.data)));
+    events.addEventListener("book", (e) => {
+      const book = JSON.parse(e.data);
+      setBooks((current) => {
+        if (!current.some((b) => b.id === book.id)) {
+          fetchData();
+          return current;
+        }
+        return current.map((b) => (b.id === book.id ? { ...b, ...book } : b));
+      });
+    });
+    events.addEventListener("deleted", (e) => {
+      const { collection, id } = JSON.parse(e.data);
+      if (collection === "books") {
+        setBooks((current) => current.filter((b) => b.id !== id));
+      } else if (collection === "members") {
+        setMembers((current) => current.filter((m) => m.id !== id));
+      }
+    });
+    events.addEventListener("transaction", () => setTransactionsVersion((v) => v + 1));
+    // Sent when this client fell behind and missed events
+    events.addEventListener("resync", () => {
+      fetchData();
+      setTransactionsVersion((v) => v + 1);
+    });
+    return () => events.close();
+  }, []);
+
   return (
     <div className="min-h-screen bg-gray-100">
       {/* Header */}
@@ -545,6 +590,7 @@ function App() {
             books={books} 
             members={members} 
             onTransactionUpdate={fetchData} 
+            transactionsVersion={transactionsVersion}
           />
         )}
       </main>
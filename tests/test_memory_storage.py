@@ -0,0 +1,219 @@
+"""
+Tests for the in-memory storage backend: queries, index planning and
+unique indexes behave as they do on MongoDB for the calls server.py makes
+"""
+
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from memory_storage import MemoryStorage  # noqa: E402
+
+BOOKS = [
+    {"id": "b1", "title": "Dune", "genre": "Fiction", "total_copies": 3, "available_copies": 1, "tags": ["sf"]},
+    {"id": "b2", "title": "Emma", "genre": "Fiction", "total_copies": 2, "available_copies": 2},
+    {"id": "b3", "title": "Cosmos", "genre": "Science", "total_copies": 1, "available_copies": 0, "tags": ["space"]},
+    {"id": "b4", "title": "Dracula", "genre": "Horror", "total_copies": 4, "available_copies": 4, "isbn": None},
+]
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def seeded():
+    db = MemoryStorage("test")
+    await db.books.insert_many([dict(book) for book in BOOKS])
+    return db
+
+
+async def ids(cursor):
+    return [doc["id"] for doc in await cursor.to_list(None)]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ({"genre": "Fiction"}, ["b1", "b2"]),
+    ({"available_copies": {"$gt": 0, "$lt": 4}}, ["b1", "b2"]),
+    ({"id": {"$in": ["b3", "b4", "missing"]}}, ["b3", "b4"]),
+    ({"id": {"$nin": ["b1", "b2"]}}, ["b3", "b4"]),
+    ({"$or": [{"genre": "Science"}, {"available_copies": 4}]}, ["b3", "b4"]),
+    ({"$and": [{"genre": "Fiction"}, {"available_copies": {"$ne": 1}}]}, ["b2"]),
+    ({"title": {"$regex": "^d", "$options": "i"}}, ["b1", "b4"]),
+    ({"tags": {"$exists": True}}, ["b1", "b3"]),
+    ({"tags": {"$exists": False}}, ["b2", "b4"]),
+    ({"tags": "space"}, ["b3"]),
+    ({"isbn": None}, ["b1", "b2", "b3", "b4"]),
+    ({"$expr": {"$lt": ["$available_copies", "$total_copies"]}}, ["b1", "b3"]),
+])
+def test_query_operators(query, expected):
+    async def check():
+        db = await seeded()
+        assert await ids(db.books.find(query).sort("id", ASCENDING)) == expected
+        assert await db.books.count_documents(query) == len(expected)
+
+    run(check())
+
+
+def test_projection_sort_skip_and_limit():
+    async def check():
+        db = await seeded()
+        cursor = db.books.find({}, {"_id": 0, "id": 1, "title": 1}).sort(
+            [("genre", ASCENDING), ("title", DESCENDING)]
+        ).skip(1).limit(2)
+        assert await cursor.to_list(None) == [{"id": "b1", "title": "Dune"}, {"id": "b4", "title": "Dracula"}]
+
+    run(check())
+
+
+def test_index_plan_narrows_and_orders():
+    async def check():
+        db = await seeded()
+        await db.books.create_indexes([IndexModel([("genre", ASCENDING), ("title", ASCENDING)], name="genre_title")])
+
+        plan = db.books.plan({"genre": "Fiction"}, [("title", ASCENDING)])
+        assert plan.ordered and plan.estimate == 2
+        assert await ids(db.books.find({"genre": "Fiction"}).sort("title", DESCENDING)) == ["b2", "b1"]
+
+        # Sorting on a field the index does not lead with needs a sort after the scan
+        assert not db.books.plan({}, [("available_copies", ASCENDING)]).ordered
+        assert await ids(db.books.find({}).sort("available_copies", ASCENDING)) == ["b3", "b1", "b2", "b4"]
+
+    run(check())
+
+
+def test_index_follows_updates_and_deletes():
+    async def check():
+        db = await seeded()
+        await db.books.create_index("genre")
+        await db.books.update_one({"id": "b2"}, {"$set": {"genre": "Science"}})
+        await db.books.delete_one({"id": "b3"})
+        assert await ids(db.books.find({"genre": "Science"})) == ["b2"]
+        assert await ids(db.books.find({"genre": "Fiction"})) == ["b1"]
+
+    run(check())
+
+
+def test_unique_index_rejects_duplicates():
+    async def check():
+        db = await seeded()
+        await db.books.create_index("id", unique=True)
+        with pytest.raises(DuplicateKeyError):
+            await db.books.insert_one({"id": "b1"})
+        with pytest.raises(DuplicateKeyError):
+            await db.books.update_one({"id": "b2"}, {"$set": {"id": "b1"}})
+        assert await db.books.count_documents({"id": "b1"}) == 1
+
+        # An ordered insert_many stops at the first duplicate
+        with pytest.raises(BulkWriteError) as error:
+            await db.books.insert_many([{"id": "b5"}, {"id": "b5"}, {"id": "b6"}])
+        assert error.value.details["nInserted"] == 1
+        assert await db.books.count_documents({"id": {"$in": ["b5", "b6"]}}) == 1
+
+    run(check())
+
+
+def test_unique_index_over_existing_duplicates_fails():
+    async def check():
+        db = await seeded()
+        with pytest.raises(DuplicateKeyError):
+            await db.books.create_index("genre", unique=True)
+        assert "genre_1" not in await db.books.index_information()
+
+    run(check())
+
+
+def test_partial_unique_index_only_covers_matching_documents():
+    async def check():
+        db = MemoryStorage("test")
+        await db.holds.create_indexes([IndexModel(
+            [("book_id", ASCENDING), ("member_id", ASCENDING)], name="open_hold", unique=True,
+            partialFilterExpression={"status": "waiting"},
+        )])
+        await db.holds.insert_one({"book_id": "b1", "member_id": "m1", "status": "waiting"})
+        await db.holds.insert_one({"book_id": "b1", "member_id": "m1", "status": "cancelled"})
+        with pytest.raises(DuplicateKeyError):
+            await db.holds.insert_one({"book_id": "b1", "member_id": "m1", "status": "waiting"})
+
+        await db.holds.update_one({"status": "waiting"}, {"$set": {"status": "fulfilled"}})
+        await db.holds.insert_one({"book_id": "b1", "member_id": "m1", "status": "waiting"})
+        assert await db.holds.count_documents({}) == 3
+
+    run(check())
+
+
+def test_upsert_seeds_from_equality_filter():
+    async def check():
+        db = MemoryStorage("test")
+        result = await db.stats.update_one(
+            {"_id": "totals", "kind": "library"}, {"$inc": {"books": 2}, "$setOnInsert": {"created": True}}, upsert=True
+        )
+        assert result.upserted_id == "totals"
+        await db.stats.update_one({"_id": "totals"}, {"$inc": {"books": 1}, "$setOnInsert": {"created": False}}, upsert=True)
+        assert await db.stats.find_one({"_id": "totals"}) == {
+            "_id": "totals", "kind": "library", "books": 3, "created": True,
+        }
+
+    run(check())
+
+
+def test_find_one_and_update_is_conditional():
+    async def check():
+        db = await seeded()
+        before = await db.books.find_one_and_update(
+            {"id": "b1", "available_copies": {"$gt": 0}}, {"$inc": {"available_copies": -1}}, projection={"_id": 0}
+        )
+        assert before["available_copies"] == 1
+        # No copies left, so the guarded decrement matches nothing
+        assert await db.books.find_one_and_update(
+            {"id": "b1", "available_copies": {"$gt": 0}}, {"$inc": {"available_copies": -1}}
+        ) is None
+
+        after = await db.books.find_one_and_update(
+            {"genre": "Fiction"}, {"$set": {"checked": True}},
+            sort=[("available_copies", DESCENDING)], return_document=ReturnDocument.AFTER,
+        )
+        assert after["id"] == "b2" and after["checked"]
+
+    run(check())
+
+
+def test_returned_documents_are_copies():
+    async def check():
+        db = await seeded()
+        book = await db.books.find_one({"id": "b1"})
+        book["tags"].append("changed")
+        assert (await db.books.find_one({"id": "b1"}))["tags"] == ["sf"]
+
+    run(check())
+
+
+def test_ttl_index_expires_old_documents():
+    async def check():
+        db = MemoryStorage("test")
+        now = datetime.utcnow()
+        await db.tombstones.create_index("deleted_at", expireAfterSeconds=60)
+        await db.tombstones.insert_many([
+            {"id": "old", "deleted_at": now - timedelta(minutes=5)},
+            {"id": "new", "deleted_at": now},
+        ])
+        assert await ids(db.tombstones.find({})) == ["new"]
+
+    run(check())
+
+
+def test_capped_collection_keeps_newest():
+    async def check():
+        db = MemoryStorage("test")
+        log = await db.create_collection("log", capped=True, size=1 << 20, max=2)
+        for number in range(4):
+            await log.insert_one({"number": number})
+        assert [doc["number"] for doc in await log.find({}).to_list(None)] == [2, 3]
+
+    run(check())